@@ -1,17 +1,25 @@
+import asyncio
+import json
+import math
 import os
 from typing import List, Optional
 
-import httpx
 from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
-from core.voice_gateway.v1 import VoicePipeline
+from core.voice_gateway.v1 import LLMUnavailable, get_pipeline
 
 router = APIRouter(prefix="/voice/v1", tags=["voice"])
 
 # Инициализируем общий пайплайн (ASR/TTS/LLM-обёртка)
-pipeline = VoicePipeline()
+pipeline = get_pipeline()
+
+
+@router.on_event("shutdown")
+async def _close_http_client():
+    # httpx.AsyncClient (keep-alive к DeepSeek) живёт в llm-loop — закрывается там
+    await asyncio.to_thread(pipeline.close)
 
 
 # ---------- Модели ----------
@@ -23,6 +31,9 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
+    # прокси отвечает с temperature=0.7 — одинаковый запрос должен давать новый
+    # ответ, поэтому кэш ответов LLM здесь только по явной просьбе клиента
+    cache: bool = False
 
 
 # ---------- Настройки DeepSeek ----------
@@ -42,6 +53,9 @@ async def health():
         "ok": True,
         "model": DEEPSEEK_MODEL,
         "has_api_key": bool(DEEPSEEK_API_KEY),
+        "backend": pipeline.llm.backend.name,
+        # предохранитель / бюджет повторов / p95 / кэш клиента LLM
+        "llm": pipeline.llm.stats(),
     }
 
 
@@ -50,9 +64,10 @@ async def health():
 @router.post("/llm/chat")
 async def llm_chat(body: ChatRequest):
     """
-    Прокси к DeepSeek chat-completions.
-    Здесь мы НОРМАЛИЗУЕМ роли, чтобы не было ошибки:
-    messages[0].role: unknown variant `boss`
+    Прокси к DeepSeek chat-completions через общий LLM-клиент: лимитер RPM/TPM
+    с очередью, повторы, предохранитель. Роли нормализует backend, чтобы не было
+    ошибки: messages[0].role: unknown variant `boss`
+    Нет ответа от API — 429 (лимит, с Retry-After) / 502 / 503 / 504, а не 500.
     """
     if not DEEPSEEK_API_KEY:
         raise HTTPException(
@@ -60,49 +75,50 @@ async def llm_chat(body: ChatRequest):
             detail="DEEPSEEK_API_KEY не задан в переменных окружения",
         )
 
-    # Нормализуем роли: всё, что не system/user/assistant/tool → user
-    normalized_messages: List[dict] = []
-    for m in body.messages:
-        role = m.role
-        if role not in ("system", "user", "assistant", "tool"):
-            role = "user"
-        normalized_messages.append({"role": role, "content": m.content})
+    messages = [{"role": m.role, "content": m.content} for m in body.messages]
+    try:
+        content = await pipeline.llm.achat(messages, temperature=0.7, cache=body.cache, fallback=False)
+    except LLMUnavailable as e:
+        headers = None
+        if e.retry_after is not None:
+            headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        raise HTTPException(status_code=e.status, detail=f"LLM unavailable: {e}", headers=headers)
 
-    payload = {
-        "model": DEEPSEEK_MODEL,
-        "messages": normalized_messages,
-        "temperature": 0.7,
-    }
+    return {"output": content}
 
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(
-                DEEPSEEK_API_URL,
-                headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}"},
-                json=payload,
-            )
-    except Exception as e:
-        # Ошибка сети / DNS / таймаут и т.п.
-        raise HTTPException(status_code=500, detail=f"HTTP error: {e}")
-
-    if resp.status_code >= 300:
-        # Ошибка от самого DeepSeek (400, 401, 429 и т.д.)
-        raise HTTPException(
-            status_code=500,
-            detail=f"DeepSeek error {resp.status_code}: {resp.text}",
-        )
 
-    data = resp.json()
-    # Формат как у OpenAI-совместимого API
-    try:
-        content: Optional[str] = data["choices"][0]["message"]["content"]
-    except Exception as e:
+@router.post("/llm/stream")
+async def llm_stream(body: ChatRequest):
+    """
+    Потоковый ответ LLM (Server-Sent Events): куски текста уходят клиенту по
+    мере генерации, не дожидаясь полного ответа.
+      data: {"delta": "..."}   — очередной кусок
+      data: [DONE]             — конец
+    Закрытие соединения клиентом прерывает и запрос к DeepSeek.
+    """
+    if not DEEPSEEK_API_KEY:
         raise HTTPException(
             status_code=500,
-            detail=f"Unexpected DeepSeek response: {e} | raw={data}",
+            detail="DEEPSEEK_API_KEY не задан в переменных окружения",
         )
 
-    return {"output": content}
+    messages = [{"role": m.role, "content": m.content} for m in body.messages]
+
+    async def events():
+        async for chunk in pipeline.llm.astream(messages, cache=body.cache):
+            yield "data: " + json.dumps({"delta": chunk}, ensure_ascii=False) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/llm/cache")
+async def llm_cache_stats():
+    """Счётчики кэша ответов LLM (попадания / промахи / размер)."""
+    return {"ok": True, "cache": pipeline.llm.cache.stats()}
 
 
 # ---------- ASR (распознавание речи, stub) ----------
@@ -1,6 +1,7 @@
 
 # patch_v4 public interface
-from .http_client import http_get, http_post
+from .http_client import (http_get, http_post, get_client, get_async_client, aclose_async_client, close_client,
+                          get_session)
 from .env import get_env
 try:
     from .routes import router  # optional, if present
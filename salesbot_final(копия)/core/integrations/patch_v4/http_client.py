@@ -1,12 +1,28 @@
 
+import threading
+import weakref
 from typing import Any, Dict, Optional
 from .env import get_env
 
-# Prefer requests if available, else simple urllib fallback
+# Prefer httpx (HTTP/2 if h2 is installed), then requests.Session, else simple urllib fallback
+try:
+    import httpx  # type: ignore
+except Exception:
+    httpx = None
 try:
     import requests  # type: ignore
+    from requests.adapters import HTTPAdapter  # type: ignore
 except Exception:
     requests = None
+try:
+    from urllib3.util.retry import Retry  # type: ignore
+except Exception:
+    Retry = None
+try:
+    import h2  # type: ignore  # noqa: F401
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
 
 def _timeout():
     return get_env("HTTP_TIMEOUT", 15.0, float)
@@ -14,9 +30,137 @@ def _timeout():
 def _retries():
     return get_env("HTTP_RETRIES", 2, int)
 
-def http_get(url: str, params: Optional[Dict[str,Any]]=None, headers: Optional[Dict[str,str]]=None, timeout: Optional[float]=None):
-    t = timeout or _timeout()
+def _pool_size():
+    return max(1, get_env("HTTP_POOL_SIZE", 10, int))
+
+def _http2():
+    return _HTTP2 and get_env("HTTP_HTTP2", True, bool)
+
+def _backoff():
+    return get_env("HTTP_BACKOFF", 0.3, float)
+
+# ---- Общий keep-alive клиент на процесс (TCP/TLS не на каждый запрос) ----
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_client():
+    """
+    Общий синхронный клиент с пулом соединений: httpx.Client (HTTP/2, если
+    доступен h2) или requests.Session с HTTPAdapter. Не более HTTP_POOL_SIZE
+    соединений на хост. None — нет ни httpx, ни requests.
+    """
+    global _CLIENT
+    if _CLIENT is not None:
+        return _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            n = _pool_size()
+            if httpx is not None:
+                _CLIENT = httpx.Client(
+                    http2=_http2(),
+                    limits=httpx.Limits(max_connections=n, max_keepalive_connections=n),
+                    timeout=_timeout(),
+                )
+            elif requests is not None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=n, pool_maxsize=n, pool_block=True)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _CLIENT = s
+        return _CLIENT
+
+# ключ — сам объект event loop (не id(loop): id закрытого loop может достаться
+# новому, и тот получил бы чужой закрытый клиент); запись исчезает вместе с loop
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[Any, Any]" = weakref.WeakKeyDictionary()
+
+def get_async_client():
+    """
+    Общий httpx.AsyncClient для текущего event loop (создаётся один раз,
+    а не на каждый запрос). Закрывается через aclose_async_client().
+    """
+    import asyncio
+    if httpx is None:
+        raise RuntimeError("httpx не установлен (pip install httpx)")
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        n = _pool_size()
+        client = httpx.AsyncClient(
+            http2=_http2(),
+            limits=httpx.Limits(max_connections=n, max_keepalive_connections=n),
+            timeout=_timeout(),
+        )
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+# ---- Отдельная keep-alive сессия на каждый апстрим (Telegram Bot API, backend, ...) ----
+#
+# Свой пул и свои настройки повторов на апстрим: долгий getUpdates или медленный
+# backend не занимают соединения, нужные для sendMessage.
+
+_SESSIONS: Dict[str, Any] = {}
+
+def _upstream_pool(name: str, pool_size: Optional[int]) -> int:
+    # HTTP_POOL_SIZE_TELEGRAM=20 и т.п. перекрывает значение из кода
+    return max(1, get_env(f"HTTP_POOL_SIZE_{name.upper()}", pool_size or _pool_size(), int))
+
+def get_session(name: str, pool_size: Optional[int] = None, retries: Optional[int] = None):
+    """
+    requests.Session апстрима name (одна на процесс): до pool_size keep-alive
+    соединений, повторы — всего retries попыток (по умолч. HTTP_RETRIES) с паузой
+    HTTP_BACKOFF * 2^n. Сбой соединения повторяется для любого метода (запрос ещё
+    не ушёл); 502/503/504 и обрыв чтения — только для GET, чтобы POST
+    (sendMessage) не задвоился. 429 не повторяется — это решает вызывающий.
+    """
     if requests is None:
+        raise RuntimeError("requests не установлен (pip install requests)")
+    session = _SESSIONS.get(name)
+    if session is not None:
+        return session
+    with _CLIENT_LOCK:
+        session = _SESSIONS.get(name)
+        if session is None:
+            n = _upstream_pool(name, pool_size)
+            attempts = max(1, retries or _retries())
+            max_retries: Any = attempts - 1
+            if Retry is not None:
+                max_retries = Retry(
+                    total=attempts - 1,
+                    backoff_factor=_backoff(),
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"GET", "HEAD"}),
+                    raise_on_status=False,
+                )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n, max_retries=max_retries)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSIONS[name] = session
+        return session
+
+async def aclose_async_client():
+    """Закрыть общий AsyncClient текущего event loop."""
+    import asyncio
+    client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def close_client():
+    global _CLIENT
+    with _CLIENT_LOCK:
+        client, _CLIENT = _CLIENT, None
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for c in [client] + sessions:
+        if c is not None:
+            c.close()
+
+def http_get(url: str, params: Optional[Dict[str,Any]]=None, headers: Optional[Dict[str,str]]=None, timeout: Optional[float]=None, retries: Optional[int]=None):
+    """retries — число попыток (по умолч. HTTP_RETRIES); 1 — без повторов, если их делает вызывающий."""
+    t = timeout or _timeout()
+    client = get_client()
+    if client is None:
         # minimal urllib fallback
         from urllib.request import urlopen, Request
         import json as _json
@@ -30,9 +174,9 @@ def http_get(url: str, params: Optional[Dict[str,Any]]=None, headers: Optional[D
             except Exception:
                 return {"raw": data}
     last_err = None
-    for _ in range(max(1, _retries())):
+    for _ in range(max(1, retries or _retries())):
         try:
-            resp = requests.get(url, params=params or {}, headers=headers or {}, timeout=t)
+            resp = client.get(url, params=params or {}, headers=headers or {}, timeout=t)
             resp.raise_for_status()
             ct = (resp.headers.get("content-type") or "").lower()
             if "application/json" in ct:
@@ -42,9 +186,11 @@ def http_get(url: str, params: Optional[Dict[str,Any]]=None, headers: Optional[D
             last_err = str(e)
     raise RuntimeError(last_err or "GET failed")
 
-def http_post(url: str, json: Optional[Dict[str,Any]]=None, data: Optional[Dict[str,Any]]=None, headers: Optional[Dict[str,str]]=None, timeout: Optional[float]=None):
+def http_post(url: str, json: Optional[Dict[str,Any]]=None, data: Optional[Dict[str,Any]]=None, headers: Optional[Dict[str,str]]=None, timeout: Optional[float]=None, retries: Optional[int]=None):
+    """retries — число попыток (по умолч. HTTP_RETRIES); 1 — без повторов, если их делает вызывающий."""
     t = timeout or _timeout()
-    if requests is None:
+    client = get_client()
+    if client is None:
         # minimal urllib fallback
         from urllib.request import urlopen, Request
         import json as _json
@@ -60,9 +206,9 @@ def http_post(url: str, json: Optional[Dict[str,Any]]=None, data: Optional[Dict[
             except Exception:
                 return {"raw": data}
     last_err = None
-    for _ in range(max(1, _retries())):
+    for _ in range(max(1, retries or _retries())):
         try:
-            resp = requests.post(url, json=json, data=data, headers=headers or {}, timeout=t)
+            resp = client.post(url, json=json, data=data, headers=headers or {}, timeout=t)
             resp.raise_for_status()
             ct = (resp.headers.get("content-type") or "").lower()
             if "application/json" in ct:
@@ -1,2 +1,12 @@
-from .store import StateStore
-__all__=['StateStore']
+from .store import StateStore, get_store, close_stores, on_startup, on_shutdown
+from .async_store import AsyncStateStore, get_async_store, close_async_stores
+from .backends import StateBackend, MemoryStateStore, ShardedStateStore, make_store
+from .cache import SessionCache, get_cache, flush_caches, close_caches
+from .session import Session, evict_on_error
+from .turns import TurnLog, turn_count
+from .ttl import Sweeper, start_sweeper, stop_sweepers
+__all__=['StateStore','get_store','close_stores','on_startup','on_shutdown',
+         'AsyncStateStore','get_async_store','close_async_stores',
+         'StateBackend','MemoryStateStore','ShardedStateStore','make_store',
+         'SessionCache','get_cache','flush_caches','close_caches','Session','evict_on_error','TurnLog','turn_count',
+         'Sweeper','start_sweeper','stop_sweepers']
@@ -0,0 +1,401 @@
+import asyncio, os, sqlite3, time
+from typing import AsyncIterator, Dict, Iterable, List, Mapping, Tuple, Optional, Union
+
+try:
+    import aiosqlite  # type: ignore
+except Exception:
+    aiosqlite = None  # type: ignore
+
+from .store import (_IN_CHUNK, _SCHEMA, DEFAULT_PATH, SessionRecord, StateStore, _pool_size,
+                    _range_sql, _session_ns, _store_key, get_store, init_db)
+from .turns import turn_item, turn_row
+
+def _init_file(path: str) -> None:
+    # DDL и миграции — тем же кодом, что у StateStore (в пуле потоков)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        init_db(conn)
+    finally:
+        conn.close()
+
+class AsyncStateStore:
+    """
+    Асинхронный аналог StateStore поверх aiosqlite для async-роутов FastAPI.
+    Тот же интерфейс (get/set/delete/*_many/scan), но ожидание busy и сам SQLite-вызов
+    не блокируют event loop. Писатель один (asyncio.Lock), читатели — пул.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, readers: Optional[int] = None):
+        if aiosqlite is None:
+            raise RuntimeError("aiosqlite не установлен (pip install aiosqlite)")
+        self.path = path
+        self._max_readers = readers or _pool_size()
+        self._writer = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._readers: Optional[asyncio.LifoQueue] = None
+        self._readers_open = 0
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def _shared_only(self) -> bool:
+        return self.path == ":memory:" or self.path.startswith("file::memory:")
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await conn.execute("PRAGMA journal_mode=WAL;")
+        await conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
+
+    async def _ensure(self):
+        if self._writer is not None:
+            return
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+            self._readers = asyncio.LifoQueue()
+        async with self._write_lock:
+            if self._writer is not None:
+                return
+            if not self._shared_only:
+                await asyncio.get_running_loop().run_in_executor(None, _init_file, self.path)
+            conn = await self._connect()
+            if self._shared_only:
+                for stmt in _SCHEMA.strip().split(';'):
+                    s = stmt.strip()
+                    if s:
+                        await conn.execute(s)
+            self._writer = conn
+
+    async def _acquire_reader(self):
+        if self._shared_only:
+            await self._write_lock.acquire()
+            return self._writer
+        try:
+            return self._readers.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        if self._readers_open < self._max_readers:
+            self._readers_open += 1
+            try:
+                return await self._connect()
+            except Exception:
+                self._readers_open -= 1
+                raise
+        return await self._readers.get()
+
+    async def _release_reader(self, conn):
+        if self._shared_only:
+            self._write_lock.release()
+            return
+        if self._closed:
+            await conn.close()
+            return
+        self._readers.put_nowait(conn)
+
+    async def _exec(self, sql: str, args: tuple=()) -> int:
+        await self._ensure()
+        backoff = 0.01
+        for _ in range(5):
+            try:
+                async with self._write_lock:
+                    cur = await self._writer.execute(sql, args)
+                    n = cur.rowcount or 0
+                    await cur.close()
+                    return n
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+        raise RuntimeError("SQLite busy, retries exceeded")
+
+    async def _query(self, sql: str, args: tuple=()) -> list:
+        await self._ensure()
+        backoff = 0.01
+        for _ in range(5):
+            conn = await self._acquire_reader()
+            try:
+                cur = await conn.execute(sql, args)
+                rows = await cur.fetchall()
+                await cur.close()
+                return list(rows)
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+            finally:
+                await self._release_reader(conn)
+        raise RuntimeError("SQLite busy, retries exceeded")
+
+    async def get(self, key: str) -> Optional[str]:
+        rows = await self._query("SELECT value FROM kv WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    async def set(self, key: str, value: str) -> None:
+        ts = time.time()
+        await self._exec("REPLACE INTO kv(key, value, ts) VALUES(?,?,?)", (key, value, ts))
+
+    async def delete(self, key: str) -> int:
+        return await self._exec("DELETE FROM kv WHERE key = ?", (key,))
+
+    async def _run_tx(self, steps: list) -> int:
+        """
+        Шаги (sql, args, many) одной явной транзакцией; возвращает rowcount
+        последнего шага.
+        """
+        await self._ensure()
+        backoff = 0.01
+        for _ in range(5):
+            try:
+                async with self._write_lock:
+                    await self._writer.execute("BEGIN IMMEDIATE")
+                    try:
+                        n = 0
+                        for sql, args, many in steps:
+                            if many:
+                                cur = await self._writer.executemany(sql, args)
+                            else:
+                                cur = await self._writer.execute(sql, args)
+                            n = cur.rowcount or 0
+                            await cur.close()
+                    except BaseException:
+                        await self._writer.rollback()
+                        raise
+                    await self._writer.commit()
+                    return n
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+        raise RuntimeError("SQLite busy, retries exceeded")
+
+    async def _exec_many(self, sql: str, rows: list) -> int:
+        return await self._run_tx([(sql, rows, True)])
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(dict.fromkeys(keys))
+        out: Dict[str, str] = {}
+        for i in range(0, len(keys), _IN_CHUNK):
+            chunk = keys[i:i + _IN_CHUNK]
+            q = "SELECT key, value FROM kv WHERE key IN (%s)" % ",".join("?" * len(chunk))
+            out.update(await self._query(q, tuple(chunk)))
+        return out
+
+    async def set_many(self, items: Union[Mapping[str, str], Iterable[Tuple[str, str]]]) -> int:
+        pairs = items.items() if isinstance(items, Mapping) else items
+        ts = time.time()
+        rows = [(k, v, ts) for k, v in pairs]
+        if not rows:
+            return 0
+        await self._exec_many("REPLACE INTO kv(key, value, ts) VALUES(?,?,?)", rows)
+        return len(rows)
+
+    async def delete_many(self, keys: Iterable[str]) -> int:
+        rows = [(k,) for k in dict.fromkeys(keys)]
+        if not rows:
+            return 0
+        return await self._exec_many("DELETE FROM kv WHERE key = ?", rows)
+
+    async def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str,str]]:
+        cond, args = _range_sql(prefix, after)
+        rows = await self._query(f"SELECT key, value FROM kv WHERE {cond} ORDER BY key LIMIT ?", args + (limit,))
+        return [(k,v) for k,v in rows]
+
+    async def iter_scan(self, prefix: str, page_size: int = 500) -> AsyncIterator[Tuple[str,str]]:
+        """Async-аналог StateStore.iter_scan (keyset-пагинация страницами)."""
+        after: Optional[str] = None
+        while True:
+            cond, args = _range_sql(prefix, after)
+            rows = await self._query(f"SELECT key, value FROM kv WHERE {cond} ORDER BY key LIMIT ?", args + (page_size,))
+            for k, v in rows:
+                yield k, v
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    # ---- сессии движков (см. StateStore.load_session / save_sessions) ----
+
+    async def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]:
+        """
+        Заголовок и ходы — одним соединением в одной read-транзакции (как
+        StateStore.load_session): между двумя SELECT не вклинится save_sessions.
+        """
+        await self._ensure()
+        backoff = 0.01
+        for _ in range(5):
+            conn = await self._acquire_reader()
+            try:
+                await conn.execute("BEGIN")
+                try:
+                    cur = await conn.execute("SELECT state, turns FROM sessions WHERE id = ?", (sid,))
+                    row = await cur.fetchone()
+                    await cur.close()
+                    if row is None:
+                        return None
+                    header, total = row
+                    base = max(0, total - last_n)
+                    cur = await conn.execute(
+                        "SELECT role, content, extra FROM turns WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                        (sid, base, total))
+                    turns = await cur.fetchall()
+                    await cur.close()
+                finally:
+                    await conn.commit()
+                return header, [turn_item(*r) for r in turns], base, total
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+            finally:
+                await self._release_reader(conn)
+        raise RuntimeError("SQLite busy, retries exceeded")
+
+    async def load_header(self, sid: str) -> Optional[str]:
+        rows = await self._query("SELECT state FROM sessions WHERE id = ?", (sid,))
+        return rows[0][0] if rows else None
+
+    async def save_session(self, sid: str, header: str, start: int, items: list) -> None:
+        await self.save_sessions([(sid, header, start, items)])
+
+    async def save_sessions(self, records: Iterable[SessionRecord]) -> int:
+        ts = time.time()
+        steps = []
+        n = 0
+        for sid, header, start, items in records:
+            steps.append(("DELETE FROM turns WHERE session_id = ? AND seq >= ?", (sid, start), False))
+            if items:
+                steps.append(("INSERT INTO turns(session_id, seq, role, content, extra, ts) VALUES(?,?,?,?,?,?)",
+                              [turn_row(sid, start + i, it, ts) for i, it in enumerate(items)], True))
+            steps.append(("REPLACE INTO sessions(id, ns, state, turns, ts) VALUES(?,?,?,?,?)",
+                          (sid, _session_ns(sid), header, start + len(items), ts), False))
+            n += 1
+        if steps:
+            await self._run_tx(steps)
+        return n
+
+    async def close(self):
+        self._closed = True
+        if self._readers is not None:
+            while True:
+                try:
+                    conn = self._readers.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        if self._writer is not None:
+            try:
+                await self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+
+
+class ThreadedAsyncStore:
+    """
+    Async-обёртка над синхронным бэкендом (memory / sharded, см. backends.py):
+    вызовы уходят в пул потоков, in-memory — выполняются сразу.
+    """
+
+    def __init__(self, backend):
+        self.path = backend.path
+        self._backend = backend
+        self._inline = not hasattr(backend, "shards") and not isinstance(backend, StateStore)
+
+    @property
+    def closed(self) -> bool:
+        return self._backend.closed
+
+    async def _call(self, name: str, *args):
+        fn = getattr(self._backend, name)
+        if self._inline:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: fn(*args))
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._call("get", key)
+
+    async def set(self, key: str, value: str) -> None:
+        await self._call("set", key, value)
+
+    async def delete(self, key: str) -> int:
+        return await self._call("delete", key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        return await self._call("get_many", list(keys))
+
+    async def set_many(self, items) -> int:
+        return await self._call("set_many", items)
+
+    async def delete_many(self, keys: Iterable[str]) -> int:
+        return await self._call("delete_many", list(keys))
+
+    async def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str,str]]:
+        return await self._call("scan", prefix, limit, after)
+
+    async def iter_scan(self, prefix: str, page_size: int = 500) -> AsyncIterator[Tuple[str,str]]:
+        """Страницами по page_size (keyset: after = последний ключ), как StateStore.iter_scan"""
+        after: Optional[str] = None
+        while True:
+            rows = await self._call("scan", prefix, page_size, after)
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    async def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]:
+        return await self._call("load_session", sid, last_n)
+
+    async def load_header(self, sid: str) -> Optional[str]:
+        return await self._call("load_header", sid)
+
+    async def save_session(self, sid: str, header: str, start: int, items: list) -> None:
+        await self._call("save_session", sid, header, start, items)
+
+    async def save_sessions(self, records: Iterable[SessionRecord]) -> int:
+        return await self._call("save_sessions", list(records))
+
+    async def close(self):
+        # сам бэкенд закрывает close_stores()
+        pass
+
+
+# ---- Реестр общих async-хранилищ ----
+
+_ASYNC_STORES: Dict[str, "AsyncStateStore"] = {}
+
+def get_async_store(path: str = DEFAULT_PATH) -> "AsyncStateStore":
+    """
+    Общий async-доступ к хранилищу path: AsyncStateStore (aiosqlite) для
+    обычного SQLite-бэкенда, иначе ThreadedAsyncStore поверх get_store(path).
+    """
+    key = _store_key(path)
+    store = _ASYNC_STORES.get(key)
+    if store is None or store.closed:
+        backend = get_store(path)
+        if type(backend) is StateStore:
+            store = AsyncStateStore(path)
+        else:
+            store = ThreadedAsyncStore(backend)
+        _ASYNC_STORES[key] = store
+    return store
+
+async def close_async_stores() -> None:
+    """Закрыть все async-хранилища (вызывается на shutdown приложения)."""
+    stores = list(_ASYNC_STORES.values())
+    _ASYNC_STORES.clear()
+    for s in stores:
+        await s.close()
@@ -0,0 +1,358 @@
+import heapq, os, sqlite3, threading, time, zlib
+from contextlib import ExitStack, contextmanager
+from typing import (Any, Dict, Iterable, Iterator, List, Mapping, Optional, Protocol,
+                    Tuple, Union, runtime_checkable)
+
+from .store import DEFAULT_PATH, SessionRecord, StateStore, _session_ns, init_db
+
+Items = Union[Mapping[str, str], Iterable[Tuple[str, str]]]
+
+@runtime_checkable
+class StateBackend(Protocol):
+    """
+    Интерфейс хранилища состояния. Его реализуют StateStore (один файл SQLite),
+    MemoryStateStore (dict, для тестов/бенчмарков) и ShardedStateStore
+    (N файлов SQLite, ключ -> шард по crc32 ключа сессии).
+    """
+
+    path: str
+
+    @property
+    def closed(self) -> bool: ...
+    def get(self, key: str) -> Optional[str]: ...
+    def set(self, key: str, value: str) -> None: ...
+    def delete(self, key: str) -> int: ...
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]: ...
+    def set_many(self, items: Items) -> int: ...
+    def delete_many(self, keys: Iterable[str]) -> int: ...
+    def transaction(self): ...
+    def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str, str]]: ...
+    def iter_scan(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]: ...
+    def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]: ...
+    def load_header(self, sid: str) -> Optional[Any]: ...
+    def save_session(self, sid: str, header: str, start: int, items: list) -> None: ...
+    def save_sessions(self, records: Iterable[SessionRecord]) -> int: ...
+    def get_turns(self, sid: str, limit: int = 50, before: Optional[int] = None) -> List[Tuple[int, Any]]: ...
+    def delete_session(self, sid: str) -> int: ...
+    def iter_sessions(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]: ...
+    def expire_sessions(self, ns: str, before: float, limit: int = 500, keep=()) -> int: ...
+    def expire_keys(self, prefix: str, before: float, limit: int = 500) -> int: ...
+    def checkpoint(self, vacuum_pages: int = 1000) -> Tuple[int, int]: ...
+    def close(self) -> None: ...
+
+
+class MemoryStateStore:
+    """Хранилище в памяти процесса: тот же интерфейс, что у StateStore, без I/O."""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._kv: Dict[str, Tuple[str, float]] = {}
+        self._sessions: Dict[str, list] = {}          # id -> [ns, header, turns, ts]
+        self._turns: Dict[str, Dict[int, Any]] = {}   # id -> {seq: item}
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @contextmanager
+    def transaction(self):
+        # без отката: только взаимное исключение на время блока
+        with self._lock:
+            yield self
+
+    def get(self, key: str) -> Optional[str]:
+        v = self._kv.get(key)
+        return v[0] if v else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._kv[key] = (value, time.time())
+
+    def delete(self, key: str) -> int:
+        with self._lock:
+            return 1 if self._kv.pop(key, None) is not None else 0
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        with self._lock:
+            return {k: self._kv[k][0] for k in keys if k in self._kv}
+
+    def set_many(self, items: Items) -> int:
+        pairs = list(items.items() if isinstance(items, Mapping) else items)
+        ts = time.time()
+        with self._lock:
+            for k, v in pairs:
+                self._kv[k] = (v, ts)
+        return len(pairs)
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        with self._lock:
+            return sum(1 for k in set(keys) if self._kv.pop(k, None) is not None)
+
+    def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str, str]]:
+        rows = self._iter(self._kv, prefix, lambda v: v[0])
+        if after is not None:
+            rows = (r for r in rows if r[0] > after)
+        return [r for _, r in zip(range(limit), rows)]
+
+    def iter_scan(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]:
+        return self._iter(self._kv, prefix, lambda v: v[0])
+
+    def _iter(self, d: dict, prefix: str, val) -> Iterator[Tuple[str, str]]:
+        with self._lock:
+            rows = [(k, val(v)) for k, v in d.items() if k.startswith(prefix)]
+        rows.sort()
+        return iter(rows)
+
+    def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]:
+        with self._lock:
+            row = self._sessions.get(sid)
+            if row is None:
+                return None
+            total = row[2]
+            base = max(0, total - last_n)
+            turns = self._turns.get(sid, {})
+            return row[1], [turns[i] for i in range(base, total) if i in turns], base, total
+
+    def load_header(self, sid: str) -> Optional[Any]:
+        row = self._sessions.get(sid)
+        return row[1] if row else None
+
+    def save_session(self, sid: str, header: str, start: int, items: list) -> None:
+        self.save_sessions([(sid, header, start, items)])
+
+    def save_sessions(self, records: Iterable[SessionRecord]) -> int:
+        ts = time.time()
+        n = 0
+        with self._lock:
+            for sid, header, start, items in records:
+                turns = self._turns.setdefault(sid, {})
+                for seq in [s for s in turns if s >= start]:
+                    del turns[seq]
+                for i, it in enumerate(items):
+                    turns[start + i] = it
+                self._sessions[sid] = [_session_ns(sid), header, start + len(items), ts]
+                n += 1
+        return n
+
+    def get_turns(self, sid: str, limit: int = 50, before: Optional[int] = None) -> List[Tuple[int, Any]]:
+        with self._lock:
+            turns = self._turns.get(sid, {})
+            seqs = sorted((s for s in turns if before is None or s < before), reverse=True)[:limit]
+            return [(s, turns[s]) for s in seqs]
+
+    def delete_session(self, sid: str) -> int:
+        with self._lock:
+            self._turns.pop(sid, None)
+            return 1 if self._sessions.pop(sid, None) is not None else 0
+
+    def iter_sessions(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]:
+        return self._iter(self._sessions, prefix, lambda v: v[1])
+
+    def expire_sessions(self, ns: str, before: float, limit: int = 500, keep=()) -> int:
+        with self._lock:
+            ids = [sid for sid, row in self._sessions.items()
+                   if row[0] == ns and row[3] < before and sid not in keep][:limit]
+            for sid in ids:
+                self.delete_session(sid)
+            return len(ids)
+
+    def expire_keys(self, prefix: str, before: float, limit: int = 500) -> int:
+        with self._lock:
+            keys = [k for k, (_, ts) in self._kv.items() if k.startswith(prefix) and ts < before][:limit]
+            for k in keys:
+                del self._kv[k]
+            return len(keys)
+
+    def checkpoint(self, vacuum_pages: int = 1000) -> Tuple[int, int]:
+        return 0, 0
+
+    def close(self) -> None:
+        self._closed = True
+
+
+def shard_paths(path: str, shards: int) -> List[str]:
+    """salesbot.db -> salesbot.0.db ... salesbot.{N-1}.db"""
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}{ext or '.db'}" for i in range(shards)]
+
+def shard_key(key: str) -> str:
+    # ключи вида "ns:sid:..." шардируются по "ns:sid" — служебные ключи сессии
+    # оказываются в том же файле, что и сама сессия
+    parts = key.split(":", 2)
+    return ":".join(parts[:2])
+
+class ShardedStateStore:
+    """
+    N независимых StateStore (свой файл, WAL и писатель у каждого); ключ попадает
+    в шард по crc32(shard_key(key)) % N. Записи разных сессий не ждут общую
+    блокировку писателя. scan/iter_* сливают упорядоченные потоки шардов.
+    transaction() открывает транзакции на всех шардах (атомарности между
+    файлами нет — коммиты идут по очереди).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, shards: int = 4):
+        self.path = path
+        self.shards = [StateStore(p) for p in shard_paths(path, shards)]
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _shard(self, key: str) -> StateStore:
+        return self.shards[zlib.crc32(shard_key(key).encode("utf-8")) % len(self.shards)]
+
+    def _group(self, keys: Iterable[str]) -> Dict[int, list]:
+        groups: Dict[int, list] = {}
+        for k in keys:
+            groups.setdefault(id(self._shard(k)), []).append(k)
+        return groups
+
+    def _by_id(self, sid: int) -> StateStore:
+        return next(s for s in self.shards if id(s) == sid)
+
+    @contextmanager
+    def transaction(self):
+        with ExitStack() as stack:
+            for s in self.shards:
+                stack.enter_context(s.transaction())
+            yield self
+
+    def get(self, key: str) -> Optional[str]:
+        return self._shard(key).get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self._shard(key).set(key, value)
+
+    def delete(self, key: str) -> int:
+        return self._shard(key).delete(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        for sid, ks in self._group(keys).items():
+            out.update(self._by_id(sid).get_many(ks))
+        return out
+
+    def set_many(self, items: Items) -> int:
+        pairs = items.items() if isinstance(items, Mapping) else items
+        groups: Dict[int, list] = {}
+        for k, v in pairs:
+            groups.setdefault(id(self._shard(k)), []).append((k, v))
+        return sum(self._by_id(sid).set_many(rows) for sid, rows in groups.items())
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        return sum(self._by_id(sid).delete_many(ks) for sid, ks in self._group(keys).items())
+
+    def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str, str]]:
+        rows = heapq.merge(*(s.scan(prefix, limit, after) for s in self.shards))
+        return [r for _, r in zip(range(limit), rows)]
+
+    def iter_scan(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]:
+        return heapq.merge(*(s.iter_scan(prefix, page_size) for s in self.shards))
+
+    def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]:
+        return self._shard(sid).load_session(sid, last_n)
+
+    def load_header(self, sid: str) -> Optional[Any]:
+        return self._shard(sid).load_header(sid)
+
+    def save_session(self, sid: str, header: str, start: int, items: list) -> None:
+        self._shard(sid).save_session(sid, header, start, items)
+
+    def save_sessions(self, records: Iterable[SessionRecord]) -> int:
+        groups: Dict[int, list] = {}
+        for rec in records:
+            groups.setdefault(id(self._shard(rec[0])), []).append(rec)
+        return sum(self._by_id(sid).save_sessions(recs) for sid, recs in groups.items())
+
+    def get_turns(self, sid: str, limit: int = 50, before: Optional[int] = None) -> List[Tuple[int, Any]]:
+        return self._shard(sid).get_turns(sid, limit, before)
+
+    def delete_session(self, sid: str) -> int:
+        return self._shard(sid).delete_session(sid)
+
+    def iter_sessions(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]:
+        return heapq.merge(*(s.iter_sessions(prefix, page_size) for s in self.shards))
+
+    def expire_sessions(self, ns: str, before: float, limit: int = 500, keep=()) -> int:
+        return sum(s.expire_sessions(ns, before, limit, keep) for s in self.shards)
+
+    def expire_keys(self, prefix: str, before: float, limit: int = 500) -> int:
+        return sum(s.expire_keys(prefix, before, limit) for s in self.shards)
+
+    def checkpoint(self, vacuum_pages: int = 1000) -> Tuple[int, int]:
+        res = [s.checkpoint(vacuum_pages) for s in self.shards]
+        return max(r[0] for r in res), sum(r[1] for r in res)
+
+    def close(self) -> None:
+        self._closed = True
+        for s in self.shards:
+            s.close()
+
+
+def _shards() -> int:
+    try:
+        return max(1, int(os.environ.get("STATE_SHARDS", "4")))
+    except ValueError:
+        return 4
+
+def migrate_to_shards(path: str, store: ShardedStateStore) -> int:
+    """
+    Одноразовый перенос sessions/turns/kv из нешардированного файла path в шарды
+    store (перед этим init_db — те же миграции core/db, что у StateStore).
+    Сам файл остаётся: в нём же живут очереди telegram (tg_updates, tg_outbox);
+    перенесённые строки из него удаляются в той же транзакции BEGIN IMMEDIATE,
+    так что второй процесс, стартующий параллельно, найдёт файл уже пустым.
+    Возвращает число перенесённых сессий и ключей kv.
+    """
+    if path == ":memory:" or not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    try:
+        init_db(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            sessions = conn.execute("SELECT id, ns, state, turns, ts FROM sessions").fetchall()
+            turns = conn.execute("SELECT session_id, seq, role, content, extra, ts FROM turns").fetchall()
+            kv = conn.execute("SELECT key, value, ts FROM kv").fetchall()
+            if sessions or turns or kv:
+                for shard in store.shards:
+                    own = lambda rows: [r for r in rows if store._shard(r[0]) is shard]
+                    with shard.transaction():
+                        shard._conn.executemany(
+                            "REPLACE INTO sessions(id, ns, state, turns, ts) VALUES(?,?,?,?,?)", own(sessions))
+                        shard._conn.executemany(
+                            "REPLACE INTO turns(session_id, seq, role, content, extra, ts) VALUES(?,?,?,?,?,?)",
+                            own(turns))
+                        shard._conn.executemany("REPLACE INTO kv(key, value, ts) VALUES(?,?,?)", own(kv))
+                # шарды уже закоммичены: падение до этой строки — повторный (идемпотентный) перенос
+                conn.execute("DELETE FROM turns")
+                conn.execute("DELETE FROM sessions")
+                conn.execute("DELETE FROM kv")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    if sessions or kv:
+        print(f"[state] {path} -> {len(store.shards)} шардов: "
+              f"перенесено сессий {len(sessions)}, ключей kv {len(kv)}")
+    return len(sessions) + len(kv)
+
+def make_store(path: str = DEFAULT_PATH) -> StateBackend:
+    """
+    Бэкенд по STATE_BACKEND: sqlite (по умолчанию) | memory | sharded
+    (число файлов — STATE_SHARDS, по умолч. 4). При sharded данные, оставшиеся
+    в нешардированном path, при старте переносятся в шарды (migrate_to_shards).
+    """
+    kind = os.environ.get("STATE_BACKEND", "sqlite").lower()
+    if kind == "memory":
+        return MemoryStateStore(path)
+    if kind == "sharded" and path != ":memory:":
+        store = ShardedStateStore(path, _shards())
+        migrate_to_shards(path, store)
+        return store
+    return StateStore(path)
@@ -0,0 +1,205 @@
+import atexit, os, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .store import DEFAULT_PATH, _store_key, get_store
+from .turns import commit_state, snapshot_state
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class _Entry:
+    __slots__ = ("state", "dirty", "version", "snap")
+
+    def __init__(self, state: Any, dirty: bool, snap: Optional[Tuple[str, int, list]] = None):
+        self.state = state
+        self.dirty = dirty
+        self.version = 1 if dirty else 0
+        self.snap = snap  # (заголовок, start, ходы) на момент последнего put(dirty=True)
+
+class SessionCache:
+    """
+    Write-behind кэш живых объектов состояния сессий (LRU).
+
+    put(..., dirty=True) снимает снимок состояния и помечает запись грязной;
+    фоновый поток раз в max_staleness секунд записывает в StateStore последний
+    снимок каждой грязной сессии — несколько save() за это время превращаются
+    в одну запись (заголовок + только новые ходы истории, см. turns.py).
+    Вытесненные грязные записи дописываются тем же потоком, а не в запросе.
+    Синхронный flush() вызывается на shutdown (и через atexit).
+
+    get() отдаёт живой объект: если обработчик упал, изменив его, — discard(key)
+    (см. session.evict_on_error), в БД уйдёт последний сохранённый снимок.
+
+    Кэш живёт в памяти процесса, поэтому выключен по умолчанию: включайте
+    (STATE_CACHE=1), только если этот процесс — единственный писатель БД
+    (один воркер uvicorn, боты aiogram не пишут в тот же файл).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, capacity: Optional[int] = None,
+                 max_staleness: Optional[float] = None,
+                 snapshot: Callable[[Any], Tuple[str, int, list]] = snapshot_state):
+        self.path = path
+        self.capacity = capacity or int(_env_float("STATE_CACHE_SIZE", 1024))
+        self.max_staleness = max_staleness if max_staleness is not None else _env_float("STATE_MAX_STALENESS", 2.0)
+        self._snapshot = snapshot
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._evicted: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "coalesced": 0}
+
+    # ---- чтение / запись ----
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = self._evicted.pop(key, None)
+                if e is not None:
+                    self._entries[key] = e
+            if e is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return e.state
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries or key in self._evicted
+
+    def put(self, key: str, state: Any, dirty: bool = True) -> None:
+        snap = self._snapshot(state) if dirty else None
+        with self._lock:
+            e = self._entries.get(key) or self._evicted.pop(key, None)
+            if e is None:
+                e = _Entry(state, dirty, snap)
+            else:
+                e.state = state
+                if dirty:
+                    if e.dirty:
+                        self.stats["coalesced"] += 1
+                    e.dirty = True
+                    e.version += 1
+                    e.snap = snap
+            self._entries[key] = e
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                k, old = self._entries.popitem(last=False)
+                if old.dirty:
+                    self._evicted[k] = old
+        if dirty:
+            self._ensure_flusher()
+
+    def discard(self, key: str) -> None:
+        """
+        Выкинуть живой объект (его могли испортить); несброшенный снимок
+        последнего save() сразу пишется в БД — следующий get() перечитает её.
+        """
+        with self._flush_lock:
+            with self._lock:
+                e = self._entries.pop(key, None) or self._evicted.pop(key, None)
+            if e is not None and e.dirty and e.snap is not None:
+                get_store(self.path).save_sessions([(key,) + e.snap])
+                self.stats["writes"] += 1
+
+    # ---- сброс в хранилище ----
+
+    def flush(self) -> int:
+        """Синхронно записать все грязные записи. Возвращает число записанных ключей."""
+        with self._flush_lock:
+            records = []
+            done = []
+            with self._lock:
+                batch = [(k, e, e.version) for k, e in self._entries.items() if e.dirty]
+                batch += [(k, e, e.version) for k, e in self._evicted.items()]
+                for key, e, version in batch:
+                    if e.snap is None:
+                        continue
+                    header, start, items = e.snap
+                    records.append((key, header, start, items))
+                    done.append((key, e, version, start + len(items)))
+            if not records:
+                return 0
+            # весь тик — одной транзакцией, а не коммит на ключ
+            get_store(self.path).save_sessions(records)
+            with self._lock:
+                for key, e, version, next_seq in done:
+                    commit_state(e.state, next_seq)
+                    if e.version == version:
+                        e.dirty = False
+                        if self._evicted.get(key) is e:
+                            del self._evicted[key]
+            self.stats["writes"] += len(done)
+            return len(done)
+
+    def _ensure_flusher(self) -> None:
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="state-cache-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.max_staleness)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as ex:
+                print(f"[state.cache] flusher error: {ex}")
+
+    def close(self) -> None:
+        """Остановить фоновый поток и синхронно дописать всё грязное."""
+        self._stopped = True
+        self._wake.set()
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=5)
+        self.flush()
+
+
+# ---- Реестр кэшей (по файлу БД) ----
+
+_CACHES: Dict[str, SessionCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+def cache_enabled() -> bool:
+    # по умолчанию выключен: aiogram-боты и API пишут в один salesbot.db
+    return os.environ.get("STATE_CACHE", "0").lower() not in ("0", "false", "no", "off")
+
+def get_cache(path: str = DEFAULT_PATH) -> Optional[SessionCache]:
+    """Общий SessionCache для файла path; None, если кэш выключен (STATE_CACHE=0)."""
+    if not cache_enabled():
+        return None
+    key = _store_key(path)
+    cache = _CACHES.get(key)
+    if cache is not None and not cache._stopped:
+        return cache
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None or cache._stopped:
+            cache = SessionCache(path)
+            _CACHES[key] = cache
+        return cache
+
+def flush_caches() -> int:
+    return sum(c.flush() for c in list(_CACHES.values()))
+
+def close_caches() -> None:
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+        _CACHES.clear()
+    for c in caches:
+        c.close()
+
+atexit.register(close_caches)
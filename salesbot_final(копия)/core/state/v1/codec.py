@@ -0,0 +1,70 @@
+import json, os, struct
+from typing import Any, Dict, Optional, Union
+
+try:
+    import msgpack  # type: ignore
+except Exception:
+    msgpack = None  # type: ignore
+
+Raw = Union[str, bytes, memoryview]
+
+# бинарные записи: b"SB" + версия формата + id кодека, дальше полезная нагрузка
+_MAGIC = b"SB"
+_HEAD = struct.Struct("<2sBB")
+_VERSION = 1
+
+class JsonCodec:
+    """Текстовый JSON — читается глазами в sqlite3, удобен для отладки."""
+    name = "json"
+    id = 0
+
+    def encode(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def decode(self, raw: Raw) -> Any:
+        return json.loads(raw)
+
+class MsgpackCodec:
+    """Компактный бинарный формат (msgpack) с 4-байтным заголовком."""
+    name = "msgpack"
+    id = 1
+
+    def encode(self, obj: Any) -> bytes:
+        return _HEAD.pack(_MAGIC, _VERSION, self.id) + msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, raw: Raw) -> Any:
+        return msgpack.unpackb(bytes(raw)[_HEAD.size:], raw=False)
+
+_JSON = JsonCodec()
+_BY_ID: Dict[int, Any] = {_JSON.id: _JSON}
+if msgpack is not None:
+    _BY_ID[MsgpackCodec.id] = MsgpackCodec()
+
+def get_codec(name: Optional[str] = None):
+    """Кодек записи по STATE_CODEC (json | msgpack)."""
+    name = (name or os.environ.get("STATE_CODEC", "json")).lower()
+    if name == "msgpack":
+        if msgpack is None:
+            # не подменяем молча на json: иначе база тихо пишется не в том формате
+            raise RuntimeError("STATE_CODEC=msgpack, но msgpack не установлен (pip install msgpack)")
+        return _BY_ID[MsgpackCodec.id]
+    return _JSON
+
+CODEC = get_codec()
+
+def encode(obj: Any) -> Raw:
+    return CODEC.encode(obj)
+
+def decode(raw: Raw) -> Any:
+    """Декодирование любой записи: формат определяется по заголовку, а не по настройке."""
+    if isinstance(raw, (bytes, memoryview)):
+        head = bytes(raw[:_HEAD.size])
+        if len(head) == _HEAD.size:
+            magic, _, cid = _HEAD.unpack(head)
+            if magic == _MAGIC:
+                codec = _BY_ID.get(cid)
+                if codec is None:
+                    raise ValueError(f"state codec {cid} недоступен (pip install msgpack)")
+                return codec.decode(raw)
+        raw = bytes(raw).decode("utf-8")
+    return json.loads(raw)
@@ -0,0 +1,154 @@
+import functools
+import inspect
+from typing import Any, Callable, List, Optional, Tuple
+
+from .store import DEFAULT_PATH, get_store
+from .async_store import get_async_store
+from .cache import get_cache
+from .codec import decode
+from .turns import HISTORY_WINDOW, build_state, commit_state, ensure_turnlog, snapshot_state
+
+class Session:
+    """
+    Загрузка/сохранение состояния одной сессии движка.
+
+    Состояние хранится как заголовок (строка в sessions, без истории) плюс
+    append-only ходы в turns(session_id, seq). load_state() поднимает только
+    последние `window` ходов (STATE_HISTORY_WINDOW, по умолч. 50) в
+    state.history (TurnLog), save_state() дописывает лишь новые ходы — цена
+    сохранения не растёт с длиной диалога. Полная история — turns().
+
+    load_state()/save_state() работают с живым объектом состояния через
+    write-behind кэш (см. cache.py): повторный запрос к той же сессии не читает
+    SQLite, а save_state() лишь помечает сессию грязной.
+    Без кэша (STATE_CACHE=0) — прямые чтение/запись в StateStore.
+
+    Режим aopen() — для async-роутов: чтение через aiosqlite, запись без кэша
+    откладывается до await aflush() в конце запроса.
+    """
+
+    def __init__(self, key: str, path: str = DEFAULT_PATH, window: Optional[int] = None):
+        self.key = key
+        self.path = path
+        self.window = window or HISTORY_WINDOW
+        self._deferred = False
+        self._preloaded = False
+        self._record: Optional[tuple] = None
+        self._pending: Optional[Tuple[Any, str, int, list]] = None
+
+    @classmethod
+    async def aopen(cls, key: str, path: str = DEFAULT_PATH, window: Optional[int] = None) -> "Session":
+        s = cls(key, path, window)
+        s._deferred = True
+        cache = get_cache(path)
+        if cache is None or key not in cache:
+            s._record = await get_async_store(path).load_session(key, s.window)
+            s._preloaded = True
+        return s
+
+    def load(self) -> Optional[tuple]:
+        """(заголовок, последние ходы, seq первого из них, всего ходов) или None."""
+        if self._preloaded:
+            return self._record
+        return get_store(self.path).load_session(self.key, self.window)
+
+    def load_state(self, parse: Callable[[dict], Any]) -> Optional[Any]:
+        """Живой объект состояния: из кэша либо parse(dict); None — нет/битая запись."""
+        cache = get_cache(self.path)
+        if cache is not None:
+            state = cache.get(self.key)
+            if state is not None:
+                return state
+        rec = self.load()
+        if not rec:
+            return None
+        try:
+            state = parse(build_state(*rec, window=self.window))
+        except Exception:
+            return None
+        if cache is not None:
+            cache.put(self.key, state, dirty=False)
+        return state
+
+    def save_state(self, state: Any) -> None:
+        ensure_turnlog(state)
+        cache = get_cache(self.path)
+        if cache is not None:
+            cache.put(self.key, state, dirty=True)
+            return
+        header, start, items = snapshot_state(state)
+        if self._deferred:
+            self._pending = (state, header, start, items)
+            return
+        get_store(self.path).save_session(self.key, header, start, items)
+        commit_state(state, start + len(items))
+
+    async def aflush(self) -> None:
+        if self._pending is None:
+            return
+        (state, header, start, items), self._pending = self._pending, None
+        await get_async_store(self.path).save_session(self.key, header, start, items)
+        commit_state(state, start + len(items))
+
+    def discard(self) -> None:
+        """Живой объект мог быть испорчен: убрать из кэша, отложенную запись — отменить."""
+        self._pending = None
+        cache = get_cache(self.path)
+        if cache is not None:
+            cache.discard(self.key)
+
+    def header(self) -> Optional[dict]:
+        """
+        Поля состояния без истории (history=None): из кэша, иначе один заголовок
+        из БД — ходы не читаются и не декодируются.
+        """
+        cached = self._cached_header()
+        if cached is not None:
+            return cached
+        raw = get_store(self.path).load_header(self.key)
+        return decode(raw) if raw else None
+
+    async def aheader(self) -> Optional[dict]:
+        """header() для async-роутов: заголовок читается через aiosqlite"""
+        cached = self._cached_header()
+        if cached is not None:
+            return cached
+        raw = await get_async_store(self.path).load_header(self.key)
+        return decode(raw) if raw else None
+
+    def _cached_header(self) -> Optional[dict]:
+        cache = get_cache(self.path)
+        state = cache.get(self.key) if cache is not None else None
+        if state is None:
+            return None
+        return {k: v for k, v in vars(state).items() if k != "history"}
+
+    def turns(self, limit: int = 50, before: Optional[int] = None) -> List[Tuple[int, Any]]:
+        """Полная история постранично: (seq, ход) по убыванию seq."""
+        return get_store(self.path).get_turns(self.key, limit, before)
+
+
+def evict_on_error(method):
+    """
+    Декоратор методов движка, меняющих self.state (handle, reset, ...): если
+    метод упал на полпути, self.session.discard() — частичные изменения живого
+    объекта не уйдут в БД со следующим успешным сохранением.
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            try:
+                return await method(self, *args, **kwargs)
+            except BaseException:
+                self.session.discard()
+                raise
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except BaseException:
+            self.session.discard()
+            raise
+    return wrapper
@@ -1,6 +1,9 @@
+import json, os, queue, sqlite3, time, threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Tuple, Optional, Union
 
-import sqlite3, time, threading
-from typing import List, Tuple, Optional
+from .codec import encode
+from .turns import turn_item, turn_row
 
 _SCHEMA = '''
 CREATE TABLE IF NOT EXISTS kv (
@@ -9,25 +12,242 @@ CREATE TABLE IF NOT EXISTS kv (
   ts REAL
 );
 CREATE INDEX IF NOT EXISTS kv_ts_idx ON kv(ts);
+CREATE TABLE IF NOT EXISTS sessions (
+  id TEXT PRIMARY KEY,
+  ns TEXT,
+  state TEXT,
+  turns INTEGER NOT NULL DEFAULT 0,
+  ts REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_ts_idx ON sessions(ts);
+CREATE INDEX IF NOT EXISTS sessions_ns_ts_idx ON sessions(ns, ts);
+CREATE TABLE IF NOT EXISTS turns (
+  session_id TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  role TEXT,
+  content TEXT,
+  extra TEXT,
+  ts REAL,
+  PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID
 '''
 
+SCHEMA_VERSION = 1
+
+# (id сессии, заголовок JSON, seq первого нового хода, новые ходы)
+SessionRecord = Tuple[str, str, int, list]
+
+DEFAULT_PATH = "salesbot.db"
+
+# лимит параметров в одном IN (...) — ниже SQLITE_MAX_VARIABLE_NUMBER старых сборок
+_IN_CHUNK = 500
+
+def _prefix_upper(prefix: str) -> Optional[str]:
+    """
+    Наименьшая строка больше всех строк с данным префиксом (для key < upper).
+    SQLite сравнивает TEXT побайтно (UTF-8), что совпадает с порядком code point.
+    None — верхней границы нет (пустой префикс / одни U+10FFFF).
+    """
+    i = len(prefix)
+    while i > 0:
+        c = ord(prefix[i - 1]) + 1
+        if 0xD800 <= c <= 0xDFFF:
+            c = 0xE000
+        if c <= 0x10FFFF:
+            return prefix[:i - 1] + chr(c)
+        i -= 1
+    return None
+
+def _range_sql(prefix: str, after: Optional[str] = None, col: str = "key") -> Tuple[str, tuple]:
+    """WHERE-часть диапазонного запроса по префиксу — идёт по индексу PRIMARY KEY."""
+    if after is None:
+        cond, args = f"{col} >= ?", [prefix]
+    else:
+        cond, args = f"{col} > ?", [after]
+    upper = _prefix_upper(prefix)
+    if upper is not None:
+        cond += f" AND {col} < ?"
+        args.append(upper)
+    return cond, tuple(args)
+
+def _session_ns(sid: str) -> str:
+    return sid.split(":", 1)[0] if ":" in sid else ""
+
+def _write_sessions(conn, records: Iterable[SessionRecord]) -> int:
+    """Записать сессии внутри уже открытой транзакции: заголовок + только новые ходы."""
+    ts = time.time()
+    n = 0
+    for sid, header, start, items in records:
+        # start=0 у новой/сброшенной сессии — старые ходы удаляются
+        conn.execute("DELETE FROM turns WHERE session_id = ? AND seq >= ?", (sid, start))
+        if items:
+            conn.executemany(
+                "INSERT INTO turns(session_id, seq, role, content, extra, ts) VALUES(?,?,?,?,?,?)",
+                [turn_row(sid, start + i, it, ts) for i, it in enumerate(items)])
+        conn.execute("REPLACE INTO sessions(id, ns, state, turns, ts) VALUES(?,?,?,?,?)",
+                     (sid, _session_ns(sid), header, start + len(items), ts))
+        n += 1
+    return n
+
+def _migrate_v1(conn) -> int:
+    """
+    kv -> sessions/turns: JSON-объекты с полем history (состояния движков)
+    переносятся в заголовок + по строке на ход; прочие ключи kv не трогаются.
+    """
+    moved = []
+    cur = conn.execute("SELECT key, value FROM kv WHERE value LIKE '{%'")
+    for key, value in cur:
+        try:
+            d = json.loads(value)
+        except Exception:
+            continue
+        if not isinstance(d, dict) or not isinstance(d.get("history"), list):
+            continue
+        items = d["history"]
+        d["history"] = None
+        moved.append((key, encode(d), 0, items))
+    cur.close()
+    _write_sessions(conn, moved)
+    conn.executemany("DELETE FROM kv WHERE key = ?", [(k,) for k, _, _, _ in moved])
+    return len(moved)
+
+def _migrate_legacy_kv(conn) -> int:
+    """
+    kv(k, v) от core/db/v1 -> kv(key, value, ts). Выполняется до DDL: иначе
+    CREATE TABLE IF NOT EXISTS kv молча оставит таблицу старой формы.
+    """
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(kv)").fetchall()]
+    if not cols or "key" in cols or not {"k", "v"} <= set(cols):
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("ALTER TABLE kv RENAME TO kv_legacy")
+        conn.execute("CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT, ts REAL)")
+        n = conn.execute("INSERT OR REPLACE INTO kv(key, value, ts) SELECT k, v, ? FROM kv_legacy",
+                         (time.time(),)).rowcount
+        conn.execute("DROP TABLE kv_legacy")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return n
+
+def init_db(conn) -> None:
+    """DDL + миграции по PRAGMA user_version (соединение sqlite3 с isolation_level=None)."""
+    # действует только для новой (пустой) БД; старые файлы — через VACUUM вручную
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    _migrate_legacy_kv(conn)
+    for stmt in _SCHEMA.strip().split(';'):
+        st = stmt.strip()
+        if st:
+            conn.execute(st)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if version < 1:
+            _migrate_v1(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+def _page_cache_kb() -> int:
+    try:
+        return max(0, int(os.environ.get("STATE_SQLITE_CACHE_KB", "8192")))
+    except ValueError:
+        return 8192
+
+def _pool_size() -> int:
+    try:
+        return max(1, int(os.environ.get("STATE_POOL_READERS", "4")))
+    except ValueError:
+        return 4
+
 class StateStore:
-    def __init__(self, path: str = "salesbot.db"):
+    """
+    KV-хранилище поверх SQLite (WAL).
+    Одно соединение-писатель (под RLock) + ограниченный пул соединений-читателей,
+    которые переиспользуются между запросами. Экземпляры не создаются на каждый
+    запрос — используйте get_store(path).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, readers: Optional[int] = None):
         self.path = path
         self._lock = threading.RLock()
-        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
-        self._conn.execute("PRAGMA journal_mode=WAL;")
-        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn = self._connect()
         self._init_db()
+        self._max_readers = readers or _pool_size()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers_open = 0
+        self._pool_lock = threading.Lock()
+        self._tx_owner: Optional[int] = None
+        self._tx_depth = 0
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # до journal_mode: переключение в WAL уже инициализирует файл
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        kb = _page_cache_kb()
+        if kb:
+            conn.execute(f"PRAGMA cache_size=-{kb}")
+        return conn
 
     def _init_db(self):
         with self._lock:
-            cur = self._conn.cursor()
-            for stmt in _SCHEMA.strip().split(';'):
-                s = stmt.strip()
-                if s:
-                    cur.execute(s)
-            cur.close()
+            init_db(self._conn)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def _shared_only(self) -> bool:
+        # in-memory БД видна только своему соединению — читаем через писателя
+        return self.path == ":memory:" or self.path.startswith("file::memory:")
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._readers_open < self._max_readers:
+                self._readers_open += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._readers_open -= 1
+                    raise
+        # пул исчерпан — ждём освобождения
+        return self._readers.get(timeout=30)
+
+    def _release_reader(self, conn: sqlite3.Connection):
+        if self._closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        self._readers.put(conn)
+
+    @contextmanager
+    def _reader(self):
+        if self._shared_only or self._tx_owner == threading.get_ident():
+            # внутри transaction() читаем своим же соединением — видны незакоммиченные записи
+            with self._lock:
+                yield self._conn
+            return
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
 
     def _exec(self, sql: str, args: tuple=()):
         # simple retry for SQLITE_BUSY
@@ -37,7 +257,8 @@ class StateStore:
                 with self._lock:
                     cur = self._conn.cursor()
                     cur.execute(sql, args)
-                    self._conn.commit()
+                    if not self._tx_depth:
+                        self._conn.commit()
                     return cur
             except sqlite3.OperationalError as e:
                 if "database is locked" in str(e).lower():
@@ -47,11 +268,69 @@ class StateStore:
                 raise
         raise RuntimeError("SQLite busy, retries exceeded")
 
+    def _query(self, sql: str, args: tuple=()) -> list:
+        backoff = 0.01
+        for _ in range(5):
+            try:
+                with self._reader() as conn:
+                    cur = conn.execute(sql, args)
+                    rows = cur.fetchall()
+                    cur.close()
+                    return rows
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    time.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+        raise RuntimeError("SQLite busy, retries exceeded")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция на соединении-писателе (BEGIN IMMEDIATE ... COMMIT).
+        Все get/set/delete/*_many внутри блока идут одним коммитом; при
+        исключении — ROLLBACK. Вложенные вызовы присоединяются к внешней.
+        """
+        with self._lock:
+            if self._tx_depth:
+                self._tx_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._tx_depth -= 1
+                return
+            self._begin()
+            self._tx_depth = 1
+            self._tx_owner = threading.get_ident()
+            try:
+                yield self
+            except BaseException:
+                self._conn.rollback()
+                raise
+            else:
+                self._conn.commit()
+            finally:
+                self._tx_depth = 0
+                self._tx_owner = None
+
+    def _begin(self):
+        backoff = 0.01
+        for _ in range(5):
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    time.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise
+        raise RuntimeError("SQLite busy, retries exceeded")
+
     def get(self, key: str) -> Optional[str]:
-        cur = self._exec("SELECT value FROM kv WHERE key = ?", (key,))
-        row = cur.fetchone()
-        cur.close()
-        return row[0] if row else None
+        rows = self._query("SELECT value FROM kv WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
 
     def set(self, key: str, value: str) -> None:
         ts = time.time()
@@ -63,14 +342,235 @@ class StateStore:
         cur.close()
         return n
 
-    def scan(self, prefix: str, limit: int = 100) -> List[Tuple[str,str]]:
-        cur = self._exec("SELECT key, value FROM kv WHERE key LIKE ? ORDER BY key LIMIT ?", (prefix + "%", limit))
-        rows = cur.fetchall()
-        cur.close()
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Значения для набора ключей одним снимком (отсутствующие ключи пропускаются)."""
+        keys = list(dict.fromkeys(keys))
+        out: Dict[str, str] = {}
+        if not keys:
+            return out
+        with self._reader() as conn:
+            own_tx = conn is not self._conn or not self._tx_depth
+            if own_tx:
+                conn.execute("BEGIN")
+            try:
+                for i in range(0, len(keys), _IN_CHUNK):
+                    chunk = keys[i:i + _IN_CHUNK]
+                    q = "SELECT key, value FROM kv WHERE key IN (%s)" % ",".join("?" * len(chunk))
+                    out.update(conn.execute(q, chunk).fetchall())
+            finally:
+                if own_tx:
+                    conn.commit()
+        return out
+
+    def set_many(self, items: Union[Mapping[str, str], Iterable[Tuple[str, str]]]) -> int:
+        """Записать пары ключ/значение одной транзакцией (executemany)."""
+        pairs = items.items() if isinstance(items, Mapping) else items
+        ts = time.time()
+        rows = [(k, v, ts) for k, v in pairs]
+        if not rows:
+            return 0
+        with self.transaction():
+            self._conn.executemany("REPLACE INTO kv(key, value, ts) VALUES(?,?,?)", rows)
+        return len(rows)
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """Удалить набор ключей одной транзакцией; возвращает число удалённых строк."""
+        rows = [(k,) for k in dict.fromkeys(keys)]
+        if not rows:
+            return 0
+        with self.transaction():
+            cur = self._conn.executemany("DELETE FROM kv WHERE key = ?", rows)
+            n = cur.rowcount or 0
+        return n
+
+    def scan(self, prefix: str, limit: int = 100, after: Optional[str] = None) -> List[Tuple[str,str]]:
+        """Не больше limit ключей с префиксом; after — продолжить после этого ключа."""
+        cond, args = _range_sql(prefix, after)
+        rows = self._query(f"SELECT key, value FROM kv WHERE {cond} ORDER BY key LIMIT ?", args + (limit,))
         return [(k,v) for k,v in rows]
 
+    def iter_scan(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str,str]]:
+        """
+        Потоковый обход всех ключей с префиксом страницами по page_size
+        (keyset-пагинация: key > последний_ключ). Соединение-читатель берётся
+        на одну страницу, а не на весь обход.
+        """
+        after: Optional[str] = None
+        while True:
+            cond, args = _range_sql(prefix, after)
+            rows = self._query(f"SELECT key, value FROM kv WHERE {cond} ORDER BY key LIMIT ?", args + (page_size,))
+            for k, v in rows:
+                yield k, v
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    # ---- сессии движков: заголовок + append-only ходы ----
+
+    def load_session(self, sid: str, last_n: int) -> Optional[Tuple[str, list, int, int]]:
+        """(заголовок, последние last_n ходов, seq первого из них, число ходов) или None."""
+        with self._reader() as conn:
+            own_tx = conn is not self._conn or not self._tx_depth
+            if own_tx:
+                conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT state, turns FROM sessions WHERE id = ?", (sid,)).fetchone()
+                if row is None:
+                    return None
+                header, total = row
+                base = max(0, total - last_n)
+                rows = conn.execute(
+                    "SELECT role, content, extra FROM turns WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                    (sid, base, total)).fetchall()
+            finally:
+                if own_tx:
+                    conn.commit()
+        return header, [turn_item(*r) for r in rows], base, total
+
+    def load_header(self, sid: str) -> Optional[Any]:
+        """Только заголовок сессии (без истории) — для stage/wave/round и т.п."""
+        rows = self._query("SELECT state FROM sessions WHERE id = ?", (sid,))
+        return rows[0][0] if rows else None
+
+    def save_session(self, sid: str, header: str, start: int, items: list) -> None:
+        self.save_sessions([(sid, header, start, items)])
+
+    def save_sessions(self, records: Iterable[SessionRecord]) -> int:
+        """Несколько сессий одной транзакцией (используется write-behind кэшем)."""
+        records = list(records)
+        if not records:
+            return 0
+        with self.transaction():
+            return _write_sessions(self._conn, records)
+
+    def get_turns(self, sid: str, limit: int = 50, before: Optional[int] = None) -> List[Tuple[int, Any]]:
+        """Ходы сессии (seq, item) по убыванию seq — постранично для полной истории."""
+        if before is None:
+            rows = self._query("SELECT seq, role, content, extra FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?", (sid, limit))
+        else:
+            rows = self._query("SELECT seq, role, content, extra FROM turns WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?", (sid, before, limit))
+        return [(seq, turn_item(r, c, e)) for seq, r, c, e in rows]
+
+    def delete_session(self, sid: str) -> int:
+        with self.transaction():
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (sid,))
+            cur = self._conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+            return cur.rowcount or 0
+
+    def iter_sessions(self, prefix: str, page_size: int = 500) -> Iterator[Tuple[str, str]]:
+        """(id, заголовок) всех сессий с префиксом id (например "arena:"), keyset-пагинация."""
+        after: Optional[str] = None
+        while True:
+            cond, args = _range_sql(prefix, after, col="id")
+            rows = self._query(f"SELECT id, state FROM sessions WHERE {cond} ORDER BY id LIMIT ?", args + (page_size,))
+            for k, v in rows:
+                yield k, v
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    # ---- TTL / обслуживание (см. ttl.py) ----
+
+    def expire_sessions(self, ns: str, before: float, limit: int = 500, keep=()) -> int:
+        """Удалить до limit сессий пространства ns, не сохранявшихся с before (индекс ns, ts)."""
+        rows = self._query("SELECT id FROM sessions WHERE ns = ? AND ts < ? ORDER BY ts LIMIT ?", (ns, before, limit))
+        ids = [(r[0],) for r in rows if r[0] not in keep]
+        if not ids:
+            return 0
+        removed = 0
+        with self.transaction():
+            for sid, in ids:
+                # повторная проверка в транзакции: сессию могли сохранить после SELECT
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE id = ? AND ts < ?)",
+                    (sid, before))
+                removed += self._conn.execute("DELETE FROM sessions WHERE id = ? AND ts < ?", (sid, before)).rowcount
+        return removed
+
+    def expire_keys(self, prefix: str, before: float, limit: int = 500) -> int:
+        """Удалить до limit ключей kv с префиксом, записанных раньше before (индекс по ts)."""
+        cond, args = _range_sql(prefix)
+        rows = self._query(f"SELECT key FROM kv WHERE ts < ? AND {cond} ORDER BY ts LIMIT ?", (before,) + args + (limit,))
+        if not rows:
+            return 0
+        with self.transaction():
+            self._conn.executemany("DELETE FROM kv WHERE key = ? AND ts < ?", [(r[0], before) for r in rows])
+        return len(rows)
+
+    def checkpoint(self, vacuum_pages: int = 1000) -> Tuple[int, int]:
+        """
+        incremental_vacuum (при auto_vacuum=INCREMENTAL) и wal_checkpoint(TRUNCATE) —
+        WAL-файл обрезается до нуля. Возвращает (busy, страниц в WAL).
+        """
+        with self._lock:
+            if vacuum_pages:
+                self._conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            busy, log, _ = self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return busy, log
+
     def close(self):
-        try:
-            self._conn.close()
-        except Exception:
-            pass
+        self._closed = True
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self._lock:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+
+
+# ---- Реестр общих хранилищ (один пул на файл БД на процесс) ----
+
+_STORES: Dict[str, "StateStore"] = {}
+_STORES_LOCK = threading.Lock()
+
+def _store_key(path: str) -> str:
+    if path == ":memory:" or path.startswith("file:"):
+        return path
+    return os.path.abspath(path)
+
+def get_store(path: str = DEFAULT_PATH) -> "StateStore":
+    """
+    Общее хранилище для файла path (создаётся при первом обращении).
+    Реализация — по STATE_BACKEND (см. backends.make_store), по умолчанию StateStore.
+    """
+    key = _store_key(path)
+    store = _STORES.get(key)
+    if store is not None and not store.closed:
+        return store
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None or store.closed:
+            from .backends import make_store
+            store = make_store(path)
+            _STORES[key] = store
+        return store
+
+def close_stores() -> None:
+    """Закрыть все общие хранилища (вызывается на shutdown приложения)."""
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+        _STORES.clear()
+    for s in stores:
+        s.close()
+
+def on_startup(path: str = DEFAULT_PATH) -> None:
+    """Хук FastAPI startup: заранее открыть пул (DDL один раз) и запустить TTL-чистильщик."""
+    get_store(path)
+    from .ttl import start_sweeper
+    start_sweeper(path)
+
+def on_shutdown() -> None:
+    """Хук FastAPI shutdown: остановить чистильщик, дописать write-behind кэш, закрыть пул."""
+    from .ttl import stop_sweepers
+    from .cache import close_caches
+    stop_sweepers()
+    close_caches()
+    close_stores()
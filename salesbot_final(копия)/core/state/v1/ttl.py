@@ -0,0 +1,142 @@
+import os, threading, time
+from typing import Dict, Optional
+
+from .store import DEFAULT_PATH, _store_key, get_store
+
+# TTL тренировочных сессий по пространствам имён (префикс ключа до ":")
+DEFAULT_POLICIES: Dict[str, float] = {
+    "arena": 14 * 86400,
+    "obj": 14 * 86400,
+    "us": 14 * 86400,
+    "mp": 30 * 86400,
+    "dragon": 14 * 86400,
+    "sleeping_dragon": 14 * 86400,
+    # дисковый кэш ответов LLM (kv "llm:<hash>"); берётся из LLM_CACHE_TTL
+    "llm": 3600,
+}
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(v: str) -> float:
+    """"3600", "30m", "12h", "7d" -> секунды; 0 — не удалять."""
+    v = v.strip().lower()
+    if v and v[-1] in _UNITS:
+        return float(v[:-1]) * _UNITS[v[-1]]
+    return float(v)
+
+def load_policies() -> Dict[str, float]:
+    """
+    DEFAULT_POLICIES + переопределения из STATE_TTL, например
+    STATE_TTL="arena=7d,mp=60d,dragon=0" (0 — хранить бессрочно).
+    """
+    policies = dict(DEFAULT_POLICIES)
+    policies["llm"] = _env_float("LLM_CACHE_TTL", policies["llm"])
+    raw = os.environ.get("STATE_TTL", "")
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        ns, val = part.split("=", 1)
+        try:
+            policies[ns.strip()] = parse_duration(val)
+        except ValueError:
+            print(f"[state.ttl] bad STATE_TTL entry: {part!r}")
+    return {ns: ttl for ns, ttl in policies.items() if ttl > 0}
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class Sweeper:
+    """
+    Фоновая очистка устаревших сессий и обслуживание файла БД.
+
+    Раз в interval секунд для каждого пространства имён удаляет сессии
+    (sessions + turns) и ключи kv старше TTL — пачками по batch строк, с паузой
+    между пачками, чтобы не держать блокировку писателя. Сессии, живущие в
+    write-behind кэше, не трогаются. После прохода — wal_checkpoint(TRUNCATE)
+    и incremental_vacuum, чтобы WAL и сам файл не росли бесконечно.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, policies: Optional[Dict[str, float]] = None,
+                 interval: Optional[float] = None, batch: Optional[int] = None):
+        self.path = path
+        self.policies = policies if policies is not None else load_policies()
+        self.interval = interval if interval is not None else _env_float("STATE_SWEEP_INTERVAL", 300.0)
+        self.batch = batch or int(_env_float("STATE_SWEEP_BATCH", 500))
+        self.pause = 0.05
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"runs": 0, "sessions": 0, "keys": 0, "checkpoints": 0}
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Один проход: удалить всё просроченное. Возвращает число удалённых записей."""
+        from .cache import get_cache
+        store = get_store(self.path)
+        cache = get_cache(self.path)
+        now = time.time() if now is None else now
+        total = 0
+        for ns, ttl in self.policies.items():
+            before = now - ttl
+            for kind in ("sessions", "keys"):
+                while not self._stop.is_set():
+                    if kind == "sessions":
+                        keep = cache if cache is not None else ()
+                        n = store.expire_sessions(ns, before, self.batch, keep=keep)
+                    else:
+                        n = store.expire_keys(ns + ":", before, self.batch)
+                    self.stats[kind] += n
+                    total += n
+                    if n < self.batch:
+                        break
+                    time.sleep(self.pause)
+        store.checkpoint()
+        self.stats["checkpoints"] += 1
+        self.stats["runs"] += 1
+        return total
+
+    def start(self) -> None:
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="state-ttl-sweeper", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as ex:
+                print(f"[state.ttl] sweep error: {ex}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=5)
+
+
+# ---- Реестр чистильщиков (по файлу БД) ----
+
+_SWEEPERS: Dict[str, Sweeper] = {}
+_SWEEPERS_LOCK = threading.Lock()
+
+def start_sweeper(path: str = DEFAULT_PATH) -> Optional[Sweeper]:
+    """Запустить чистильщик для файла path (STATE_SWEEP_INTERVAL=0 — выключен)."""
+    if path == ":memory:":
+        return None
+    key = _store_key(path)
+    with _SWEEPERS_LOCK:
+        sw = _SWEEPERS.get(key)
+        if sw is None:
+            sw = Sweeper(path)
+            _SWEEPERS[key] = sw
+        sw.start()
+        return sw
+
+def stop_sweepers() -> None:
+    with _SWEEPERS_LOCK:
+        sweepers = list(_SWEEPERS.values())
+        _SWEEPERS.clear()
+    for sw in sweepers:
+        sw.stop()
@@ -0,0 +1,108 @@
+import os
+from dataclasses import fields, is_dataclass
+from typing import Any, List, Optional, Tuple
+
+from .codec import Raw, decode, encode
+
+def _window() -> int:
+    try:
+        return max(1, int(os.environ.get("STATE_HISTORY_WINDOW", "50")))
+    except ValueError:
+        return 50
+
+HISTORY_WINDOW = _window()
+
+class TurnLog(list):
+    """
+    history сессии: последние N ходов из таблицы turns + новые (append как у list).
+    base      — seq первого элемента списка
+    saved_seq — следующий seq, которого ещё нет в БД (всё левее уже записано)
+    """
+
+    def __init__(self, items=(), base: int = 0, saved_seq: int = 0, window: Optional[int] = None):
+        super().__init__(items)
+        self.base = base
+        self.saved_seq = saved_seq
+        self.window = window or HISTORY_WINDOW
+
+    @property
+    def total(self) -> int:
+        """Всего ходов в сессии (sessions.turns + ещё не записанные), а не только в окне."""
+        return self.base + len(self)
+
+    def pending(self) -> Tuple[int, list]:
+        """(seq первого незаписанного хода, сами ходы)."""
+        start = self.saved_seq
+        return start, list(self[start - self.base:])
+
+    def commit(self, next_seq: int) -> None:
+        """Ходы до next_seq записаны; лишнее сверх окна (только записанное) отбрасываем."""
+        if next_seq > self.saved_seq:
+            self.saved_seq = next_seq
+        extra = min(len(self) - self.window, self.saved_seq - self.base)
+        if extra > 0:
+            del self[:extra]
+            self.base += extra
+
+def turn_count(history: Any) -> int:
+    """Число ходов сессии: у TurnLog — total (окно — лишь хвост), у list — len."""
+    if isinstance(history, TurnLog):
+        return history.total
+    return len(history or ())
+
+def ensure_turnlog(state: Any) -> Optional[TurnLog]:
+    """Обычный list в state.history (новая сессия / reset) -> TurnLog с seq с нуля."""
+    hist = getattr(state, "history", None)
+    if hist is None or isinstance(hist, TurnLog):
+        return hist
+    log = TurnLog(hist)
+    state.history = log
+    return log
+
+def snapshot_state(state: Any) -> Tuple[Raw, int, list]:
+    """
+    (заголовок без истории в кодеке STATE_CODEC, seq первого нового хода, новые ходы).
+    История не сериализуется целиком — только то, что ещё не в БД; asdict
+    (глубокая копия) не используется — поля берутся как есть.
+    """
+    if is_dataclass(state):
+        d = {f.name: getattr(state, f.name) for f in fields(state)}
+    else:
+        d = dict(state.to_dict())
+    log = d.get("history")
+    if log is None:
+        return encode(d), 0, []
+    d["history"] = None
+    header = encode(d)
+    if not isinstance(log, TurnLog):
+        return header, 0, list(log)
+    start, items = log.pending()
+    return header, start, items
+
+def commit_state(state: Any, next_seq: int) -> None:
+    log = getattr(state, "history", None)
+    if isinstance(log, TurnLog):
+        log.commit(next_seq)
+
+def build_state(header: Raw, turns: List[Any], base: int, next_seq: int, window: Optional[int] = None) -> dict:
+    d = decode(header)
+    if "history" in d:
+        d["history"] = TurnLog(turns, base, next_seq, window)
+    return d
+
+# ---- строки таблицы turns ----
+
+def turn_row(sid: str, seq: int, item: Any, ts: float) -> tuple:
+    if isinstance(item, dict) and isinstance(item.get("content", ""), str):
+        rest = {k: v for k, v in item.items() if k not in ("role", "content")}
+        extra = encode(rest) if rest else None
+        return (sid, seq, item.get("role"), item.get("content"), extra, ts)
+    return (sid, seq, None, None, encode(item), ts)
+
+def turn_item(role: Optional[str], content: Optional[str], extra: Optional[Raw]) -> Any:
+    if role is None and content is None:
+        return decode(extra) if extra else None
+    item = {"role": role, "content": content}
+    if extra:
+        item.update(decode(extra))
+    return item
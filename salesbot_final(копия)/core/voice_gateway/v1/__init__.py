@@ -1,2 +1,6 @@
-from .pipeline import VoicePipeline
-__all__=['VoicePipeline']
+from .pipeline import VoicePipeline, get_pipeline
+from .pipeline import LLMUnavailable
+from .prompt import PromptBuilder, estimate_tokens
+from .ratelimit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+__all__=['VoicePipeline','get_pipeline','PromptBuilder','estimate_tokens',
+         'LLMUnavailable','PRIORITY_INTERACTIVE','PRIORITY_BACKGROUND']
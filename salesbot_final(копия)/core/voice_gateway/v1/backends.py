@@ -0,0 +1,143 @@
+"""
+Провайдеры LLM для _LLMClient. Все говорят на формате OpenAI /chat/completions
+(в т.ч. SSE-стрим), различаются адресом, ключом, моделью и допустимыми ролями.
+Выбор — LLM_BACKEND: deepseek (по умолч.) | openai | mock.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Protocol, runtime_checkable
+
+
+def _env(name: str, default: Optional[str] = None) -> Optional[str]:
+    return os.environ.get(name, default)
+
+
+@runtime_checkable
+class LLMBackend(Protocol):
+    """
+    Интерфейс провайдера. Реализуют DeepSeekBackend, OpenAICompatibleBackend
+    (любой совместимый сервис: OpenAI, vLLM, Ollama, LM Studio) и MockBackend
+    (локальный mock_server.py для нагрузочных тестов без платных вызовов).
+    """
+
+    name: str
+    api_url: str
+    api_key: Optional[str]
+    model: str
+
+    def headers(self) -> Dict[str, str]: ...
+    def payload(self, messages: List[Dict[str, str]], temperature: Optional[float] = None,
+                stream: bool = False) -> Dict[str, Any]: ...
+    def extract(self, data: Any) -> Optional[str]: ...
+    def requires_key(self) -> bool: ...
+
+
+class OpenAICompatibleBackend:
+    """
+    POST {api_url} c {"model", "messages", ["temperature"], ["stream"]};
+    ответ — choices[0].message.content (или {"output": "..."}).
+    ENV: OPENAI_API_URL, OPENAI_API_KEY, OPENAI_MODEL.
+    """
+
+    name = "openai"
+    allowed_roles = {"system", "user", "assistant", "tool"}
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None) -> None:
+        self.api_url = api_url or _env("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+        self.api_key = api_key if api_key is not None else _env("OPENAI_API_KEY")
+        self.model = model or _env("OPENAI_MODEL", "gpt-4o-mini")
+
+    def requires_key(self) -> bool:
+        return True
+
+    def normalize(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Кастомные роли ("boss", "coach", ...) -> system/user, как ждёт API."""
+        out: List[Dict[str, str]] = []
+        for m in messages:
+            role = m.get("role", "user")
+            if role not in self.allowed_roles:
+                low = str(role).lower()
+                role = "system" if ("system" in low or "meta" in low) else "user"
+            out.append({"role": role, "content": m.get("content", "")})
+        return out
+
+    def headers(self) -> Dict[str, str]:
+        h = {"Content-Type": "application/json"}
+        if self.api_key:
+            h["Authorization"] = f"Bearer {self.api_key}"
+        return h
+
+    def payload(self, messages: List[Dict[str, str]], temperature: Optional[float] = None,
+                stream: bool = False) -> Dict[str, Any]:
+        p: Dict[str, Any] = {"model": self.model, "messages": self.normalize(messages)}
+        if temperature is not None:
+            p["temperature"] = temperature
+        if stream:
+            p["stream"] = True
+        return p
+
+    def extract(self, data: Any) -> Optional[str]:
+        if isinstance(data, dict):
+            # Вариант { "output": "..." }
+            if "output" in data and isinstance(data["output"], str):
+                return data["output"]
+
+            # Вариант OpenAI-стиля с choices
+            if "choices" in data and data["choices"]:
+                ch = data["choices"][0]
+                msg = (ch.get("message") or {}).get("content")
+                if isinstance(msg, str):
+                    return msg
+        return None
+
+
+class DeepSeekBackend(OpenAICompatibleBackend):
+    """DeepSeek (OpenAI-совместимый). ENV: DEEPSEEK_API_URL, DEEPSEEK_API_KEY, DEEPSEEK_MODEL."""
+
+    name = "deepseek"
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None) -> None:
+        super().__init__(
+            api_url or _env("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions"),
+            api_key if api_key is not None else _env("DEEPSEEK_API_KEY"),
+            model or _env("DEEPSEEK_MODEL", "deepseek-chat"),
+        )
+
+
+class MockBackend(OpenAICompatibleBackend):
+    """
+    Локальный mock_server.py (python -m core.voice_gateway.v1.mock_server).
+    Ключ не нужен. ENV: LLM_MOCK_URL (по умолч. http://127.0.0.1:8089/v1/chat/completions).
+    """
+
+    name = "mock"
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None) -> None:
+        super().__init__(
+            api_url or _env("LLM_MOCK_URL", "http://127.0.0.1:8089/v1/chat/completions"),
+            api_key or "mock",
+            model or "mock",
+        )
+
+    def requires_key(self) -> bool:
+        return False
+
+
+BACKENDS = {
+    DeepSeekBackend.name: DeepSeekBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+    MockBackend.name: MockBackend,
+}
+
+
+def make_backend(name: Optional[str] = None) -> LLMBackend:
+    """Провайдер по LLM_BACKEND: deepseek (по умолчанию) | openai | mock."""
+    kind = (name or _env("LLM_BACKEND", "deepseek") or "deepseek").lower()
+    cls = BACKENDS.get(kind)
+    if cls is None:
+        print(f"[voice_gateway] unknown LLM_BACKEND={kind!r} — используется deepseek")
+        cls = DeepSeekBackend
+    return cls()
@@ -0,0 +1,101 @@
+"""
+Нагрузочный прогон LLM-пайплайна: N вызовов achat() с заданной параллельностью,
+на выходе — задержки p50/p95/p99, пропускная способность и llm.stats().
+
+  # против встроенного mock (без сети и платных вызовов)
+  python -m core.voice_gateway.v1.loadtest --mock --requests 500 --concurrency 100 \
+      --latency lognormal:0.8,0.5 --error-rate 0.02
+
+  # против того, что настроено в ENV (LLM_BACKEND / DEEPSEEK_* / LLM_MOCK_URL)
+  python -m core.voice_gateway.v1.loadtest --requests 50 --concurrency 5
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Optional
+
+from .backends import MockBackend
+from .mock_server import MockConfig, start_mock_server
+from .pipeline import VoicePipeline
+
+
+def _pct(data: List[float], q: float) -> float:
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(q * len(data)))]
+
+
+async def run(pipeline: VoicePipeline, requests: int, concurrency: int, stream: bool = False) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    first: List[float] = []
+
+    async def one(i: int) -> None:
+        # разные тексты — чтобы кэш ответов не скрывал реальную нагрузку
+        messages = [
+            {"role": "system", "content": "Ты клиент. Тип: busy. Реагируй естественно."},
+            {"role": "user", "content": f"Здравствуйте! Это сообщение продавца №{i}"},
+        ]
+        async with sem:
+            t0 = time.monotonic()
+            if stream:
+                ttft = None
+                async for _ in pipeline.llm.astream(messages, cache=False):
+                    if ttft is None:
+                        ttft = time.monotonic() - t0
+                if ttft is not None:
+                    first.append(ttft)
+            else:
+                await pipeline.llm.achat(messages, cache=False)
+            latencies.append(time.monotonic() - t0)
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.monotonic() - t0
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 2),
+        "rps": round(requests / wall, 1) if wall else 0.0,
+        "p50": round(_pct(latencies, 0.50), 3),
+        "p95": round(_pct(latencies, 0.95), 3),
+        "p99": round(_pct(latencies, 0.99), 3),
+        "llm": pipeline.llm.stats(),
+    }
+    if stream:
+        report["ttft_p50"] = round(_pct(first, 0.50), 3)
+        report["ttft_p95"] = round(_pct(first, 0.95), 3)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="LLM pipeline load test")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--stream", action="store_true", help="astream() вместо achat(), плюс время до первого куска")
+    ap.add_argument("--mock", action="store_true", help="поднять встроенный mock и гнать нагрузку в него")
+    ap.add_argument("--latency", default="lognormal:0.8,0.5")
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit", type=float, default=0.0)
+    ap.add_argument("--tps", type=float, default=40.0)
+    ap.add_argument("--seed", type=int, default=None)
+    a = ap.parse_args(argv)
+
+    backend = None
+    server = None
+    if a.mock:
+        server, url = start_mock_server(config=MockConfig(a.latency, a.error_rate, a.rate_limit, a.tps, seed=a.seed))
+        backend = MockBackend(api_url=url)
+    pipeline = VoicePipeline(backend)
+    report = asyncio.run(run(pipeline, a.requests, a.concurrency, a.stream))
+    if server is not None:
+        report["mock"] = dict(server.RequestHandlerClass.config.stats)
+        server.shutdown()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Локальный mock OpenAI-совместимого /chat/completions для нагрузочных тестов
+без платных вызовов и лимитов API.
+
+  python -m core.voice_gateway.v1.mock_server --port 8089 \
+      --latency lognormal:0.8,0.5 --error-rate 0.02 --rate-limit 0.01 --tps 40
+
+  LLM_BACKEND=mock LLM_MOCK_URL=http://127.0.0.1:8089/v1/chat/completions python main.py
+
+Ответ детерминирован: один и тот же последний user-текст даёт один и тот же
+текст ответа. Случайны только задержка и ошибки (--seed фиксирует и их).
+"stream": true — SSE-чанки со скоростью --tps токенов в секунду.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from .prompt import estimate_tokens
+
+_PHRASES = [
+    "Спасибо, интересно.", "А сколько это стоит?", "Мне нужно подумать.",
+    "Сейчас не самое удобное время.", "Звучит неплохо.", "А какие сроки?",
+    "Я посоветуюсь с женой.", "Дороговато для меня.", "А можно пример?",
+    "Хорошо, давайте попробуем.", "Я уже видел похожее.", "Расскажите подробнее.",
+    "Не уверен, что мне это нужно.", "А есть скидка?", "Это для подарка на юбилей.",
+]
+
+
+class LatencyModel:
+    """
+    Задержка ответа по спецификации "вид:параметры" (секунды):
+      fixed:0.5 | uniform:0.2,1.5 | normal:1.0,0.3 | lognormal:0.8,0.5 (медиана, sigma) | exp:0.8
+    """
+
+    def __init__(self, spec: str = "lognormal:0.8,0.5") -> None:
+        kind, _, args = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.args = [float(a) for a in args.split(",") if a.strip()]
+        self.spec = spec
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"unknown latency spec: {spec!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        a = self.args
+        if self.kind == "fixed":
+            v = a[0]
+        elif self.kind == "uniform":
+            v = rng.uniform(a[0], a[1])
+        elif self.kind == "normal":
+            v = rng.gauss(a[0], a[1])
+        elif self.kind == "lognormal":
+            v = rng.lognormvariate(math.log(max(a[0], 1e-6)), a[1])
+        else:
+            v = rng.expovariate(1.0 / a[0])
+        return max(0.0, v)
+
+
+class MockConfig:
+    def __init__(self, latency: str = "lognormal:0.8,0.5", error_rate: float = 0.0,
+                 rate_limit: float = 0.0, tps: float = 40.0, words: Tuple[int, int] = (8, 40),
+                 seed: Optional[int] = None) -> None:
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.tps = max(1.0, tps)
+        self.words = words
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def draw(self) -> Tuple[float, float]:
+        with self.lock:
+            return self.rng.random(), self.latency.sample(self.rng)
+
+    def count(self, key: str, delta: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += delta
+            if key == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+
+def reply_for(messages: List[Dict[str, Any]], words: Tuple[int, int] = (8, 40)) -> str:
+    """Детерминированный ответ по последнему сообщению пользователя."""
+    last = ""
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            last = str(m.get("content") or "")
+            break
+    rng = random.Random(hashlib.sha256(last.encode("utf-8")).digest())
+    out: List[str] = []
+    target = rng.randint(*words)
+    while sum(len(p.split()) for p in out) < target:
+        out.append(rng.choice(_PHRASES))
+    return " ".join(out)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = MockConfig()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _json(self, code: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/stats":
+            with self.config.lock:
+                self._json(200, dict(self.config.stats, latency=self.config.latency.spec))
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        cfg = self.config
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            self._json(400, {"error": {"message": "invalid json"}})
+            return
+        cfg.count("requests")
+        roll, delay = cfg.draw()
+        if roll < cfg.rate_limit:
+            cfg.count("rate_limited")
+            self._json(429, {"error": {"message": "rate limit (mock)"}}, {"Retry-After": "1"})
+            return
+        if roll < cfg.rate_limit + cfg.error_rate:
+            cfg.count("errors")
+            time.sleep(delay / 2)
+            self._json(500, {"error": {"message": "internal error (mock)"}})
+            return
+
+        messages = body.get("messages") or []
+        text = reply_for(messages, cfg.words)
+        usage = {
+            "prompt_tokens": sum(estimate_tokens(str(m.get("content") or "")) for m in messages),
+            "completion_tokens": estimate_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "mock")
+
+        cfg.count("in_flight")
+        try:
+            time.sleep(delay)  # время до первого токена
+            if body.get("stream"):
+                cfg.count("streams")
+                self._stream(text, model)
+            else:
+                time.sleep(usage["completion_tokens"] / cfg.tps)
+                self._json(200, {
+                    "id": "mock", "object": "chat.completion", "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # клиент отменил запрос
+        finally:
+            cfg.count("in_flight", -1)
+
+    def _stream(self, text: str, model: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(obj: Any) -> None:
+            data = ("data: " + (obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)) + "\n\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        words = text.split(" ")
+        for i, w in enumerate(words):
+            piece = w if i == 0 else " " + w
+            send({"object": "chat.completion.chunk", "model": model,
+                  "choices": [{"index": 0, "delta": {"content": piece}}]})
+            time.sleep(estimate_tokens(piece) / self.config.tps)
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512  # сотни одновременных подключений при нагрузочном тесте
+
+
+def make_server(host: str, port: int, config: MockConfig) -> ThreadingHTTPServer:
+    return _Server((host, port), type("MockHandler", (_Handler,), {"config": config}))
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, config: Optional[MockConfig] = None):
+    """Запустить mock в фоновом потоке; возвращает (server, url /v1/chat/completions)."""
+    server = make_server(host, port, config or MockConfig())
+    threading.Thread(target=server.serve_forever, name="llm-mock", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1/chat/completions"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:0.8,0.5", help="fixed:S | uniform:A,B | normal:M,SD | lognormal:MEDIAN,SIGMA | exp:MEAN")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429")
+    ap.add_argument("--tps", type=float, default=40.0, help="токенов в секунду при генерации")
+    ap.add_argument("--seed", type=int, default=None)
+    a = ap.parse_args(argv)
+    cfg = MockConfig(a.latency, a.error_rate, a.rate_limit, a.tps, seed=a.seed)
+    server = make_server(a.host, a.port, cfg)
+    print(f"[llm-mock] http://{a.host}:{a.port}/v1/chat/completions latency={a.latency} "
+          f"errors={a.error_rate} 429={a.rate_limit} tps={a.tps}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
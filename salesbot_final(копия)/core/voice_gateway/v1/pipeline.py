@@ -1,18 +1,30 @@
+import asyncio
+import contextvars
+import hashlib
+import json
 import os
+import queue
+import threading
 import time
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Iterator, List, Dict, Optional
 
-# Попробуем взять HTTP-клиент из integrations.patch_v4 / patch_v3
+# Попробуем взять HTTP-клиент из core.integrations.patch_v4 (пул keep-alive
+# соединений) / integrations.patch_v4 / patch_v3
 _HTTP_CLIENT = None
 try:
-    from integrations.patch_v4.http_client import http_post  # type: ignore
-    _HTTP_CLIENT = ("v4", http_post)
+    from core.integrations.patch_v4.http_client import http_post  # type: ignore
+    _HTTP_CLIENT = ("core", http_post)  # принимает retries= — повторы делает сам клиент LLM
 except Exception:
     try:
-        from integrations.patch_v3.http_client import http_post  # type: ignore
-        _HTTP_CLIENT = ("v3", http_post)
+        from integrations.patch_v4.http_client import http_post  # type: ignore
+        _HTTP_CLIENT = ("v4", http_post)
     except Exception:
-        _HTTP_CLIENT = None
+        try:
+            from integrations.patch_v3.http_client import http_post  # type: ignore
+            _HTTP_CLIENT = ("v3", http_post)
+        except Exception:
+            _HTTP_CLIENT = None
 
 # Фоллбек на requests (если есть)
 try:
@@ -20,6 +32,28 @@ try:
 except Exception:
     requests = None  # type: ignore
 
+# Async-транспорт: общий httpx.AsyncClient из patch_v4, иначе свой
+try:
+    from core.integrations.patch_v4.http_client import (  # type: ignore
+        aclose_async_client as _aclose_async_client, get_async_client as _get_async_client)
+except Exception:
+    _get_async_client = _aclose_async_client = None
+try:
+    import httpx  # type: ignore
+except Exception:
+    httpx = None  # type: ignore
+
+from .backends import LLMBackend, make_backend
+from .prompt import estimate_tokens, message_tokens
+from .ratelimit import PRIORITY_INTERACTIVE, QueueFull, RateLimiter
+from .resilience import CircuitBreaker, LatencyTracker, RetryBudget, backoff_delay
+
+# Дисковый уровень кэша ответов — kv-таблица core.state (если модуль доступен)
+try:
+    from core.state.v1 import get_store as _get_state_store  # type: ignore
+except Exception:
+    _get_state_store = None
+
 
 def _read_env(name: str, default: Optional[str] = None) -> Optional[str]:
     return os.environ.get(name, default)
@@ -63,9 +97,283 @@ def _normalize_messages_for_deepseek(
     return normalized
 
 
+# ---- Фоновый event loop для всех LLM-запросов процесса ----
+#
+# achat() из любого event loop (FastAPI, aiogram) и chat() из обычных потоков
+# выполняют запрос здесь: один RateLimiter (ratelimit.py) на процесс держит
+# лимиты RPM/TPM и число одновременных запросов, а отмена ожидающей задачи
+# отменяет и запрос.
+
+_LLM_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LLM_THREAD: Optional[threading.Thread] = None
+_LLM_LOCK = threading.Lock()
+_AHTTP = None
+_STREAM_END = object()  # маркер конца потока stream()/astream()
+
+
+class _Flight:
+    """Один общий вызов API и число ждущих его результата (single-flight)."""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class _ClientError(Exception):
+    """4xx от API (кроме 408/429): повторять бессмысленно, предохранитель не трогаем."""
+
+
+class _RateLimited(Exception):
+    """429 от API: лимитер уже поставлен на паузу, запрос можно повторить."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"HTTP 429: rate limited, retry after {retry_after:g}s")
+        self.retry_after = retry_after
+
+
+class LLMUnavailable(Exception):
+    """
+    Ответа от API нет (исчерпаны попытки, дедлайн, предохранитель, лимит).
+    chat()/achat() с fallback=True (по умолч.) вместо него отдают _local_echo;
+    status / retry_after — для HTTP-ответа прокси (429 / 502 / 503 / 504).
+    """
+
+    def __init__(self, message: str, status: int = 503, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+# приоритет текущего вызова в очереди лимитера (задаётся в llm-loop на время вызова)
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+def _retry_after(r: Any, default: float = 1.0) -> float:
+    """Retry-After из ответа 429 (секунды; HTTP-дату не разбираем — берём default)."""
+    try:
+        return max(0.0, float(r.headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return default
+
+
+def _llm_loop() -> asyncio.AbstractEventLoop:
+    global _LLM_LOOP, _LLM_THREAD
+    if _LLM_LOOP is not None:
+        return _LLM_LOOP
+    with _LLM_LOCK:
+        if _LLM_LOOP is None:
+            loop = asyncio.new_event_loop()
+            t = threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True)
+            t.start()
+            _LLM_THREAD = t
+            _LLM_LOOP = loop
+    return _LLM_LOOP
+
+
+def _async_http():
+    global _AHTTP
+    if _get_async_client is not None:
+        return _get_async_client()
+    if _AHTTP is None:
+        _AHTTP = httpx.AsyncClient()
+    return _AHTTP
+
+
+async def _aclose_http() -> None:
+    global _AHTTP
+    if _aclose_async_client is not None:
+        await _aclose_async_client()  # клиент именно этого loop (llm-loop)
+    client, _AHTTP = _AHTTP, None
+    if client is not None:
+        await client.aclose()
+
+
+def close_http(timeout: float = 5.0) -> None:
+    """
+    Закрыть keep-alive клиент к API. Он живёт в llm-loop, поэтому aclose тоже
+    выполняется там (run_coroutine_threadsafe); из другого loop его не закрыть.
+    Следующий запрос откроет клиент заново.
+    """
+    loop = _LLM_LOOP
+    if loop is None or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_aclose_http(), loop).result(timeout)
+    except Exception as e:  # noqa: BLE001
+        print(f"[voice_gateway] http close error: {e}")
+
+
+# ---- Кэш ответов LLM ----
+
+class _ResponseCache:
+    """
+    Кэш ответов по нормализованному ключу (model, messages, temperature).
+
+    Нормализация: роли как для DeepSeek, в тексте схлопываются пробелы и
+    регистр — "Сколько  стоит?" и "сколько стоит?" дают один ключ.
+    Уровни:
+      - память: LRU на LLM_CACHE_SIZE записей (по умолч. 1024) с TTL
+        LLM_CACHE_TTL сек (по умолч. 3600)
+      - диск (опционально): LLM_CACHE_DB=<файл SQLite> — kv-таблица core.state
+        с ключами "llm:<sha256>"; переживает рестарт и общий для процессов
+    LLM_CACHE=0 — выключить. В кэш попадают только настоящие ответы API,
+    локальный фоллбек не кэшируется.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 3600.0, db_path: Optional[str] = None,
+                 enabled: bool = True) -> None:
+        self.size = max(1, size)
+        self.ttl = ttl
+        self.db_path = db_path if _get_state_store is not None else None
+        self.enabled = enabled and ttl > 0
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypass = 0
+
+    @classmethod
+    def from_env(cls) -> "_ResponseCache":
+        return cls(
+            size=int(_read_env("LLM_CACHE_SIZE", "1024")),
+            ttl=float(_read_env("LLM_CACHE_TTL", "3600")),
+            db_path=_read_env("LLM_CACHE_DB") or None,
+            enabled=_read_env("LLM_CACHE", "1").lower() not in ("0", "false", "no", "off"),
+        )
+
+    @staticmethod
+    def key(model: Optional[str], messages: List[Dict[str, str]], temperature: Optional[float]) -> str:
+        norm = [
+            [m["role"], " ".join(str(m["content"]).split()).casefold()]
+            for m in _normalize_messages_for_deepseek(messages)
+        ]
+        raw = json.dumps([model, temperature, norm], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # -- память --
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+            return value
+
+    def _mem_put(self, key: str, value: str, expires: float) -> None:
+        with self._lock:
+            self._mem[key] = (expires, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.size:
+                self._mem.popitem(last=False)
+
+    # -- диск --
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if not self.db_path:
+            return None
+        try:
+            store = _get_state_store(self.db_path)
+            raw = store.get("llm:" + key)
+            if raw is None:
+                return None
+            rec = json.loads(raw)
+            if rec["exp"] < time.time():
+                store.delete("llm:" + key)  # остальное просроченное убирает sweeper (политика "llm")
+                return None
+        except Exception as e:  # noqa: BLE001
+            print(f"[voice_gateway] llm cache read error: {e}")
+            return None
+        self._mem_put(key, rec["out"], rec["exp"])
+        return rec["out"]
+
+    def _disk_put(self, key: str, value: str, expires: float) -> None:
+        if not self.db_path:
+            return
+        try:
+            rec = json.dumps({"exp": expires, "out": value}, ensure_ascii=False)
+            _get_state_store(self.db_path).set("llm:" + key, rec)
+        except Exception as e:  # noqa: BLE001
+            print(f"[voice_gateway] llm cache write error: {e}")
+
+    # -- API --
+
+    def _count(self, value: Optional[str], disk: bool) -> Optional[str]:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += int(disk)
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._mem_get(key)
+        if value is not None:
+            return self._count(value, False)
+        value = self._disk_get(key)
+        return self._count(value, value is not None)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Как get(), но чтение с диска — в пуле потоков, не в event loop."""
+        value = self._mem_get(key)
+        if value is not None or not self.db_path:
+            return self._count(value, False)
+        value = await asyncio.get_running_loop().run_in_executor(None, self._disk_get, key)
+        return self._count(value, value is not None)
+
+    def set(self, key: str, value: str) -> None:
+        expires = time.time() + self.ttl
+        self._mem_put(key, value, expires)
+        self._disk_put(key, value, expires)
+        with self._lock:
+            self.stores += 1
+
+    async def aset(self, key: str, value: str) -> None:
+        expires = time.time() + self.ttl
+        self._mem_put(key, value, expires)
+        if self.db_path:
+            await asyncio.get_running_loop().run_in_executor(None, self._disk_put, key, value, expires)
+        with self._lock:
+            self.stores += 1
+
+    def skip(self) -> None:
+        with self._lock:
+            self.bypass += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._mem),
+                "capacity": self.size,
+                "ttl": self.ttl,
+                "disk": self.db_path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "bypass": self.bypass,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
 class _LLMClient:
     """
-    Обёртка над DeepSeek (или совместимым сервисом).
+    Обёртка над DeepSeek (или совместимым сервисом). Провайдер — backend
+    (см. backends.py, LLM_BACKEND=deepseek|openai|mock).
 
     Ожидаемый API (по сути как OpenAI /chat/completions):
       POST {api_url}
@@ -80,46 +388,596 @@ class _LLMClient:
       response:
         либо { "output": "..." }
         либо { "choices": [ { "message": { "content": "..." } } ] }
+
+    achat() — нативный async-вызов (не блокирует event loop): общий дедлайн
+    LLM_DEADLINE сек (по умолч. 60; ожидание в очереди входит в него), отмена
+    задачи отменяет HTTP-запрос. chat() — синхронная обёртка над тем же.
+
+    Перед API стоит RateLimiter (ratelimit.py): LLM_RPM / LLM_TPM, не больше
+    LLM_MAX_CONCURRENCY (8) запросов одновременно, очередь по priority —
+    PRIORITY_INTERACTIVE (по умолч.) обгоняет PRIORITY_BACKGROUND. Токены запроса
+    оцениваются заранее (промпт + LLM_EST_COMPLETION, 200) и уточняются по usage.
+    429 от API ставит очередь на паузу по Retry-After и повторяется, но не
+    считается отказом для предохранителя. fallback=False — вместо _local_echo
+    поднимается LLMUnavailable (status / retry_after для HTTP-ответа).
+
+    Повторные одинаковые запросы отдаются из кэша (см. _ResponseCache);
+    cache=False в chat()/achat() — обойти кэш для конкретного вызова.
+
+    stream()/astream() — то же с "stream": true: текст отдаётся кусками по мере
+    генерации (SSE chat.completion.chunk), первый кусок — через сотни мс.
+
+    Сбои API (см. resilience.py): HTTP_RETRIES — всего попыток на вызов (HTTP-слой
+    сам не повторяет), между ними пауза с джиттером; повторы тратят общий
+    RetryBudget; после LLM_CB_FAILURES ошибок подряд предохранитель открывается
+    и вызовы сразу получают _local_echo, через LLM_CB_RESET сек — один пробный.
+    LLM_HEDGE=1 — если ответа нет дольше p95, параллельно уходит второй запрос.
+
+    Одновременные одинаковые chat()/achat() (тот же нормализованный ключ, что у
+    кэша) делят один запрос к API; отменяется он, только когда его перестали
+    ждать все. Счётчики — stats()["singleflight"].
     """
 
-    def __init__(self) -> None:
-        self.api_url = _read_env(
-            "DEEPSEEK_API_URL",
-            "https://api.deepseek.com/v1/chat/completions",
-        )
-        self.api_key = _read_env("DEEPSEEK_API_KEY", None)
+    def __init__(self, backend: Optional[LLMBackend] = None) -> None:
+        self.backend = backend or make_backend()
+        self.api_url = self.backend.api_url
+        self.api_key = self.backend.api_key
         self.timeout = float(_read_env("HTTP_TIMEOUT", "15"))
         self.retries = int(_read_env("HTTP_RETRIES", "2"))
-        self.model = _read_env("DEEPSEEK_MODEL", "deepseek-chat")
+        self.model = self.backend.model
+        self.max_concurrency = int(_read_env("LLM_MAX_CONCURRENCY", "8"))
+        self.limiter = RateLimiter.from_env(self.max_concurrency)
+        self.est_completion = int(_read_env("LLM_EST_COMPLETION", "200"))
+        self.deadline = float(_read_env("LLM_DEADLINE", "60"))
+        self.cache = _ResponseCache.from_env()
+        self.breaker = CircuitBreaker()
+        self.retry_budget = RetryBudget()
+        self.latency = LatencyTracker()
+        self.hedge = _read_env("LLM_HEDGE", "0").lower() in ("1", "true", "yes", "on")
+        self.hedge_min_delay = float(_read_env("LLM_HEDGE_MIN_DELAY", "0.5"))
+        self.hedges = 0
+        self._inflight: Dict[str, _Flight] = {}  # только из llm-loop
+        self.flights = 0
+        self.coalesced = 0
 
-    def chat(self, messages: List[Dict[str, str]]) -> str:
+    def _offline(self) -> bool:
         # Если ключа нет или вообще нет HTTP-клиента — локальный коуч-ответ
-        if not self.api_key or (_HTTP_CLIENT is None and requests is None):
-            return self._local_echo(messages)
+        if self.backend.requires_key() and not self.api_key:
+            return True
+        return _HTTP_CLIENT is None and requests is None and httpx is None
 
-        safe_messages = _normalize_messages_for_deepseek(messages)
+    def _request(self, messages: List[Dict[str, str]], temperature: Optional[float] = None):
+        return self.backend.payload(messages, temperature), self.backend.headers()
 
-        payload: Dict[str, object] = {
-            "model": self.model,
-            "messages": safe_messages,
-        }
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
+    def _extract(self, data) -> Optional[str]:
+        return self.backend.extract(data)
+
+    def _cache_key(self, messages: List[Dict[str, str]], temperature: Optional[float], cache: bool) -> Optional[str]:
+        if not self.cache.enabled:
+            return None
+        if not cache:
+            self.cache.skip()
+            return None
+        return self.cache.key(self.model, messages, temperature)
+
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float] = None,
+        temperature: Optional[float] = None,
+        cache: bool = True,
+        priority: int = PRIORITY_INTERACTIVE,
+        fallback: bool = True,
+    ) -> str:
+        """Синхронный вызов для потоков без event loop (движки, бот на requests)."""
+        if self._offline():
+            return self._offline_reply(messages, fallback)
+        key = self._cache_key(messages, temperature, cache)
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+        try:
+            if httpx is None or threading.current_thread() is _LLM_THREAD:
+                return self._chat_blocking(messages, temperature, key)
+            fut = asyncio.run_coroutine_threadsafe(
+                self._achat(messages, deadline, temperature, key, priority), _llm_loop()
+            )
+            try:
+                return fut.result()
+            except BaseException:
+                fut.cancel()
+                raise
+        except LLMUnavailable as e:
+            if not fallback:
+                raise
+            return self._local_echo(messages, error=str(e))
+
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float] = None,
+        temperature: Optional[float] = None,
+        cache: bool = True,
+        priority: int = PRIORITY_INTERACTIVE,
+        fallback: bool = True,
+    ) -> str:
+        """
+        Async-вызов: await не держит event loop вызывающего. Отмена задачи
+        (asyncio.CancelledError) прерывает и запрос к API.
+        """
+        if self._offline():
+            return self._offline_reply(messages, fallback)
+        key = self._cache_key(messages, temperature, cache)
+        if key is not None:
+            hit = await self.cache.aget(key)
+            if hit is not None:
+                return hit
+        try:
+            if httpx is None:
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self._chat_blocking, messages, temperature, key
+                )
+            fut = asyncio.run_coroutine_threadsafe(
+                self._achat(messages, deadline, temperature, key, priority), _llm_loop()
+            )
+            return await asyncio.wrap_future(fut)
+        except LLMUnavailable as e:
+            if not fallback:
+                raise
+            return self._local_echo(messages, error=str(e))
+
+    def _offline_reply(self, messages: List[Dict[str, str]], fallback: bool) -> str:
+        if not fallback:
+            raise LLMUnavailable("LLM API key is not configured", 503)
+        return self._local_echo(messages)
+
+    async def _achat(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+        temperature: Optional[float] = None,
+        key: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> str:
+        # выполняется в llm-loop; одинаковые запросы в полёте склеиваются
+        # (место в очереди лимитера — по приоритету первого из них)
+        fkey = self.cache.key(self.model, messages, temperature)
+        flight = self._inflight.get(fkey)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(self._achat_once(messages, deadline, temperature, key, priority)))
+            self._inflight[fkey] = flight
+            flight.task.add_done_callback(lambda _t, k=fkey, f=flight: self._forget_flight(k, f))
+            self.flights += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # результат больше никому не нужен — отменяем и сам запрос
+                self._forget_flight(fkey, flight)
+                flight.task.cancel()
+
+    def _forget_flight(self, fkey: str, flight: _Flight) -> None:
+        if self._inflight.get(fkey) is flight:
+            del self._inflight[fkey]
+
+    async def _achat_once(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+        temperature: Optional[float] = None,
+        key: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> str:
+        _PRIORITY.set(priority)  # своя копия контекста у задачи — видна в _post_once
+        try:
+            return await asyncio.wait_for(self._acall(messages, temperature, key), deadline or self.deadline)
+        except asyncio.TimeoutError:
+            raise LLMUnavailable("deadline exceeded", 504) from None
+
+    async def _acall(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        key: Optional[str] = None,
+    ) -> str:
+        payload, headers = self._request(messages, temperature)
+        last_err: Optional[str] = None
+        status, retry_after = 503, None
+        for attempt in range(max(1, self.retries)):
+            ticket = self._may_attempt(attempt)
+            if ticket is None:
+                if last_err is None:
+                    last_err, retry_after = "circuit open", self.breaker.reset
+                break
+            try:
+                if attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                out = await self._hedged(payload, headers)
+                if key is not None:
+                    await self.cache.aset(key, out)
+                return out
+            except _RateLimited as e:
+                last_err, status, retry_after = str(e), 429, e.retry_after
+            except QueueFull as e:
+                raise LLMUnavailable(str(e), 503, 1.0) from None
+            except _ClientError as e:
+                last_err, status, retry_after = str(e), 502, None
+                break
+            except Exception as e:  # noqa: BLE001
+                last_err, status, retry_after = str(e), 503, None
+            finally:
+                # пробный запрос без итога (отмена, 429, очередь) не держит half_open навсегда
+                self.breaker.release_probe(ticket)
+        raise LLMUnavailable(last_err or "no response", status, retry_after)
+
+    # ---- Повторы, предохранитель, hedged-запросы ----
+
+    def _may_attempt(self, attempt: int) -> Optional[int]:
+        """
+        Первая попытка — если пускает предохранитель; повтор — ещё и из общего
+        бюджета. None — нельзя, иначе билет предохранителя (CircuitBreaker.acquire).
+        """
+        ticket = self.breaker.acquire()
+        if ticket is None:
+            return None
+        if attempt == 0 or self.retry_budget.acquire():
+            return ticket
+        self.breaker.release_probe(ticket)
+        return None
+
+    def _record(self, ok: bool, started: Optional[float] = None) -> None:
+        if ok:
+            self.breaker.record_success()
+            self.retry_budget.record_success()
+            if started is not None:
+                self.latency.add(time.monotonic() - started)
+        else:
+            self.breaker.record_failure()
+
+    async def _post_once(self, payload: Dict[str, object], headers: Dict[str, str]) -> str:
+        """
+        Один HTTP-запрос через лимитер: ответ или исключение; итог учитывается
+        предохранителем.
+        """
+        est = self._estimate(payload)
+        try:
+            async with self.limiter.slot(est, _PRIORITY.get()):
+                started = time.monotonic()
+                r = await _async_http().post(self.api_url, json=payload, headers=headers, timeout=self.timeout)
+                if r.status_code == 429:
+                    self._throttled(est, _retry_after(r))
+                if 400 <= r.status_code < 500 and r.status_code != 408:
+                    # ошибка запроса (ключ, формат) — API живо, повтор не поможет
+                    self._record(True)
+                    self.limiter.settle(est, 0)
+                    raise _ClientError(f"HTTP {r.status_code}: {r.text[:200]}")
+                r.raise_for_status()
+                data = r.json()
+                self.limiter.settle(est, self._usage(data))
+            out = self._extract(data)
+            if out is None:
+                raise ValueError(f"unexpected response: {str(data)[:200]}")
+        except (_ClientError, _RateLimited, QueueFull):
+            raise
+        except Exception:
+            self._record(False)
+            raise
+        self._record(True, started)
+        return out
+
+    def _estimate(self, payload: Dict[str, Any]) -> int:
+        """Оценка токенов запроса для TPM: промпт + ожидаемый ответ."""
+        return sum(message_tokens(m) for m in payload.get("messages") or []) + self.est_completion
+
+    @staticmethod
+    def _usage(data: Any) -> Optional[int]:
+        usage = data.get("usage") if isinstance(data, dict) else None
+        total = usage.get("total_tokens") if isinstance(usage, dict) else None
+        return total if isinstance(total, int) else None
+
+    def _throttled(self, est: int, retry_after: float) -> None:
+        """429: пауза очереди, токены не списаны; API отвечает — для предохранителя это не отказ."""
+        self.limiter.penalize(retry_after)
+        self.limiter.settle(est, 0)
+        self.breaker.record_success()
+        raise _RateLimited(retry_after)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.latency.p95()
+        return None if p95 is None else max(self.hedge_min_delay, p95)
+
+    async def _hedged(self, payload: Dict[str, object], headers: Dict[str, str]) -> str:
+        """
+        Запрос с подстраховкой: нет ответа дольше p95 — второй такой же запрос
+        (из бюджета повторов), берём первый успешный, второй отменяем.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._post_once(payload, headers)
+        first = asyncio.ensure_future(self._post_once(payload, headers))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        ticket = None if done or self.limiter.depth else self.breaker.acquire()
+        if ticket is None or not self.retry_budget.acquire():
+            # очередь к API не пуста — второй запрос только отнял бы слот у других
+            self.breaker.release_probe(ticket)
+            return await first
+        self.hedges += 1
+        second = asyncio.ensure_future(self._post_once(payload, headers))
+        pending = {first, second}
+        err: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    err = t.exception()
+            assert err is not None
+            raise err
+        finally:
+            self.breaker.release_probe(ticket)
+            for t in (first, second):
+                if not t.done():
+                    t.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.stats(),
+            "retry_budget": self.retry_budget.stats(),
+            "p95": self.latency.p95(),
+            "hedges": self.hedges,
+            "limiter": self.limiter.stats(),
+            "singleflight": {
+                "inflight": len(self._inflight),
+                "flights": self.flights,
+                "coalesced": self.coalesced,
+            },
+            "cache": self.cache.stats(),
         }
 
+    # ---- Потоковый режим ----
+
+    @staticmethod
+    def _sse_chunk(line: str) -> Optional[str]:
+        """Текст из строки SSE "data: {...}" (delta.content); None — служебная строка."""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            return None
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            return None
+        choices = obj.get("choices") if isinstance(obj, dict) else None
+        if not choices:
+            return None
+        delta = choices[0].get("delta") or choices[0].get("message") or {}
+        content = delta.get("content")
+        return content if isinstance(content, str) else None
+
+    def stream(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float] = None,
+        temperature: Optional[float] = None,
+        cache: bool = True,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Iterator[str]:
+        """Синхронный генератор кусков ответа (для потоков без event loop)."""
+        if self._offline():
+            yield self._local_echo(messages)
+            return
+        key = self._cache_key(messages, temperature, cache)
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                yield hit
+                return
+        if httpx is None or threading.current_thread() is _LLM_THREAD:
+            yield self._chat_blocking_or_echo(messages, temperature, key)
+            return
+        q: "queue.Queue" = queue.Queue()
+        fut = asyncio.run_coroutine_threadsafe(
+            self._astream(messages, deadline, temperature, key, q.put, priority), _llm_loop()
+        )
+        try:
+            while True:
+                item = q.get()
+                if item is _STREAM_END:
+                    break
+                yield item
+        finally:
+            fut.cancel()
+
+    async def astream(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float] = None,
+        temperature: Optional[float] = None,
+        cache: bool = True,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncIterator[str]:
+        """
+        Async-итератор кусков ответа. Прекращение итерации (или отмена задачи)
+        закрывает и поток от API.
+        """
+        if self._offline():
+            yield self._local_echo(messages)
+            return
+        key = self._cache_key(messages, temperature, cache)
+        if key is not None:
+            hit = await self.cache.aget(key)
+            if hit is not None:
+                yield hit
+                return
+        loop = asyncio.get_running_loop()
+        if httpx is None:
+            yield await loop.run_in_executor(None, self._chat_blocking_or_echo, messages, temperature, key)
+            return
+        q: "asyncio.Queue" = asyncio.Queue()
+
+        def emit(item) -> None:
+            try:
+                loop.call_soon_threadsafe(q.put_nowait, item)
+            except RuntimeError:
+                pass  # loop вызывающего уже закрыт
+
+        fut = asyncio.run_coroutine_threadsafe(
+            self._astream(messages, deadline, temperature, key, emit, priority), _llm_loop()
+        )
+        try:
+            while True:
+                item = await q.get()
+                if item is _STREAM_END:
+                    break
+                yield item
+        finally:
+            fut.cancel()
+
+    async def _astream(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+        temperature: Optional[float],
+        key: Optional[str],
+        emit: Callable[[Any], None],
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> None:
+        # выполняется в llm-loop; куски и _STREAM_END отдаются через emit
+        _PRIORITY.set(priority)
+        parts: List[str] = []
+        try:
+            await asyncio.wait_for(
+                self._astream_call(messages, temperature, key, emit, parts), deadline or self.deadline
+            )
+        except asyncio.TimeoutError:
+            if not parts:
+                emit(self._local_echo(messages, error="deadline exceeded"))
+        finally:
+            emit(_STREAM_END)
+
+    async def _astream_call(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        key: Optional[str],
+        emit: Callable[[Any], None],
+        parts: List[str],
+    ) -> None:
+        payload, headers = self._request(messages, temperature)
+        payload["stream"] = True
         last_err: Optional[str] = None
+        for attempt in range(max(1, self.retries)):
+            ticket = self._may_attempt(attempt)
+            if ticket is None:
+                last_err = last_err or "circuit open"
+                break
+            est = self._estimate(payload)
+            try:
+                if attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                async with self.limiter.slot(est, _PRIORITY.get()):
+                    started = time.monotonic()
+                    async with _async_http().stream(
+                        "POST", self.api_url, json=payload, headers=headers, timeout=self.timeout
+                    ) as r:
+                        if r.status_code == 429:
+                            self._throttled(est, _retry_after(r))
+                        if 400 <= r.status_code < 500 and r.status_code != 408:
+                            # как в _post_once: API живо, ошибка в запросе — без повтора
+                            # и без счёта в предохранитель
+                            self._record(True)
+                            self.limiter.settle(est, 0)
+                            body = (await r.aread()).decode("utf-8", "replace")
+                            raise _ClientError(f"HTTP {r.status_code}: {body[:200]}")
+                        r.raise_for_status()
+                        if "text/event-stream" in r.headers.get("content-type", ""):
+                            async for line in r.aiter_lines():
+                                if line.strip() == "data: [DONE]":
+                                    break
+                                chunk = self._sse_chunk(line)
+                                if chunk:
+                                    parts.append(chunk)
+                                    emit(chunk)
+                        else:
+                            # сервис проигнорировал stream — пришёл обычный JSON целиком
+                            out = self._extract(json.loads(await r.aread()))
+                            if out:
+                                parts.append(out)
+                                emit(out)
+                    # в стриме нет usage — списываем оценку по полученному тексту
+                    self.limiter.settle(est, est - self.est_completion + estimate_tokens("".join(parts)))
+                if parts:
+                    self._record(True, started)
+                    if key is not None:
+                        await self.cache.aset(key, "".join(parts))
+                    return
+                last_err = "empty stream"
+                self._record(False)
+            except _RateLimited as e:
+                last_err = str(e)
+            except QueueFull as e:
+                last_err = str(e)
+                break
+            except _ClientError as e:
+                last_err = str(e)
+                break
+            except Exception as e:  # noqa: BLE001
+                self._record(False)
+                if parts:
+                    return  # часть ответа уже отдана — повтор дал бы дубли
+                last_err = str(e)
+            finally:
+                self.breaker.release_probe(ticket)
+        emit(self._local_echo(messages, error=last_err))
 
-        for _ in range(max(1, self.retries)):
+    def _chat_blocking(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        key: Optional[str] = None,
+    ) -> str:
+        # Старый блокирующий путь (нет httpx): http_post из patch_* или requests
+        payload, headers = self._request(messages, temperature)
+        last_err: Optional[str] = None
+        deadline = time.monotonic() + self.deadline
+
+        for attempt in range(max(1, self.retries)):
+            ticket = self._may_attempt(attempt)
+            if ticket is None:
+                last_err = last_err or "circuit open"
+                break
+            if attempt:
+                pause = backoff_delay(attempt)
+                if time.monotonic() + pause >= deadline:
+                    self.breaker.release_probe(ticket)
+                    break
+                time.sleep(pause)
+            started = time.monotonic()
             try:
                 # Вариант через integrations.patch_*
                 if _HTTP_CLIENT is not None:
-                    _, http_post = _HTTP_CLIENT
+                    kind, http_post = _HTTP_CLIENT
+                    # повторы — только здесь, HTTP-слой делает одну попытку
+                    extra = {"retries": 1} if kind == "core" else {}
                     resp = http_post(
                         self.api_url,
                         json=payload,
                         headers=headers,
                         timeout=self.timeout,
+                        **extra,
                     )
                     data = resp if isinstance(resp, dict) else {}
                 else:
@@ -133,25 +991,34 @@ class _LLMClient:
                     )
                     data = r.json()
 
-                if isinstance(data, dict):
-                    # Вариант { "output": "..." }
-                    if "output" in data and isinstance(data["output"], str):
-                        return data["output"]
-
-                    # Вариант OpenAI-стиля с choices
-                    if "choices" in data and data["choices"]:
-                        ch = data["choices"][0]
-                        msg = (ch.get("message") or {}).get("content")
-                        if isinstance(msg, str):
-                            return msg
+                out = self._extract(data)
+                if out is not None:
+                    self._record(True, started)
+                    if key is not None:
+                        self.cache.set(key, out)
+                    return out
 
                 last_err = f"unexpected response: {str(data)[:200]}"
+                self._record(False)
             except Exception as e:  # noqa: BLE001
                 last_err = str(e)
-                time.sleep(0.25)
+                self._record(False)
+            finally:
+                self.breaker.release_probe(ticket)
 
-        # Если всё упало — аккуратно деградируем
-        return self._local_echo(messages, error=last_err)
+        # Если всё упало — решает вызывающий: _local_echo или LLMUnavailable
+        raise LLMUnavailable(last_err or "no response", 503)
+
+    def _chat_blocking_or_echo(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        key: Optional[str] = None,
+    ) -> str:
+        try:
+            return self._chat_blocking(messages, temperature, key)
+        except LLMUnavailable as e:
+            return self._local_echo(messages, error=str(e))
 
     def _local_echo(
         self,
@@ -217,12 +1084,33 @@ class VoicePipeline:
     """
     Основной фасад голосового шлюза.
     Содержит:
-      - llm: чат-API (DeepSeek + фоллбек)
+      - llm: чат-API (DeepSeek / OpenAI-совместимый / mock + фоллбек)
       - asr: распознавание (стаб)
       - tts: синтез (стаб)
     """
 
-    def __init__(self) -> None:
-        self.llm = _LLMClient()
+    def __init__(self, backend: Optional[LLMBackend] = None) -> None:
+        self.llm = _LLMClient(backend)
         self.asr = _ASRStub()
-        self.tts = _TTSStub()
\ No newline at end of file
+        self.tts = _TTSStub()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """На shutdown приложения: закрыть HTTP-клиент LLM (блокирующий вызов)."""
+        close_http(timeout)
+
+
+_PIPELINE: Optional[VoicePipeline] = None
+_PIPELINE_LOCK = threading.Lock()
+
+
+def get_pipeline() -> VoicePipeline:
+    """
+    Общий VoicePipeline на процесс. Движки создаются на каждый запрос —
+    пайплайн (и его HTTP-пул) переиспользуется между ними.
+    """
+    global _PIPELINE
+    if _PIPELINE is None:
+        with _PIPELINE_LOCK:
+            if _PIPELINE is None:
+                _PIPELINE = VoicePipeline()
+    return _PIPELINE
@@ -0,0 +1,262 @@
+"""
+Сборка промпта из истории сессии в пределах бюджета токенов.
+
+Промпт = system (+ краткое содержание прошлого разговора) + последние ходы
++ текущее сообщение. Размер не растёт с длиной сессии:
+  - токены считаются локально (estimate_tokens, без токенизатора)
+  - в промпт попадают последние PROMPT_WINDOW ходов (по умолч. 12), пока
+    хватает бюджета модуля
+  - ходы, выпавшие из окна, сворачиваются в rolling summary; оно хранится
+    в state.meta и обновляется инкрементально — только новыми выпавшими ходами
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .ratelimit import PRIORITY_BACKGROUND
+
+# Бюджет токенов на один запрос по модулям (PROMPT_BUDGETS="arena=1000,...")
+DEFAULT_BUDGET = 1500
+DEFAULT_BUDGETS: Dict[str, int] = {
+    "arena": 1500,
+    "sleeping_dragon": 1500,
+}
+
+_MSG_OVERHEAD = 4  # служебные токены на каждое сообщение chat-формата
+_SUMMARY_HEADER = "Кратко о предыдущем разговоре:"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая локальная оценка: ~4 символа на токен для латиницы и цифр,
+    ~2.5 для кириллицы и прочего (BPE-токенизаторы режут её мельче).
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other = len(text) - ascii_chars
+    return max(1, math.ceil(ascii_chars / 4 + other / 2.5))
+
+
+def message_tokens(m: Dict[str, Any]) -> int:
+    return estimate_tokens(str(m.get("content") or "")) + _MSG_OVERHEAD
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def load_budgets() -> Dict[str, int]:
+    """DEFAULT_BUDGETS + переопределения из PROMPT_BUDGETS, например "arena=800,sleeping_dragon=2000"."""
+    budgets = dict(DEFAULT_BUDGETS)
+    for part in os.environ.get("PROMPT_BUDGETS", "").split(","):
+        if "=" not in part:
+            continue
+        module, val = part.split("=", 1)
+        try:
+            budgets[module.strip()] = int(val)
+        except ValueError:
+            print(f"[voice_gateway] bad PROMPT_BUDGETS entry: {part!r}")
+    return budgets
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class PromptBuilder:
+    """
+    builder = PromptBuilder("arena", llm=get_pipeline().llm)
+    messages = builder.build(system, state.history, user=text, meta=state.meta)
+
+    role_map переводит роли истории движка в роли чата с точки зрения модели
+    (например {"seller": "user", "client": "assistant"}).
+
+    Краткое содержание (PROMPT_SUMMARY):
+      local — выжимка из самих реплик, без вызовов API (по умолч.)
+      llm   — LLM дописывает summary пачками по PROMPT_SUMMARY_BATCH ходов (4);
+              пока пачка не набралась, выпавшие ходы идут локальной выжимкой
+    Размер summary — не больше PROMPT_SUMMARY_TOKENS (по умолч. 300).
+
+    build(..., defer=True) — для async-обработчиков: LLM-конспект не строится
+    внутри build (синхронный вызов API блокировал бы event loop и задерживал
+    ответ), выпавшие ходы идут локальной выжимкой, а в self.deferred остаётся
+    (прежний конспект, ходы, summary_upto) — обновить его в фоне через
+    await asummarize(...) и сохранить, как удобно движку.
+    """
+
+    def __init__(
+        self,
+        module: str,
+        budget: Optional[int] = None,
+        window: Optional[int] = None,
+        summary_tokens: Optional[int] = None,
+        role_map: Optional[Dict[str, str]] = None,
+        llm: Any = None,
+    ) -> None:
+        self.module = module
+        self.budget = budget or load_budgets().get(module) or _env_int("PROMPT_BUDGET", DEFAULT_BUDGET)
+        self.window = max(0, window if window is not None else _env_int("PROMPT_WINDOW", 12))
+        self.summary_tokens = summary_tokens or _env_int("PROMPT_SUMMARY_TOKENS", 300)
+        self.role_map = role_map or {}
+        self.llm = llm
+        self.summary_mode = os.environ.get("PROMPT_SUMMARY", "local").lower()
+        self.summary_batch = max(1, _env_int("PROMPT_SUMMARY_BATCH", 4))
+        self.deferred: Optional[Tuple[str, List[Any], int]] = None
+
+    # ---- окно ----
+
+    def _turn(self, item: Any) -> Optional[Dict[str, str]]:
+        if not isinstance(item, dict) or not item.get("content"):
+            return None
+        role = str(item.get("role") or "user")
+        return {"role": self.role_map.get(role, role), "content": str(item["content"])}
+
+    def build(
+        self,
+        system: str,
+        history: Sequence[Any],
+        user: Optional[str] = None,
+        meta: Optional[Dict[str, Any]] = None,
+        upto: Optional[int] = None,
+        defer: bool = False,
+    ) -> List[Dict[str, str]]:
+        """
+        history — state.history (list или TurnLog); upto — учитывать только
+        history[:upto] (если текущее сообщение уже добавлено в историю).
+        meta — словарь состояния, где кэшируется summary (summary / summary_upto).
+        defer — не вызывать LLM для конспекта (см. docstring класса).
+        """
+        self.deferred = None
+        base = getattr(history, "base", 0)
+        n = len(history) if upto is None else max(0, min(upto, len(history)))
+        tail = [{"role": "user", "content": user}] if user else []
+
+        fixed = estimate_tokens(system) + _MSG_OVERHEAD + sum(message_tokens(m) for m in tail)
+        avail = self.budget - fixed - (self.summary_tokens + _MSG_OVERHEAD)
+
+        window: List[Dict[str, str]] = []
+        keep_from = n
+        used = 0
+        for i in range(n - 1, -1, -1):
+            if len(window) >= self.window:
+                break
+            turn = self._turn(history[i])
+            if turn is None:
+                keep_from = i
+                continue
+            cost = message_tokens(turn)
+            if used + cost > avail:
+                break
+            window.append(turn)
+            used += cost
+            keep_from = i
+        window.reverse()
+
+        summary = self._summary(history, base, keep_from, meta, defer)
+        if summary:
+            system = f"{system}\n\n{_SUMMARY_HEADER}\n{summary}"
+        return [{"role": "system", "content": system}] + window + tail
+
+    # ---- rolling summary ----
+
+    def _local_lines(self, turns: Sequence[Any]) -> List[str]:
+        lines = []
+        for item in turns:
+            turn = self._turn(item)
+            if turn is not None:
+                lines.append(f"- {item.get('role', 'user')}: {_clip(turn['content'], 160)}")
+        return lines
+
+    def _fit(self, lines: List[str]) -> str:
+        """Оставить самые свежие строки, укладывающиеся в summary_tokens."""
+        out: List[str] = []
+        used = 0
+        for line in reversed(lines):
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.summary_tokens:
+                break
+            out.append(line)
+            used += cost
+        out.reverse()
+        return "\n".join(out)
+
+    def _summary(self, history: Sequence[Any], base: int, keep_from: int,
+                 meta: Optional[Dict[str, Any]], defer: bool = False) -> str:
+        meta = meta if meta is not None else {}
+        cached = meta.get("summary") or ""
+        upto = int(meta.get("summary_upto") or 0)
+        boundary = base + keep_from          # seq первого хода в окне
+        if boundary <= upto:
+            return cached
+        # ходы [upto, boundary) выпали из окна и ещё не в summary; то, что левее
+        # base, уже вытеснено из памяти — его не восстановить
+        pending = list(history[max(0, upto - base):keep_from])
+
+        if self.summary_mode == "llm" and self.llm is not None:
+            if len(pending) < self.summary_batch:
+                # пачка не набралась — этим ходам хватит локальной выжимки в этот раз
+                return self._fit(cached.splitlines() + self._local_lines(pending))
+            if defer:
+                # meta не трогаем: пока фоновый конспект не готов, ходы считаются невыпавшими
+                self.deferred = (cached, pending, boundary)
+                return self._fit(cached.splitlines() + self._local_lines(pending))
+            text = self._llm_summary(cached, pending)
+            if text is not None:
+                meta["summary"] = text
+                meta["summary_upto"] = boundary
+                return text
+
+        text = self._fit(cached.splitlines() + self._local_lines(pending))
+        meta["summary"] = text
+        meta["summary_upto"] = boundary
+        return text
+
+    def _summary_unavailable(self) -> bool:
+        breaker = getattr(self.llm, "breaker", None)
+        # иначе в summary попал бы локальный ответ-заглушка
+        return getattr(self.llm, "_offline", lambda: False)() or (breaker is not None and breaker.state != "closed")
+
+    def _summary_prompt(self, previous: str, turns: Sequence[Any]) -> List[Dict[str, str]]:
+        words = max(20, int(self.summary_tokens / 2))
+        return [
+            {"role": "system", "content": (
+                "Ты ведёшь краткий конспект тренировочного диалога продавца с клиентом. "
+                f"Обнови конспект новыми репликами. Не больше {words} слов, только факты: "
+                "что клиент сказал о себе, возражения, договорённости, тон."
+            )},
+            {"role": "user", "content": (
+                f"Текущий конспект:\n{previous or '(пусто)'}\n\nНовые реплики:\n"
+                + "\n".join(self._local_lines(turns))
+            )},
+        ]
+
+    def _llm_summary(self, previous: str, turns: Sequence[Any]) -> Optional[str]:
+        if self._summary_unavailable():
+            return None
+        try:
+            # конспект — фоновая работа: в очереди к API уступает ходам пользователей
+            # fallback=False: при сбое API — LLMUnavailable, а не заглушка в конспекте
+            text = self.llm.chat(self._summary_prompt(previous, turns),
+                                 priority=PRIORITY_BACKGROUND, fallback=False)
+        except Exception as e:  # noqa: BLE001
+            print(f"[voice_gateway] summary error: {e}")
+            return None
+        return self._fit(str(text).splitlines())
+
+    async def asummarize(self, previous: str, turns: Sequence[Any]) -> Optional[str]:
+        """Async-вариант LLM-конспекта для self.deferred; None — API недоступно."""
+        if self.llm is None or self._summary_unavailable():
+            return None
+        try:
+            text = await self.llm.achat(self._summary_prompt(previous, turns),
+                                        priority=PRIORITY_BACKGROUND, fallback=False)
+        except Exception as e:  # noqa: BLE001
+            print(f"[voice_gateway] summary error: {e}")
+            return None
+        return self._fit(str(text).splitlines())
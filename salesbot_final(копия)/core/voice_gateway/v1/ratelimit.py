@@ -0,0 +1,231 @@
+"""
+Клиентский лимитер запросов к API LLM: token bucket на запросы в минуту (RPM)
+и токены в минуту (TPM), предел одновременных запросов и очередь с
+приоритетами — интерактивные ходы обгоняют фоновые задачи.
+
+Живёт в llm-loop (см. pipeline.py): все методы вызываются из одного event loop,
+поэтому без блокировок.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from .resilience import LatencyTracker
+
+# Приоритеты: меньше — раньше
+PRIORITY_INTERACTIVE = 0   # ход пользователя, он ждёт ответа
+PRIORITY_BACKGROUND = 10   # разбор в фоне, конспекты, отчёты
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class QueueFull(Exception):
+    """Очередь к API переполнена (LLM_QUEUE_MAX) — запрос не ставится."""
+
+
+class TokenBucket:
+    """
+    rate_per_min жетонов в минуту, ёмкость — burst секунд от этой скорости.
+    rate_per_min <= 0 — без ограничения. Запрос крупнее ёмкости проходит при
+    полном ведре (уходит в минус), иначе он не прошёл бы никогда.
+    """
+
+    def __init__(self, rate_per_min: float, burst_seconds: float = 10.0) -> None:
+        self.rate = max(0.0, rate_per_min) / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, n: float) -> float:
+        """Сколько ждать, пока можно взять n жетонов (0 — можно сейчас)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        need = min(n, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, n: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= n
+
+    def refund(self, n: float) -> None:
+        """n > 0 — вернуть (оценка была завышена), n < 0 — доплатить."""
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "future", "enqueued")
+
+    def __init__(self, priority: int, seq: int, tokens: int, future: "asyncio.Future") -> None:
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RateLimiter:
+    """
+    async with limiter.slot(est_tokens, priority): ... — ждёт, пока есть
+    свободный слот (max_concurrency), запрос в RPM и est_tokens в TPM.
+    Очередь строго по приоритету, внутри приоритета — FIFO; голова очереди
+    не пропускает вперёд запросы того же или более низкого приоритета.
+
+    ENV: LLM_RPM, LLM_TPM (0 — без лимита, по умолч.), LLM_BURST_SECONDS (10),
+    LLM_QUEUE_MAX (1000), LLM_MAX_CONCURRENCY (8).
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_concurrency: int = 8,
+                 max_queue: int = 1000, burst_seconds: float = 10.0) -> None:
+        self.rpm = TokenBucket(rpm, burst_seconds)
+        self.tpm = TokenBucket(tpm, burst_seconds)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.waits = LatencyTracker(window=500, min_samples=1)
+        self.stats_counters: Dict[str, Any] = {
+            "granted": 0, "rejected": 0, "throttled_429": 0, "max_depth": 0,
+            "wait_total": 0.0, "by_priority": {},
+        }
+
+    @classmethod
+    def from_env(cls, max_concurrency: int = 8) -> "RateLimiter":
+        return cls(
+            rpm=_env_float("LLM_RPM", 0),
+            tpm=_env_float("LLM_TPM", 0),
+            max_concurrency=max_concurrency,
+            max_queue=int(_env_float("LLM_QUEUE_MAX", 1000)),
+            burst_seconds=_env_float("LLM_BURST_SECONDS", 10.0),
+        )
+
+    # ---- очередь ----
+
+    @property
+    def depth(self) -> int:
+        """Сколько запросов ждут слота."""
+        return sum(1 for w in self._queue if not w.future.done())
+
+    def _wait_for(self, w: _Waiter) -> float:
+        """0 — можно выдать слот сейчас, иначе сколько ждать (inf — до освобождения слота)."""
+        if self.in_flight >= self.max_concurrency:
+            return float("inf")
+        pause = self.paused_until - time.monotonic()
+        return max(pause, self.rpm.wait_time(1), self.tpm.wait_time(w.tokens), 0.0)
+
+    def _grant(self, w: _Waiter) -> None:
+        self.in_flight += 1
+        self.rpm.take(1)
+        self.tpm.take(w.tokens)
+        waited = time.monotonic() - w.enqueued
+        self.waits.add(waited)
+        c = self.stats_counters
+        c["granted"] += 1
+        c["wait_total"] += waited
+        c["by_priority"][w.priority] = c["by_priority"].get(w.priority, 0) + 1
+        w.future.set_result(None)
+
+    def _wake(self) -> None:
+        self._timer = None
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():          # отменён (дедлайн / клиент ушёл)
+                heapq.heappop(self._queue)
+                continue
+            delay = self._wait_for(head)
+            if delay == 0:
+                heapq.heappop(self._queue)
+                self._grant(head)
+                continue
+            if delay != float("inf"):
+                self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+            return
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        depth = self.depth
+        if depth >= self.max_queue:
+            self.stats_counters["rejected"] += 1
+            raise QueueFull(f"LLM queue is full ({self.max_queue})")
+        loop = asyncio.get_running_loop()
+        w = _Waiter(priority, next(self._seq), max(0, int(tokens)), loop.create_future())
+        heapq.heappush(self._queue, w)
+        self.stats_counters["max_depth"] = max(self.stats_counters["max_depth"], depth + 1)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+        try:
+            await w.future
+        except asyncio.CancelledError:
+            if w.future.done() and not w.future.cancelled():
+                self._release()  # слот уже выдан, но ждавший ушёл
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+
+    # ---- обратная связь от API ----
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """Поправить TPM по фактическому usage.total_tokens из ответа."""
+        if actual is not None:
+            self.tpm.refund(estimated - actual)
+
+    def penalize(self, retry_after: float) -> None:
+        """Пришёл 429: никому не отправлять, пока не истечёт retry_after."""
+        self.stats_counters["throttled_429"] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + max(0.0, retry_after))
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.stats_counters
+        granted = c["granted"] or 1
+        return {
+            "queue_depth": self.depth,
+            "max_depth": c["max_depth"],
+            "in_flight": self.in_flight,
+            "granted": c["granted"],
+            "rejected": c["rejected"],
+            "throttled_429": c["throttled_429"],
+            "wait_avg": round(c["wait_total"] / granted, 4),
+            "wait_p95": self.waits.p95(),
+            "by_priority": dict(c["by_priority"]),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            "rpm_tokens": None if self.rpm.unlimited else round(self.rpm.tokens, 1),
+            "tpm_tokens": None if self.tpm.unlimited else round(self.tpm.tokens, 1),
+        }
@@ -0,0 +1,161 @@
+"""
+Устойчивость LLM-клиента к деградации API: предохранитель (circuit breaker),
+экспоненциальная пауза с джиттером, общий бюджет повторов и трекер задержек
+для hedged-запросов. Всё потокобезопасно — используется и из llm-loop,
+и из блокирующих потоков.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def backoff_delay(attempt: int, base: float = 0.25, cap: float = 4.0) -> float:
+    """Пауза перед повтором attempt (1, 2, ...): full jitter от 0 до base*2^(attempt-1), не больше cap."""
+    return random.uniform(0, min(cap, base * (2 ** max(0, attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    closed    — запросы идут как обычно; failures подряд ошибок -> open
+    open      — запросы не отправляются (сразу локальный фоллбек) reset сек
+    half_open — пропускается один пробный запрос: успех -> closed, ошибка -> open;
+                пробный без итога (отмена, 429, очередь) — release_probe() -> open
+                с прежним opened_at, т.е. следующий запрос снова станет пробным
+
+    LLM_CB_FAILURES (по умолч. 5), LLM_CB_RESET (по умолч. 30 сек).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: Optional[int] = None, reset: Optional[float] = None) -> None:
+        self.threshold = max(1, failures or int(_env_float("LLM_CB_FAILURES", 5)))
+        self.reset = reset if reset is not None else _env_float("LLM_CB_RESET", 30.0)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = 0  # номер текущего пробного запроса, 0 — нет
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[int]:
+        """
+        Как allow(), но с билетом: None — нельзя, 0 — обычный запрос, > 0 —
+        пробный; его итог — record_success/record_failure, иначе release_probe(билет).
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset:
+                    return None
+                self.state = self.HALF_OPEN
+                self._probing = 0
+            if self._probing:
+                return None
+            self._probes += 1
+            self._probing = self._probes
+            return self._probing
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас (в half_open — только один пробный)."""
+        return self.acquire() is not None
+
+    def release_probe(self, ticket: Optional[int]) -> None:
+        """Пробный запрос закончился без итога — вернуть open, не сдвигая opened_at."""
+        if not ticket:
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probing == ticket:
+                self.state = self.OPEN
+                self._probing = 0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+
+class RetryBudget:
+    """
+    Общий на процесс бюджет повторов (как retry throttling в gRPC): каждый
+    повтор или hedged-запрос тратит 1 жетон, каждый успешный ответ возвращает
+    ratio жетона (LLM_RETRY_RATIO, по умолч. 0.2), максимум — max_tokens (10).
+    При массовых ошибках повторы быстро кончаются и не множат нагрузку на API.
+    """
+
+    def __init__(self, ratio: Optional[float] = None, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio if ratio is not None else _env_float("LLM_RETRY_RATIO", 0.2)
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.spent = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            self.spent += 1
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tokens": round(self.tokens, 2), "spent": self.spent, "denied": self.denied}
+
+
+class LatencyTracker:
+    """Скользящее окно последних window успешных задержек; p95 — для hedged-запросов."""
+
+    def __init__(self, window: int = 100, min_samples: int = 20) -> None:
+        self.samples: deque = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            data = sorted(self.samples)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def p95(self) -> Optional[float]:
+        return self.quantile(0.95)
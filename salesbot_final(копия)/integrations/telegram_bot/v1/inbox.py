@@ -0,0 +1,330 @@
+"""
+Входящая очередь апдейтов Telegram между webhook и обработчиками.
+
+Webhook только кладёт апдейт в очередь и сразу отвечает Telegram 200 — долгие
+ответы LLM больше не держат соединение и не вызывают повторных доставок.
+Разбирает очередь кто-то один — TG_INBOX_DRAINER (см. inbox_drainer()):
+воркеры в процессе backend (WebhookWorkers, asyncio) или отдельные процессы
+simple_telegram_bot.
+
+  - идемпотентность: ключ — update_id; повторная доставка того же апдейта
+    (Telegram повторяет при таймауте/5xx) в очередь не попадает
+  - порядок: апдейты одного чата выдаются строго по одному и по возрастанию
+    update_id, разные чаты — параллельно
+  - сбой обработчика: повтор через TG_INBOX_RETRY_DELAY * попытка сек, после
+    TG_INBOX_MAX_ATTEMPTS попыток — status='failed'
+  - воркер упал посреди обработки: через TG_INBOX_LEASE сек апдейт выдаётся снова
+
+TG_INBOX=sqlite (по умолч.; файл TG_INBOX_DB, по умолч. salesbot.db — таблица
+tg_updates, общая для всех процессов) | memory (только этот процесс).
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tg_updates (
+  update_id INTEGER PRIMARY KEY,
+  chat TEXT NOT NULL,
+  body TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  available_at REAL NOT NULL DEFAULT 0,
+  lease_until REAL,
+  error TEXT,
+  ts REAL
+);
+CREATE INDEX IF NOT EXISTS tg_updates_status_idx ON tg_updates(status, update_id);
+CREATE INDEX IF NOT EXISTS tg_updates_chat_idx ON tg_updates(chat, status)
+'''
+
+# Апдейт в работе: (update_id, сам апдейт)
+Claimed = Tuple[int, Dict[str, Any]]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def update_chat(update: Dict[str, Any]) -> str:
+    """Ключ порядка: id чата (апдейты без чата — каждый сам по себе)."""
+    for kind in ("message", "edited_message", "channel_post", "callback_query"):
+        obj = update.get(kind) or {}
+        chat = (obj.get("message") or {}).get("chat") if kind == "callback_query" else obj.get("chat")
+        if chat and chat.get("id") is not None:
+            return str(chat["id"])
+    return f"update:{update.get('update_id')}"
+
+
+class SQLiteInbox:
+    """
+    Очередь в SQLite (WAL): переживает рестарт, разбирается несколькими
+    процессами. Все методы синхронные и быстрые; из async-кода — через
+    asyncio.to_thread (см. WebhookWorkers).
+    """
+
+    def __init__(self, path: Optional[str] = None, lease: Optional[float] = None,
+                 max_attempts: Optional[int] = None, retry_delay: Optional[float] = None,
+                 keep: Optional[float] = None):
+        self.path = path or os.environ.get("TG_INBOX_DB", "salesbot.db")
+        self.lease = lease if lease is not None else _env_float("TG_INBOX_LEASE", 300)
+        self.max_attempts = max_attempts or int(_env_float("TG_INBOX_MAX_ATTEMPTS", 3))
+        self.retry_delay = retry_delay if retry_delay is not None else _env_float("TG_INBOX_RETRY_DELAY", 5)
+        # обработанные update_id храним, пока Telegram ещё может их повторить
+        self.keep = keep if keep is not None else _env_float("TG_INBOX_KEEP", 86400)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("PRAGMA busy_timeout=5000;")
+        for stmt in _SCHEMA.strip().split(';'):
+            if stmt.strip():
+                self._conn.execute(stmt)
+        self._last_purge = 0.0
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        """Поставить апдейт; False — этот update_id уже был (повторная доставка)."""
+        uid = int(update["update_id"])
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO tg_updates(update_id, chat, body, ts) VALUES(?,?,?,?)",
+                (uid, update_chat(update), json.dumps(update, ensure_ascii=False), time.time()))
+            return cur.rowcount == 1
+
+    def claim(self) -> Optional[Claimed]:
+        """
+        Взять следующий апдейт: самый ранний готовый, чей чат сейчас никем не
+        обрабатывается и у которого нет более ранних необработанных апдейтов.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # истёкшая аренда — воркер умер, апдейт снова доступен
+                self._conn.execute(
+                    "UPDATE tg_updates SET status='queued' WHERE status='processing' AND lease_until < ?", (now,))
+                row = self._conn.execute(
+                    "SELECT u.update_id, u.body FROM tg_updates u "
+                    "WHERE u.status = 'queued' AND u.available_at <= ? "
+                    "AND NOT EXISTS (SELECT 1 FROM tg_updates p WHERE p.chat = u.chat "
+                    "  AND (p.status = 'processing' OR (p.status = 'queued' AND p.update_id < u.update_id))) "
+                    "ORDER BY u.update_id LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE tg_updates SET status='processing', attempts=attempts+1, lease_until=? "
+                        "WHERE update_id=?", (now + self.lease, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def done(self, update_id: int, error: Optional[str] = None) -> None:
+        """Отметить результат: без error — обработан; с error — повтор или failed."""
+        now = time.time()
+        with self._lock:
+            if error is None:
+                self._conn.execute(
+                    "UPDATE tg_updates SET status='done', body='', lease_until=NULL, ts=? WHERE update_id=?",
+                    (now, update_id))
+            else:
+                self._conn.execute(
+                    "UPDATE tg_updates SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                    "available_at = ? + ? * attempts, lease_until=NULL, error=?, ts=? WHERE update_id=?",
+                    (self.max_attempts, now, self.retry_delay, error[:500], now, update_id))
+            if now - self._last_purge > 600:
+                self._last_purge = now
+                self._conn.execute("DELETE FROM tg_updates WHERE status IN ('done','failed') AND ts < ?",
+                                   (now - self.keep,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tg_updates GROUP BY status").fetchall()
+        return {"backend": "sqlite", **{status: n for status, n in rows}}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class MemoryInbox:
+    """Та же семантика в памяти процесса (без переживания рестарта)."""
+
+    def __init__(self, max_attempts: Optional[int] = None, retry_delay: Optional[float] = None,
+                 seen: int = 10000):
+        self.max_attempts = max_attempts or int(_env_float("TG_INBOX_MAX_ATTEMPTS", 3))
+        self.retry_delay = retry_delay if retry_delay is not None else _env_float("TG_INBOX_RETRY_DELAY", 5)
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[int, None]" = OrderedDict()  # последние update_id
+        self._seen_max = seen
+        self._chats: Dict[str, deque] = {}                    # чат -> [update_id, ...]
+        self._items: Dict[int, Dict[str, Any]] = {}           # update_id -> {update, attempts, available_at}
+        self._active: set = set()
+        self.counters = {"done": 0, "failed": 0}
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        uid = int(update["update_id"])
+        with self._lock:
+            if uid in self._seen:
+                return False
+            self._seen[uid] = None
+            if len(self._seen) > self._seen_max:
+                self._seen.popitem(last=False)
+            self._items[uid] = {"update": update, "attempts": 0, "available_at": 0.0}
+            self._chats.setdefault(update_chat(update), deque()).append(uid)
+            return True
+
+    def claim(self) -> Optional[Claimed]:
+        now = time.time()
+        with self._lock:
+            best = None
+            for chat, q in self._chats.items():
+                if chat in self._active or not q:
+                    continue
+                uid = q[0]
+                if self._items[uid]["available_at"] <= now and (best is None or uid < best[1]):
+                    best = (chat, uid)
+            if best is None:
+                return None
+            chat, uid = best
+            self._active.add(chat)
+            item = self._items[uid]
+            item["attempts"] += 1
+            return uid, item["update"]
+
+    def done(self, update_id: int, error: Optional[str] = None) -> None:
+        with self._lock:
+            item = self._items[update_id]
+            chat = update_chat(item["update"])
+            self._active.discard(chat)
+            if error is not None and item["attempts"] < self.max_attempts:
+                item["available_at"] = time.time() + self.retry_delay * item["attempts"]
+                return
+            self.counters["done" if error is None else "failed"] += 1
+            del self._items[update_id]
+            q = self._chats[chat]
+            q.popleft()
+            if not q:
+                del self._chats[chat]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "queued": len(self._items) - len(self._active),
+                    "processing": len(self._active), **self.counters}
+
+    def close(self) -> None:
+        pass
+
+
+_INBOX = None
+_INBOX_LOCK = threading.Lock()
+
+
+def get_inbox():
+    """Очередь процесса по TG_INBOX: sqlite (по умолч.) | memory."""
+    global _INBOX
+    if _INBOX is None:
+        with _INBOX_LOCK:
+            if _INBOX is None:
+                kind = os.environ.get("TG_INBOX", "sqlite").lower()
+                _INBOX = MemoryInbox() if kind == "memory" else SQLiteInbox()
+    return _INBOX
+
+
+def inbox_drainer() -> str:
+    """
+    Кто разбирает очередь, TG_INBOX_DRAINER: "backend" (WebhookWorkers в FastAPI)
+    | "bot" (процессы simple_telegram_bot) | "off". Не задано — "backend", если
+    настроен webhook (TG_WEBHOOK_SECRET), иначе "off": при long polling очередь
+    пуста и опрашивать её незачем.
+    """
+    value = (os.environ.get("TG_INBOX_DRAINER") or "").strip().lower()
+    if value in ("backend", "bot", "off"):
+        return value
+    return "backend" if os.environ.get("TG_WEBHOOK_SECRET") else "off"
+
+
+class WebhookWorkers:
+    """
+    N asyncio-воркеров в процессе FastAPI: берут апдейты из очереди и вызывают
+    handler(update). Новый апдейт будит их сразу (notify), апдейты, положенные
+    другими процессами или отложенные повторы, — опросом раз в poll сек.
+    """
+
+    def __init__(self, inbox, handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 workers: int = 4, poll: float = 1.0):
+        self.inbox = inbox
+        self.handler = handler
+        self.workers = max(0, workers)
+        self.poll = poll
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List["asyncio.Task"] = []
+        self._stopping = False
+        self.processed = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"tg-webhook-{i}") for i in range(self.workers)]
+
+    def notify(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            # clear до claim: notify, пришедший во время claim, не потеряется
+            self._wake.clear()
+            claimed = await asyncio.to_thread(self.inbox.claim)
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            uid, update = claimed
+            error = None
+            try:
+                await self.handler(update)
+                self.processed += 1
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.inbox.done, uid, "cancelled (shutdown)")
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.errors += 1
+                error = f"{type(e).__name__}: {e}"
+                print(f"[telegram_bot] update {uid} failed: {error}")
+            await asyncio.to_thread(self.inbox.done, uid, error)
+            self._wake.set()  # освободился чат — его следующий апдейт может ждать
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дать текущим обработкам до timeout сек, остальное отменить (вернётся в очередь)."""
+        self._stopping = True
+        self.notify()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "running": self.running,
+                "processed": self.processed, "errors": self.errors}
@@ -0,0 +1,505 @@
+"""
+Исходящая очередь в Telegram Bot API: все отправки бота идут через один
+планировщик, который держится в лимитах Telegram.
+
+  - на бота — не больше TG_SEND_RATE сообщений в секунду (по умолч. 30)
+  - в чат — TG_CHAT_RATE в секунду (1, всплеск до TG_CHAT_BURST), в группу —
+    TG_GROUP_RATE_PER_MIN в минуту (20)
+  - 429: пауза на retry_after из ответа для всего бота, сообщение остаётся
+    первым в очереди своего чата и уходит после паузы (попыткой не считается)
+  - сбой сети / 5xx: повтор через TG_SEND_RETRY_DELAY * 2^n сек, всего до
+    TG_SEND_MAX_ATTEMPTS попыток; 400/403 (чат не найден, бот заблокирован) —
+    без повторов
+  - порядок сообщений в одном чате сохраняется; ответы пользователям
+    (PRIORITY_INTERACTIVE) обгоняют рассылки (PRIORITY_BACKGROUND)
+
+durable=True (рассылки telegram_push): сообщение сначала пишется в SQLite
+(таблица tg_outbox в TG_OUTBOX_DB, по умолч. salesbot.db) и помечается sent /
+failed только по ответу Telegram. Неотправленное при рестарте или падении
+процесса подхватывается через TG_OUTBOX_LEASE сек (любым процессом с тем же
+ботом). Доставка «хотя бы один раз»: упасть между ответом Telegram и записью
+в базу — сообщение уйдёт повторно.
+
+  outbox = get_outbox(token)
+  outbox.send("sendMessage", {...})                      # из потока, ждёт ответа
+  await outbox.asend("editMessageText", {...})           # из async-кода
+  outbox.submit("sendMessage", {...}, PRIORITY_BACKGROUND, durable=True)  # Future
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from core.integrations.patch_v4.http_client import get_session
+from core.voice_gateway.v1.ratelimit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, TokenBucket
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tg_outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  bot TEXT NOT NULL,
+  chat TEXT NOT NULL,
+  method TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  priority INTEGER NOT NULL DEFAULT 10,
+  status TEXT NOT NULL DEFAULT 'queued',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  lease_until REAL,
+  error TEXT,
+  ts REAL
+);
+CREATE INDEX IF NOT EXISTS tg_outbox_status_idx ON tg_outbox(bot, status, id)
+'''
+
+# Как часто продлевать аренду своих durable-сообщений и подбирать чужие брошенные
+_HOUSEKEEP_EVERY = 30.0
+
+# Методы, на которые действуют лимиты отправки (остальное — в обход очереди)
+SCHEDULED_METHODS = frozenset({
+    "sendMessage", "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+    "forwardMessage", "copyMessage", "sendPhoto", "sendDocument", "sendSticker",
+    "sendLocation", "sendContact", "sendPoll",
+})
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _bot_id(token: str) -> str:
+    # в базу пишем id бота (часть токена до ":"), а не сам токен
+    return token.split(":", 1)[0]
+
+
+class OutboxStore:
+    """Журнал durable-сообщений в SQLite (WAL), общий для всех процессов."""
+
+    def __init__(self, path: Optional[str] = None, lease: Optional[float] = None,
+                 keep: Optional[float] = None):
+        self.path = path or os.environ.get("TG_OUTBOX_DB") or os.environ.get("TG_INBOX_DB", "salesbot.db")
+        self.lease = lease if lease is not None else _env_float("TG_OUTBOX_LEASE", 120)
+        # отправленные храним для разбора («ушло ли напоминание»)
+        self.keep = keep if keep is not None else _env_float("TG_OUTBOX_KEEP", 7 * 86400)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("PRAGMA busy_timeout=5000;")
+        for stmt in _SCHEMA.strip().split(';'):
+            if stmt.strip():
+                self._conn.execute(stmt)
+
+    def add(self, bot: str, chat: str, method: str, payload: Dict[str, Any], priority: int) -> int:
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO tg_outbox(bot, chat, method, payload, priority, lease_until, ts) "
+                "VALUES(?,?,?,?,?,?,?)",
+                (bot, chat, method, json.dumps(payload, ensure_ascii=False), priority, now + self.lease, now))
+            return int(cur.lastrowid)
+
+    def renew(self, ids: List[int]) -> None:
+        """Продлить аренду своих неотправленных сообщений (процесс жив)."""
+        if not ids:
+            return
+        until = time.time() + self.lease
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE tg_outbox SET lease_until=? WHERE id=? AND status='queued'", [(until, i) for i in ids])
+
+    def release(self, ids: List[int]) -> None:
+        """Отдать сообщения другим процессам сразу (остановка без отправки)."""
+        with self._lock:
+            self._conn.executemany("UPDATE tg_outbox SET lease_until=0 WHERE id=? AND status='queued'",
+                                   [(i,) for i in ids])
+
+    def claim_expired(self, bot: str) -> List[Dict[str, Any]]:
+        """Забрать неотправленные сообщения, чья аренда истекла (процесс-владелец умер)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, chat, method, payload, priority, attempts FROM tg_outbox "
+                    "WHERE bot=? AND status='queued' AND (lease_until IS NULL OR lease_until < ?) ORDER BY id",
+                    (bot, now)).fetchall()
+                self._conn.executemany("UPDATE tg_outbox SET lease_until=? WHERE id=?",
+                                       [(now + self.lease, r[0]) for r in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{"id": r[0], "chat": r[1], "method": r[2], "payload": json.loads(r[3]),
+                 "priority": r[4], "attempts": r[5]} for r in rows]
+
+    def attempt(self, row_id: int, attempts: int, error: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE tg_outbox SET attempts=?, error=?, ts=? WHERE id=?",
+                               (attempts, error[:500], time.time(), row_id))
+
+    def finish(self, row_id: int, ok: bool, attempts: int, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tg_outbox SET status=?, attempts=?, error=?, lease_until=NULL, ts=? WHERE id=?",
+                ("sent" if ok else "failed", attempts, (error or "")[:500] or None, time.time(), row_id))
+
+    def purge(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tg_outbox WHERE status IN ('sent','failed') AND ts < ?",
+                               (time.time() - self.keep,))
+
+    def stats(self, bot: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tg_outbox WHERE bot=? GROUP BY status",
+                                      (bot,)).fetchall()
+        return {status: n for status, n in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _stopped(row_id: Optional[int]) -> Dict[str, Any]:
+    """Итог для Future, не дождавшегося отправки из-за stop()"""
+    if row_id is not None:
+        # строка осталась queued в tg_outbox — её дошлёт этот или другой процесс
+        return {"ok": False, "deferred": True, "status": None,
+                "description": "outbox stopped, message stays queued", "outbox_id": row_id}
+    return {"ok": False, "status": None, "description": "outbox stopped"}
+
+
+class _Job:
+    __slots__ = ("seq", "method", "payload", "priority", "future", "attempts", "row_id")
+
+    def __init__(self, seq: int, method: str, payload: Dict[str, Any], priority: int,
+                 future: Optional[Future], attempts: int = 0, row_id: Optional[int] = None) -> None:
+        self.seq = seq
+        self.method = method
+        self.payload = payload
+        self.priority = priority
+        self.future = future
+        self.attempts = attempts
+        self.row_id = row_id
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "paused_until", "busy")
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.jobs: Deque[_Job] = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.busy = False  # сообщение чата сейчас в пути — следующее ждёт (порядок)
+
+
+class TelegramOutbox:
+    """
+    Планировщик отправок одного бота: поток tg-outbox выбирает, что можно
+    отправить сейчас, HTTP-запросы делает пул из TG_SEND_WORKERS потоков.
+    """
+
+    def __init__(self, token: str, rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 chat_burst: Optional[float] = None, group_rate_per_min: Optional[float] = None,
+                 workers: Optional[int] = None, max_attempts: Optional[int] = None,
+                 retry_delay: Optional[float] = None, store: Optional[OutboxStore] = None,
+                 api_url: Optional[str] = None):
+        self.token = token
+        self.bot = _bot_id(token)
+        self.api = (api_url or "https://api.telegram.org").rstrip("/") + f"/bot{token}"
+        rate = rate if rate is not None else _env_float("TG_SEND_RATE", 30)
+        self.chat_rate = chat_rate if chat_rate is not None else _env_float("TG_CHAT_RATE", 1)
+        self.chat_burst = chat_burst if chat_burst is not None else _env_float("TG_CHAT_BURST", 3)
+        self.group_rate = (group_rate_per_min if group_rate_per_min is not None
+                           else _env_float("TG_GROUP_RATE_PER_MIN", 20))
+        self.workers = workers or int(_env_float("TG_SEND_WORKERS", 8))
+        self.max_attempts = max_attempts or int(_env_float("TG_SEND_MAX_ATTEMPTS", 5))
+        self.retry_delay = retry_delay if retry_delay is not None else _env_float("TG_SEND_RETRY_DELAY", 1)
+        # всплеск — 0.1 с лимита: в любом окне в 1 с уходит не больше ~1.1 * rate
+        self.bucket = TokenBucket(rate * 60, 0.1)
+        self.paused_until = 0.0                    # 429 на весь бот
+        self._store = store
+        self._chats: Dict[str, _Chat] = {}
+        self._durable: Set[int] = set()            # id строк tg_outbox, которые держит этот процесс
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+        self._last_housekeep = 0.0
+        self.counters = {"sent": 0, "failed": 0, "retried": 0, "throttled_429": 0, "recovered": 0}
+
+    # ---- запуск / остановка ----
+
+    @property
+    def store(self) -> OutboxStore:
+        if self._store is None:
+            self._store = OutboxStore()
+        return self._store
+
+    def start(self) -> "TelegramOutbox":
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._stopping = False
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="tg-send")
+            self._thread = threading.Thread(target=self._run, name="tg-outbox", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Дождаться отправок в пути (до timeout сек). Durable-сообщения остаются в
+        базе и сразу доступны другим процессам — их Future получают
+        deferred=True (не ошибка: сообщение уйдёт позже); ждущим остальных — ok=False.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        with self._cond:
+            for chat in self._chats.values():
+                for job in chat.jobs:
+                    if job.future is not None and not job.future.done():
+                        job.future.set_result(_stopped(job.row_id))
+            self._chats.clear()
+            durable = list(self._durable)
+            self._durable.clear()
+        if durable:
+            self.store.release(durable)
+
+    # ---- постановка ----
+
+    def _chat_bucket(self, chat: str) -> TokenBucket:
+        if chat.startswith("-"):
+            # группы и каналы (отрицательный chat_id): лимит в минуту
+            return TokenBucket(self.group_rate, self.chat_burst * 60 / max(self.group_rate, 1e-9))
+        return TokenBucket(self.chat_rate * 60, self.chat_burst / max(self.chat_rate, 1e-9))
+
+    def _enqueue(self, chat: str, job: _Job) -> None:
+        c = self._chats.get(chat)
+        if c is None:
+            c = self._chats[chat] = _Chat(self._chat_bucket(chat))
+        c.jobs.append(job)
+        if job.row_id is not None:
+            self._durable.add(job.row_id)
+        self._cond.notify()
+
+    def submit(self, method: str, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+               durable: bool = False) -> "Future[Dict[str, Any]]":
+        """
+        Поставить вызов method(payload) в очередь. Future получает ответ Telegram
+        (+ "status" — HTTP-код, None — не достучались); исключений не бывает.
+        """
+        chat = str(payload.get("chat_id", ""))
+        row_id = self.store.add(self.bot, chat, method, payload, priority) if durable else None
+        future: "Future[Dict[str, Any]]" = Future()
+        with self._cond:
+            if self._stopping:
+                future.set_result(_stopped(row_id))
+                return future
+            self._seq += 1
+            self._enqueue(chat, _Job(self._seq, method, payload, priority, future, row_id=row_id))
+        return future
+
+    def send(self, method: str, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+             durable: bool = False, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self.submit(method, payload, priority, durable).result(timeout)
+
+    async def asend(self, method: str, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                    durable: bool = False) -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(method, payload, priority, durable))
+
+    # ---- планировщик ----
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                delay = self._dispatch()
+                if delay > 0:
+                    self._cond.wait(min(delay, _HOUSEKEEP_EVERY))
+            if time.monotonic() - self._last_housekeep > _HOUSEKEEP_EVERY:
+                self._housekeep()
+
+    def _dispatch(self) -> float:
+        """Отправить всё, что можно сейчас; вернуть, сколько ждать до следующей возможности."""
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                return self.paused_until - now
+            best: Optional[_Chat] = None
+            nearest = 3600.0
+            for c in self._chats.values():
+                if c.busy or not c.jobs:
+                    continue
+                wait = max(c.paused_until - now, c.bucket.wait_time(1))
+                if wait > 0:
+                    nearest = min(nearest, wait)
+                    continue
+                head = c.jobs[0]
+                if best is None or (head.priority, head.seq) < (best.jobs[0].priority, best.jobs[0].seq):
+                    best = c
+            if best is None:
+                return nearest
+            wait = self.bucket.wait_time(1)
+            if wait > 0:
+                return wait
+            self.bucket.take(1)
+            best.bucket.take(1)
+            best.busy = True
+            self._pool.submit(self._deliver, best, best.jobs[0])
+
+    def _housekeep(self) -> None:
+        self._last_housekeep = time.monotonic()
+        try:
+            with self._cond:
+                own = list(self._durable)
+                # простаивающие чаты с полным ведром не нужны
+                for chat in [k for k, c in self._chats.items()
+                             if not c.jobs and not c.busy and c.bucket.wait_time(c.bucket.capacity) == 0]:
+                    del self._chats[chat]
+            self.store.renew(own)
+            rows = self.store.claim_expired(self.bot)
+            self.store.purge()
+        except Exception as e:  # база недоступна — очередь в памяти работает дальше
+            print(f"[telegram_outbox] housekeeping failed: {type(e).__name__}: {e}")
+            return
+        if rows:
+            with self._cond:
+                for r in rows:
+                    self._seq += 1
+                    self._enqueue(r["chat"], _Job(self._seq, r["method"], r["payload"], r["priority"],
+                                                  None, attempts=r["attempts"], row_id=r["id"]))
+                self.counters["recovered"] += len(rows)
+
+    # ---- отправка ----
+
+    def _deliver(self, chat: _Chat, job: _Job) -> None:
+        job.attempts += 1
+        try:
+            r = get_session("telegram").post(f"{self.api}/{job.method}", json=job.payload, timeout=15)
+            status: Optional[int] = r.status_code
+            try:
+                data = r.json()
+            except ValueError:
+                data = {"ok": False, "description": r.text[:200]}
+        except Exception as e:
+            status, data = None, {"ok": False, "description": f"{type(e).__name__}: {e}"}
+        try:
+            self._settle(chat, job, status, data)
+        except Exception as e:  # база недоступна — не оставлять чат занятым навсегда
+            print(f"[telegram_outbox] settle failed: {type(e).__name__}: {e}")
+            with self._cond:
+                chat.busy = False
+                self._cond.notify()
+
+    def _settle(self, chat: _Chat, job: _Job, status: Optional[int], data: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        if status == 429:
+            retry_after = float((data.get("parameters") or {}).get("retry_after") or 1)
+            job.attempts -= 1
+            with self._cond:
+                self.counters["throttled_429"] += 1
+                self.paused_until = max(self.paused_until, now + retry_after)
+                chat.busy = False
+                self._cond.notify()
+            return
+        retryable = status is None or status >= 500
+        if retryable and job.attempts < self.max_attempts:
+            error = f"{status}: {data.get('description')}"
+            if job.row_id is not None:
+                self.store.attempt(job.row_id, job.attempts, error)
+            with self._cond:
+                self.counters["retried"] += 1
+                chat.paused_until = now + self.retry_delay * 2 ** (job.attempts - 1)
+                chat.busy = False
+                self._cond.notify()
+            return
+        ok = bool(data.get("ok"))
+        if not ok:
+            print(f"[telegram_outbox] {job.method} to {job.payload.get('chat_id')} failed: "
+                  f"{status} {data.get('description')}")
+        if job.row_id is not None:
+            self.store.finish(job.row_id, ok, job.attempts, None if ok else f"{status}: {data.get('description')}")
+        with self._cond:
+            self.counters["sent" if ok else "failed"] += 1
+            chat.jobs.popleft()
+            chat.busy = False
+            if job.row_id is not None:
+                self._durable.discard(job.row_id)
+            self._cond.notify()
+        if job.future is not None:
+            job.future.set_result(dict(data, status=status, outbox_id=job.row_id))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            out = {
+                "queued": sum(len(c.jobs) for c in self._chats.values()),
+                "chats": sum(1 for c in self._chats.values() if c.jobs),
+                "in_flight": sum(1 for c in self._chats.values() if c.busy),
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+                **self.counters,
+            }
+        if self._store is not None:
+            out["durable"] = self._store.stats(self.bot)
+        return out
+
+
+_OUTBOXES: Dict[str, TelegramOutbox] = {}
+_OUTBOXES_LOCK = threading.Lock()
+
+
+def get_outbox(token: str) -> TelegramOutbox:
+    """Очередь отправок бота (одна на токен в процессе), запускается при первом вызове."""
+    with _OUTBOXES_LOCK:
+        outbox = _OUTBOXES.get(token)
+        if outbox is None:
+            outbox = _OUTBOXES[token] = TelegramOutbox(token)
+            # неотправленные рассылки прошлого запуска — сразу в очередь
+            outbox._housekeep()
+        return outbox.start()
+
+
+def close_outboxes(timeout: float = 10.0) -> None:
+    with _OUTBOXES_LOCK:
+        items = list(_OUTBOXES.values())
+        _OUTBOXES.clear()
+    for outbox in items:
+        outbox.stop(timeout)
+
+
+def aiogram_bot(token: str, **kwargs):
+    """
+    aiogram v2 Bot, у которого отправки и правки сообщений (message.answer,
+    bot.send_message, ...) идут через очередь, а не напрямую в API.
+    """
+    from aiogram import Bot
+    from aiogram.bot import api
+
+    class ScheduledBot(Bot):
+        async def request(self, method, data=None, files=None, **kw):
+            if files or method not in SCHEDULED_METHODS or not data or "chat_id" not in data:
+                return await super().request(method, data, files, **kw)
+            result = await get_outbox(token).asend(method, dict(data))
+            status = result.pop("status", None) or 502
+            result.pop("outbox_id", None)
+            # ошибки Telegram -> привычные исключения aiogram (BadRequest, BotBlocked, ...)
+            return api.check_result(method, "application/json", status, json.dumps(result))
+
+    return ScheduledBot(token=token, **kwargs)
+
+
+__all__ = ["TelegramOutbox", "OutboxStore", "get_outbox", "close_outboxes", "aiogram_bot",
+           "SCHEDULED_METHODS", "PRIORITY_INTERACTIVE", "PRIORITY_BACKGROUND"]
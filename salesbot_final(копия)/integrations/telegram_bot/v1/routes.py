@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Request
-from typing import Any, Dict
+from fastapi import APIRouter, Header, HTTPException, Request
+from typing import Any, Dict, Optional
 
+import asyncio
 import os
-import requests
 
-from core.voice_gateway.v1 import VoicePipeline
+from core.voice_gateway.v1 import get_pipeline
+from .inbox import WebhookWorkers, get_inbox, inbox_drainer
+from .outbox import close_outboxes, get_outbox
+from .streaming import stream_reply
 
 router = APIRouter(
     prefix="/telegram_bot/v1",
@@ -28,41 +31,125 @@ def _get_token() -> str:
     return token
 
 
-def _send_message(chat_id: int, text: str) -> Dict[str, Any]:
+def _stream_enabled() -> bool:
+    # TG_STREAM=0 — отвечать одним сообщением после полной генерации
+    return os.environ.get("TG_STREAM", "1").lower() not in ("0", "false", "no", "off")
+
+
+async def _send_message(chat_id: int, text: str) -> Dict[str, Any]:
     """
-    Отправка сообщения в Telegram.
+    Отправка сообщения в Telegram через общую исходящую очередь (outbox.py):
+    лимиты Telegram на бота и на чат, retry_after при 429, повторы при 5xx.
     """
-    token = _get_token()
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": text,
         "parse_mode": "HTML",
     }
-    r = requests.post(url, json=payload, timeout=10)
+    data = await get_outbox(_get_token()).asend("sendMessage", payload)
+    if data.get("status") is None:
+        # до Telegram так и не достучались — апдейт повторится из очереди
+        raise ConnectionError(data.get("description") or "telegram unreachable")
+    return {"ok": bool(data.get("ok")), "status": data.get("status"), "data": data}
+
+
+# ---------- Очередь между webhook и обработчиками ----------
+
+def _workers_count() -> int:
+    # сколько воркеров, если очередь разбирает backend (TG_INBOX_DRAINER=backend)
     try:
-        data = r.json()
-    except Exception:
-        data = {"raw": r.text}
-    return {"ok": r.ok, "status": r.status_code, "data": data}
+        return max(1, int(os.environ.get("TG_WEBHOOK_WORKERS", "4")))
+    except ValueError:
+        return 4
+
+
+_WORKERS: Optional[WebhookWorkers] = None
+
+
+def _ensure_workers() -> Optional[WebhookWorkers]:
+    # воркеры есть, только если очередь разбирает этот процесс; иначе webhook
+    # лишь кладёт апдейты (их берёт simple_telegram_bot), а при long polling
+    # никто не дёргает SQLite впустую
+    global _WORKERS
+    if inbox_drainer() != "backend":
+        return None
+    if _WORKERS is None:
+        _WORKERS = WebhookWorkers(get_inbox(), handle_update, workers=_workers_count())
+    if not _WORKERS.running:
+        _WORKERS.start()
+    return _WORKERS
+
+
+@router.on_event("startup")
+async def _start_workers():
+    # апдейты, оставшиеся в очереди с прошлого запуска, разбираются сразу
+    workers = _ensure_workers()
+    print(f"[telegram_bot] inbox drainer: {inbox_drainer()}"
+          + (f", workers={workers.workers}" if workers is not None else ""))
+    # и рассылки из tg_outbox, не отправленные прошлым процессом: очередь
+    # подбирает их при создании, а не при первой отправке после рестарта
+    token = os.environ.get("TELEGRAM_BOT_TOKEN") or os.environ.get("TG_BOT_TOKEN")
+    if token:
+        await asyncio.to_thread(get_outbox, token)
+
+
+@router.on_event("shutdown")
+async def _close_sessions():
+    if _WORKERS is not None:
+        await _WORKERS.stop()
+    # дождаться отправок в пути; durable-рассылки остаются в базе
+    await asyncio.to_thread(close_outboxes)
 
 
 @router.get("/health")
 async def health():
     """
-    Быстрый чек, что модуль подключен.
+    Быстрый чек, что модуль подключен, + состояние очередей апдейтов и отправок.
     """
-    return {"ok": True}
+    try:
+        outbox = await asyncio.to_thread(lambda: get_outbox(_get_token()).stats())
+    except RuntimeError:
+        outbox = None  # токен не задан
+    return {
+        "ok": True,
+        "inbox": await asyncio.to_thread(get_inbox().stats),
+        "drainer": inbox_drainer(),
+        "workers": _WORKERS.stats() if _WORKERS is not None else None,
+        "outbox": outbox,
+    }
 
 
 @router.post("/webhook")
-async def telegram_webhook(update: Dict[str, Any]):
+async def telegram_webhook(
+    update: Dict[str, Any],
+    x_telegram_bot_api_secret_token: Optional[str] = Header(default=None),
+):
     """
-    Основной вход от Telegram (webhook).
+    Вход от Telegram (webhook): апдейт кладётся в очередь, ответ 200 — сразу,
+    не дожидаясь LLM. Повторная доставка того же update_id игнорируется.
+    TG_WEBHOOK_SECRET — тот же secret_token, что передан в setWebhook.
+    """
+    secret = os.environ.get("TG_WEBHOOK_SECRET")
+    if secret and x_telegram_bot_api_secret_token != secret:
+        raise HTTPException(status_code=403, detail="bad secret token")
+    if "update_id" not in update:
+        return {"ok": False, "error": "no_update_id"}
+
+    queued = await asyncio.to_thread(get_inbox().put, update)
+    workers = _ensure_workers() if queued else None
+    if workers is not None:
+        workers.notify()
+    return {"ok": True, "queued": queued, "duplicate": not queued}
+
+
+async def handle_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обработка одного апдейта (вызывается воркерами очереди). Исключение —
+    апдейт будет повторён (см. inbox.py).
     """
     message = update.get("message") or update.get("edited_message")
     if not message:
-        # ничего не делаем, чтобы Telegram был доволен
+        # не сообщение — пропускаем
         return {"ok": True, "skipped": True}
 
     chat = message.get("chat") or {}
@@ -85,20 +172,30 @@ async def telegram_webhook(update: Dict[str, Any]):
 
     # 2) Любой другой текст — отправляем в DeepSeek через VoicePipeline
     else:
-        vp = VoicePipeline()
+        vp = get_pipeline()
         system_prompt = (
             "Ты тёплый, живой ассистент проекта «На Счастье».\n"
             "Отвечай коротко, по-человечески, без канцелярита, в тоне заботливого менеджера,\n"
             "который помогает человеку создать персональную песню по его истории.\n"
             "Задавай уточняющие вопросы по истории, эмоциям, поводу, но не дави на оплату."
         )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text},
+        ]
+        if _stream_enabled():
+            # ответ появляется в чате сразу и дописывается по мере генерации
+            sent = await stream_reply(_get_token(), chat_id, vp.llm.astream(messages))
+            if sent["message_ids"]:
+                # часть ответа уже в чате (даже если поток оборвался) — второй
+                # полный ответ через achat не шлём
+                return {"ok": True, "streamed": sent}
+            if sent.get("status") in (400, 403):
+                # чат недоступен (бот заблокирован, чат удалён) — achat и
+                # повторная отправка дали бы ту же ошибку
+                return {"ok": False, "streamed": sent}
         try:
-            reply_text = vp.llm.chat(
-                [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": text},
-                ]
-            )
+            reply_text = await vp.llm.achat(messages)
         except Exception:
             # Если вдруг DeepSeek/VoicePipeline упал — не молчим.
             reply_text = (
@@ -107,9 +204,6 @@ async def telegram_webhook(update: Dict[str, Any]):
             )
 
     # --- Отправляем ответ пользователю ---
-    try:
-        send_result = _send_message(chat_id, reply_text)
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
-
+    # сетевая ошибка поднимается наверх — воркер повторит апдейт позже
+    send_result = await _send_message(chat_id, reply_text)
     return {"ok": True, "sent": send_result}
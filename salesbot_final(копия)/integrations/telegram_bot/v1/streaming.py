@@ -0,0 +1,128 @@
+"""
+Потоковый ответ в Telegram: первое сообщение уходит, как только пришёл первый
+кусок текста от LLM, дальше оно дописывается через editMessageText — не чаще
+раза в TG_STREAM_INTERVAL сек (по умолч. 1.0), чтобы не упереться в лимиты
+Telegram на редактирование. Сами вызовы идут через исходящую очередь
+(outbox.py): она же ждёт retry_after, если Telegram ответил 429.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .outbox import get_outbox
+
+# Лимит длины одного сообщения Telegram
+TG_MAX_LEN = 4096
+
+
+class StreamSendError(RuntimeError):
+    """sendMessage не прошёл (бот заблокирован, чат не найден...) — поток остановлен."""
+
+    def __init__(self, status: Optional[int], description: str):
+        super().__init__(f"sendMessage failed ({status}): {description}")
+        self.status = status
+
+
+def _interval() -> float:
+    try:
+        return max(0.3, float(os.environ.get("TG_STREAM_INTERVAL", "1.0")))
+    except ValueError:
+        return 1.0
+
+
+class TelegramStreamer:
+    """
+    Показывает растущий ответ одним сообщением (или несколькими, если текст
+    длиннее TG_MAX_LEN). Текст отправляется без parse_mode — незакрытые теги
+    на середине генерации ломали бы HTML-разметку.
+    """
+
+    def __init__(self, token: str, chat_id: int, interval: Optional[float] = None):
+        self.token = token
+        self.chat_id = chat_id
+        self.interval = interval if interval is not None else _interval()
+        self.text = ""
+        self.message_ids: List[int] = []
+        self._offset = 0        # начало текущего сообщения в self.text
+        self._shown = ""        # что сейчас видно в текущем сообщении
+        self._last_edit = 0.0
+        self.failed: Optional[StreamSendError] = None
+
+    async def _call(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await get_outbox(self.token).asend(method, payload)
+
+    async def _show(self, part: str) -> None:
+        if part == self._shown or not part.strip():
+            return
+        if not self.message_ids or len(self.message_ids) * TG_MAX_LEN <= self._offset:
+            data = await self._call("sendMessage", {"chat_id": self.chat_id, "text": part})
+            msg_id = (data.get("result") or {}).get("message_id")
+            if not data.get("ok") or msg_id is None:
+                # без message_id каждый следующий кусок слал бы новое сообщение —
+                # дальше в этот чат не пишем
+                self.failed = StreamSendError(data.get("status"), data.get("description") or "no message_id")
+                raise self.failed
+            self.message_ids.append(msg_id)
+        else:
+            await self._call("editMessageText", {
+                "chat_id": self.chat_id,
+                "message_id": self.message_ids[-1],
+                "text": part,
+            })
+        self._shown = part
+        self._last_edit = time.monotonic()
+
+    async def _flush(self) -> None:
+        # текущее сообщение переполнено — дописываем его и начинаем следующее
+        while len(self.text) - self._offset > TG_MAX_LEN:
+            await self._show(self.text[self._offset:self._offset + TG_MAX_LEN])
+            self._offset += TG_MAX_LEN
+            self._shown = ""
+        await self._show(self.text[self._offset:])
+
+    async def feed(self, chunk: str) -> None:
+        if self.failed is not None:
+            raise self.failed
+        self.text += chunk
+        first = not self.message_ids
+        if first or time.monotonic() - self._last_edit >= self.interval:
+            await self._flush()
+
+    async def finish(self) -> None:
+        if self.failed is None:
+            await self._flush()
+
+
+async def stream_reply(token: str, chat_id: int, chunks: AsyncIterator[str],
+                       interval: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Отправить поток кусков (например, llm.astream(...)) в чат с правками по ходу.
+    Ошибка генерации или отправки не поднимается, а возвращается в "error":
+    по message_ids вызывающий видит, успело ли что-то появиться в чате.
+    Не прошёл sendMessage — генерация прерывается, HTTP-статус Telegram — в
+    "status" (400/403: писать в этот чат бессмысленно, повторять не нужно).
+    """
+    streamer = TelegramStreamer(token, chat_id, interval)
+    error: Optional[BaseException] = None
+    try:
+        async for chunk in chunks:
+            await streamer.feed(chunk)
+    except Exception as e:
+        error = e
+        if streamer.failed is not None and hasattr(chunks, "aclose"):
+            await chunks.aclose()  # закрыть и запрос к LLM, а не ждать сборщика мусора
+    finally:
+        # даже при ошибке генерации показываем то, что успело прийти
+        try:
+            await asyncio.shield(streamer.finish())
+        except Exception as e:
+            error = error or e
+    out: Dict[str, Any] = {"ok": bool(streamer.message_ids) and error is None,
+                           "message_ids": streamer.message_ids, "chars": len(streamer.text)}
+    if error is not None:
+        out["error"] = repr(error)
+    if streamer.failed is not None:
+        out["status"] = streamer.failed.status
+    return out
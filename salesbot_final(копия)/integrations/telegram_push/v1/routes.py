@@ -4,7 +4,7 @@ from pydantic import BaseModel
 import json
 import os
 
-from .service import config, subscribers, update_subscribers, send_push, LOG
+from .service import config, subscribers, update_subscribers, send_push, outbox_stats, LOG
 
 
 router = APIRouter(
@@ -64,6 +64,7 @@ async def health():
     return {
         "ok": True,
         "mock_mode": bool(cfg.get("mock_mode", False)),
+        "outbox": outbox_stats(),
     }
 
 
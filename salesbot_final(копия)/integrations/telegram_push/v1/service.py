@@ -66,17 +66,38 @@ def send_push(manager_id: str, channel: str, template_key: str, payload: Dict[st
         _append_log(entry)
         return {"ok": True, "mock": True, "entry": entry}
 
-    # Real send (disabled in mock-only mode). Example kept for adapter:
+    # Real send: durable outbound queue (integrations/telegram_bot/v1/outbox.py) —
+    # Telegram rate limits, retry_after on 429, retries; survives restarts.
+    # Returns at once, the result lands in the log when Telegram answers.
     try:
-        import requests
+        from integrations.telegram_bot.v1.outbox import PRIORITY_BACKGROUND, get_outbox
         token = os.environ.get(cfg.get("bot_token_env","TELEGRAM_BOT_TOKEN"))
         if not token:
             return {"ok": False, "error": "no_token_env"}
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
         data = {"chat_id": sub.get("chat_id"), "text": text, "parse_mode": "HTML"}
-        r = requests.post(url, json=data, timeout=10)
-        _append_log({**entry, "status": r.status_code})
-        return {"ok": r.ok, "status": r.status_code}
+        fut = get_outbox(token).submit("sendMessage", data, PRIORITY_BACKGROUND, durable=True)
+        fut.add_done_callback(lambda f: _log_result(entry, f.result()))
+        return {"ok": True, "queued": True}
     except Exception as e:
         _append_log({**entry, "error": str(e)})
         return {"ok": False, "error": str(e)}
+
+
+def _log_result(entry: Dict[str, Any], result: Dict[str, Any]):
+    rec = {**entry, "status": result.get("status"), "outbox_id": result.get("outbox_id")}
+    if result.get("deferred"):
+        # процесс остановился раньше отправки: запись осталась в tg_outbox и уйдёт
+        # после рестарта — итог смотреть там (status sent/failed), а не ошибкой здесь
+        rec["deferred"] = True
+    elif not result.get("ok"):
+        rec["error"] = result.get("description")
+    _append_log(rec)
+
+
+def outbox_stats()->Optional[Dict[str, Any]]:
+    cfg = config()
+    token = os.environ.get(cfg.get("bot_token_env","TELEGRAM_BOT_TOKEN"))
+    if cfg.get("mock_mode", True) or not token:
+        return None
+    from integrations.telegram_bot.v1.outbox import get_outbox
+    return get_outbox(token).stats()
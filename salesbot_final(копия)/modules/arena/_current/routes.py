@@ -1,21 +1,27 @@
 
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from .engine import ArenaEngine
 
 router = APIRouter(prefix="/arena/v4", tags=["arena"])
 
 @router.post("/start/{sid}")
 async def start(sid: str):
-    eng=ArenaEngine(sid)
+    eng=await ArenaEngine.aopen(sid)
     eng.reset()
+    await eng.asave()
     return {"ok":True, "sid":sid}
 
 @router.post("/handle/{sid}")
 async def handle(sid: str, text: str):
-    eng=ArenaEngine(sid)
-    return eng.handle(text)
+    eng=await ArenaEngine.aopen(sid)
+    # handle() синхронно ходит в LLM — в пул потоков, чтобы не держать event loop
+    result = await run_in_threadpool(eng.handle, text)
+    await eng.asave()
+    return result
 
 @router.get("/snapshot/{sid}")
 async def snapshot(sid: str):
-    eng=ArenaEngine(sid)
+    eng=await ArenaEngine.aopen(sid)
+    await eng.asave()
     return eng.snapshot()
@@ -1,8 +1,9 @@
 
 import json, random
 from dataclasses import dataclass, asdict
-from core.state.v1 import StateStore
-from core.voice_gateway.v1 import VoicePipeline
+from typing import Optional
+from core.state.v1 import Session, evict_on_error, turn_count
+from core.voice_gateway.v1 import PromptBuilder, get_pipeline
 
 EMOTIONS = ["calm","neutral","annoyed","angry","excited"]
 CLIENT_TYPES = [
@@ -22,21 +23,22 @@ class ArenaState:
     def to_dict(self): return asdict(self)
 
 class ArenaEngine:
-    def __init__(self, sid: str):
+    def __init__(self, sid: str, session: Optional[Session]=None):
         self.sid=f"arena:{sid}"
-        self.store=StateStore("salesbot.db")
-        raw=self.store.get(self.sid)
-        if raw:
-            try:
-                d=json.loads(raw)
-                self.state=ArenaState(**d)
-            except:
-                self._reset()
-        else:
+        self.session=session or Session(self.sid)
+        self.state=self.session.load_state(lambda d: ArenaState(**d))
+        if self.state is None:
             self._reset()
 
-        try: self.llm=VoicePipeline().llm
+        try: self.llm=get_pipeline().llm
         except: self.llm=None
+        # история в промпт — окном в пределах бюджета токенов (PROMPT_BUDGETS)
+        self.prompts=PromptBuilder("arena", llm=self.llm)
+
+    @classmethod
+    async def aopen(cls, sid: str):
+        """Загрузка без блокировки event loop (async-роуты); запись — через asave()"""
+        return cls(sid, await Session.aopen(f"arena:{sid}"))
 
     def _reset(self):
         self.state = ArenaState(
@@ -49,11 +51,16 @@ class ArenaEngine:
         self._save()
 
     def _save(self):
-        self.store.set(self.sid, json.dumps(self.state.to_dict(), ensure_ascii=False))
+        self.session.save_state(self.state)
+
+    async def asave(self):
+        await self.session.aflush()
 
     def snapshot(self):
-        return self.state.to_dict()
+        # history — последние STATE_HISTORY_WINDOW ходов; сколько всего — turn_count
+        return dict(self.state.to_dict(), turn_count=turn_count(self.state.history))
 
+    @evict_on_error
     def handle(self, text: str)->dict:
         self.state.history.append({"role":"user","content":text})
         self.state.meta["round"] += 1
@@ -62,13 +69,16 @@ class ArenaEngine:
         suggestion=None
         if self.llm:
             try:
-                msg=[
-                  {"role":"system","content":f"Ты клиент. {persona_desc} Реагируй естественно."},
-                  {"role":"user","content":text}
-                ]
+                msg=self.prompts.build(
+                  f"Ты клиент. {persona_desc} Реагируй естественно.",
+                  self.state.history, user=text, meta=self.state.meta,
+                  upto=len(self.state.history)-1
+                )
                 suggestion=self.llm.chat(msg)
             except:
                 suggestion=None
+        if suggestion:
+            self.state.history.append({"role":"assistant","content":suggestion})
 
         # emotion shift
         if any(w in text.lower() for w in ["извиняюсь","понимаю","давайте","готов"]):
@@ -94,6 +104,7 @@ class ArenaEngine:
             "score":score
         }
 
+    @evict_on_error
     def reset(self):
         self._reset()
         return {"ok":True}
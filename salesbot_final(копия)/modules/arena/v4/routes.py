@@ -17,8 +17,9 @@ async def start_telegram(req: Request):
     
     # Use chat_id as session ID for telegram users
     sid = str(chat_id)
-    eng = ArenaEngine(sid)
+    eng = await ArenaEngine.aopen(sid)
     eng.reset()
+    await eng.asave()
     
     # Get initial state to show user
     state = eng.snapshot()
@@ -34,6 +35,7 @@ async def start_telegram(req: Request):
     }
 @router.post("/start/{sid}")
 async def start(sid: str):
-    eng = ArenaEngine(sid)
+    eng = await ArenaEngine.aopen(sid)
     eng.reset()
+    await eng.asave()
     return {"ok": True, "sid": sid}
\ No newline at end of file
@@ -1,6 +1,11 @@
+import asyncio
+
 from .routes import router
 __all__=['router']
 
+# Незавершённые запросы /coach по пользователю: новый вопрос отменяет старый
+_COACH_TASKS = {}
+
 # Telegram integration
 try:
     from aiogram import types
@@ -25,7 +30,7 @@ def register_telegram(dp, registry):
         Команда /coach <текст> - получить совет коуча
         Пример: /coach Как ответить клиенту на возражение о цене?
         """
-        from .service import persona_chat
+        from .service import apersona_chat
         
         # Получаем текст после команды
         text = message.get_args()
@@ -37,12 +42,26 @@ def register_telegram(dp, registry):
             )
             return
         
+        uid = message.from_user.id if message.from_user else message.chat.id
+        prev = _COACH_TASKS.get(uid)
+        if prev is not None and not prev.done():
+            # пользователь не дождался ответа и спросил заново — старый запрос к LLM отменяем
+            prev.cancel()
+        task = asyncio.ensure_future(apersona_chat(text, role="coach"))
+        _COACH_TASKS[uid] = task
         try:
-            # Генерируем ответ коуча
-            reply = persona_chat(text, role="coach")
+            # Генерируем ответ коуча (не блокируя event loop бота)
+            reply = await task
             await message.reply(f"🎓 Совет коуча:\n\n{reply}")
+        except asyncio.CancelledError:
+            if _COACH_TASKS.get(uid) is not task:
+                return  # заменён более новым /coach
+            raise
         except Exception as e:
             await message.reply(f"❌ Ошибка: {str(e)}")
+        finally:
+            if _COACH_TASKS.get(uid) is task:
+                del _COACH_TASKS[uid]
     
     @dp.message_handler(commands=["stylize"])
     async def _cmd_stylize(message: types.Message):
@@ -1,7 +1,7 @@
 
 import os, json, random
 from typing import Dict, Any
-from core.voice_gateway.v1 import VoicePipeline
+from core.voice_gateway.v1 import get_pipeline
 
 BASE = os.path.dirname(__file__)
 DATA = os.path.join(BASE, "data", "persona.json")
@@ -23,20 +23,33 @@ def apply_persona(role: str, text: str)->str:
         prefix = random.choice(blocks.get("client_rational", ["Мне нужно…"]))
     return f"{prefix} {text}"
 
-def persona_chat(prompt: str, role: str="coach")->str:
+def _persona_messages(prompt: str):
     persona = load_persona()
-    vp = VoicePipeline()
     sys = (
         "Ты говоришь от имени бренда «На Счастье»: тёплый, уверенный стиль, "
         "эмоции, искренность, уважение. Следуй правилам:\n" +
         "\n".join(persona.get("rules", []))
     )
-    msg = [
+    return [
         {"role": "system", "content": sys},
         {"role": "user", "content": prompt}
     ]
+
+def persona_chat(prompt: str, role: str="coach")->str:
+    vp = get_pipeline()
+    msg = _persona_messages(prompt)
     try:
         base = vp.llm.chat(msg)
         return apply_persona(role, base)
     except Exception:
         return apply_persona(role, prompt)
+
+async def apersona_chat(prompt: str, role: str="coach")->str:
+    """Async-версия для aiogram/FastAPI: не блокирует event loop, отменяема."""
+    vp = get_pipeline()
+    msg = _persona_messages(prompt)
+    try:
+        base = await vp.llm.achat(msg)
+        return apply_persona(role, base)
+    except Exception:
+        return apply_persona(role, prompt)
@@ -150,8 +150,7 @@ def register_telegram(dp, registry):
         from modules.master_path.v3.engine import MasterPath
         
         user_id = str(message.from_user.id)
-        mp = MasterPath(user_id)
-        state = mp.snapshot()
+        stage = await MasterPath.astage(user_id)
         
         stages_ru = {
             "greeting": "Приветствие",
@@ -163,7 +162,7 @@ def register_telegram(dp, registry):
             "done": "Завершено"
         }
         
-        stage_name = stages_ru.get(state['stage'], state['stage'])
+        stage_name = stages_ru.get(stage, stage)
         
         help_text = (
             "🎯 <b>Путь Мастера</b> - Полный цикл продажи\n\n"
@@ -1,26 +1,34 @@
 
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from .engine import MasterPath
 
 router = APIRouter(prefix="/master_path/v3", tags=["master_path"])
 
 @router.post("/start/{sid}")
 async def start(sid: str):
-    mp = MasterPath(sid)
+    mp = await MasterPath.aopen(sid)
     mp.reset()
+    await mp.asave()
     return {"ok": True, "sid": sid}
 
 @router.post("/handle/{sid}")
 async def handle(sid: str, text: str):
-    mp = MasterPath(sid)
-    return mp.handle(text)
+    mp = await MasterPath.aopen(sid)
+    # handle() синхронно ходит в LLM — в пул потоков, чтобы не держать event loop
+    result = await run_in_threadpool(mp.handle, text)
+    await mp.asave()
+    return result
 
 @router.get("/snapshot/{sid}")
 async def snapshot(sid: str):
-    mp = MasterPath(sid)
+    mp = await MasterPath.aopen(sid)
+    await mp.asave()
     return mp.snapshot()
 
 @router.post("/reset/{sid}")
 async def reset(sid: str):
-    mp = MasterPath(sid)
-    return mp.reset()
+    mp = await MasterPath.aopen(sid)
+    result = mp.reset()
+    await mp.asave()
+    return result
@@ -62,7 +62,7 @@ def register_telegram(dp, registry):
         }
         
         stage_name = stages_ru.get(state['stage'], state['stage'])
-        history_count = len(state.get('history', []))
+        history_count = state['turn_count']
         
         status_text = (
             f"📊 <b>Статус тренировки</b>\n\n"
@@ -1,8 +1,8 @@
 
 from dataclasses import dataclass, asdict
-from typing import Dict, Any
-from core.state.v1 import StateStore
-from core.voice_gateway.v1 import VoicePipeline
+from typing import Dict, Any, Optional
+from core.state.v1 import Session, evict_on_error, turn_count
+from core.voice_gateway.v1 import get_pipeline
 
 STAGES = ["greeting","qualification","support","offer","demo","final","done"]
 
@@ -16,37 +16,49 @@ class MPState:
         return asdict(self)
 
 class MasterPath:
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, session: Optional[Session] = None):
         self.sid = f"mp:{session_id}"
-        self.store = StateStore("salesbot.db")
-        raw = self.store.get(self.sid)
-        if raw:
-            try:
-                import json
-                d = json.loads(raw)
-                self.state = MPState(stage=d.get("stage","greeting"),
-                                     history=d.get("history",[]),
-                                     metadata=d.get("metadata",{}))
-            except Exception:
-                self._reset()
-        else:
+        self.session = session or Session(self.sid)
+        self.state = self.session.load_state(self._parse)
+        if self.state is None:
             self._reset()
         try:
-            self.llm = VoicePipeline().llm
+            self.llm = get_pipeline().llm
         except Exception:
             self.llm = None
 
+    @classmethod
+    async def aopen(cls, session_id: str):
+        """Загрузка без блокировки event loop (async-роуты); запись — через asave()"""
+        return cls(session_id, await Session.aopen(f"mp:{session_id}"))
+
+    @staticmethod
+    async def astage(session_id: str) -> str:
+        """Текущий этап по заголовку сессии — без чтения истории и без создания сессии"""
+        header = await Session(f"mp:{session_id}").aheader()
+        return (header or {}).get("stage", "greeting")
+
+    @staticmethod
+    def _parse(d: dict) -> MPState:
+        return MPState(stage=d.get("stage","greeting"),
+                       history=d.get("history",[]),
+                       metadata=d.get("metadata",{}))
+
     def _reset(self):
         self.state = MPState(stage="greeting", history=[], metadata={})
         self._save()
 
     def _save(self):
-        import json
-        self.store.set(self.sid, json.dumps(self.state.to_dict(), ensure_ascii=False))
+        self.session.save_state(self.state)
+
+    async def asave(self):
+        await self.session.aflush()
 
     def snapshot(self)->dict:
-        return self.state.to_dict()
+        # history — последние STATE_HISTORY_WINDOW ходов; сколько всего — turn_count
+        return dict(self.state.to_dict(), turn_count=turn_count(self.state.history))
 
+    @evict_on_error
     def advance(self)->str:
         idx = STAGES.index(self.state.stage)
         if idx < len(STAGES)-1:
@@ -54,6 +66,7 @@ class MasterPath:
             self._save()
         return self.state.stage
 
+    @evict_on_error
     def handle(self, text: str)->dict:
         self.state.history.append({"role":"user","content":text})
         suggestion = None
@@ -83,6 +96,7 @@ class MasterPath:
         self._save()
         return reply
 
+    @evict_on_error
     def reset(self):
         self._reset()
         return {"ok": True}
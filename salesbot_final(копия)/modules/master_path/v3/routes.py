@@ -17,8 +17,9 @@ async def start_telegram(req: Request):
     
     # Use chat_id as session ID for telegram users
     sid = str(chat_id)
-    mp = MasterPath(sid)
+    mp = await MasterPath.aopen(sid)
     mp.reset()
+    await mp.asave()
     
     # Get initial state to show user
     state = mp.snapshot()
@@ -33,6 +34,7 @@ async def start_telegram(req: Request):
     }
 @router.post("/start/{sid}")
 async def start(sid: str):
-    mp = MasterPath(sid)
+    mp = await MasterPath.aopen(sid)
     mp.reset()
+    await mp.asave()
     return {"ok": True, "sid": sid}
\ No newline at end of file
@@ -89,7 +89,7 @@ def register_telegram(dp, registry):
         
         obj_type = objection_types_ru.get(state['objection_type'], state['objection_type'])
         persona = personas_ru.get(state['persona'], state['persona'])
-        history_count = len(state.get('history', []))
+        history_count = state['turn_count']
         
         status_text = (
             f"📊 <b>Статус тренировки</b>\n\n"
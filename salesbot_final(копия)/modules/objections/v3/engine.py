@@ -1,8 +1,9 @@
 
 import random, json
 from dataclasses import dataclass, asdict
-from core.state.v1 import StateStore
-from core.voice_gateway.v1 import VoicePipeline
+from typing import Optional
+from core.state.v1 import Session, evict_on_error, turn_count
+from core.voice_gateway.v1 import get_pipeline
 
 OBJECTION_TYPES = [
     "price","trust","hurry","think","ask_spouse","scam_fear",
@@ -26,23 +27,22 @@ class OBJState:
         return asdict(self)
 
 class ObjectionEngine:
-    def __init__(self, sid: str):
+    def __init__(self, sid: str, session: Optional[Session]=None):
         self.sid=f"obj:{sid}"
-        self.store=StateStore("salesbot.db")
-        raw=self.store.get(self.sid)
-        if raw:
-            try:
-                d=json.loads(raw)
-                self.state=OBJState(**d)
-            except:
-                self._reset()
-        else:
+        self.session=session or Session(self.sid)
+        self.state=self.session.load_state(lambda d: OBJState(**d))
+        if self.state is None:
             self._reset()
         try:
-            self.llm=VoicePipeline().llm
+            self.llm=get_pipeline().llm
         except:
             self.llm=None
 
+    @classmethod
+    async def aopen(cls, sid: str):
+        """Загрузка без блокировки event loop (async-роуты); запись — через asave()"""
+        return cls(sid, await Session.aopen(f"obj:{sid}"))
+
     def _reset(self):
         persona=random.choice(list(PERSONAS.keys()))
         otype=random.choice(OBJECTION_TYPES)
@@ -50,11 +50,16 @@ class ObjectionEngine:
         self._save()
 
     def _save(self):
-        self.store.set(self.sid, json.dumps(self.state.to_dict(), ensure_ascii=False))
+        self.session.save_state(self.state)
+
+    async def asave(self):
+        await self.session.aflush()
 
     def snapshot(self):
-        return self.state.to_dict()
+        # history — последние STATE_HISTORY_WINDOW ходов; сколько всего — turn_count
+        return dict(self.state.to_dict(), turn_count=turn_count(self.state.history))
 
+    @evict_on_error
     def handle(self, text: str)->dict:
         self.state.history.append({"role":"user","content":text})
         persona_desc=PERSONAS[self.state.persona]
@@ -87,6 +92,7 @@ class ObjectionEngine:
             "score": score
         }
 
+    @evict_on_error
     def reset(self):
         self._reset()
         return {"ok":True}
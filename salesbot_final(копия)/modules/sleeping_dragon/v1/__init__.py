@@ -86,7 +86,7 @@ def register_telegram(dp, registry):
             f"📍 Ситуация: {scenario_name}\n"
             f"👤 Тип клиента: {behavior_name}\n"
             f"🌊 Волна: {state['wave']} из 3\n"
-            f"💬 Сообщений: {len(state.get('history', []))}\n\n"
+            f"💬 Сообщений: {state['turn_count']}\n\n"
             f"Продолжай работать с клиентом!"
         )
         
@@ -3,12 +3,14 @@
 Обучает продажников возвращать клиентов через 3 волны сообщений
 """
 
+import asyncio
 import json
 import random
+import uuid
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Any
-from core.state.v1 import StateStore
-from core.voice_gateway.v1 import VoicePipeline
+from typing import List, Dict, Any, Optional
+from core.state.v1 import Session, evict_on_error, get_async_store, get_store, turn_count
+from core.voice_gateway.v1 import PRIORITY_BACKGROUND, PromptBuilder, get_pipeline
 
 # Ситуации для тренировки
 SCENARIOS = [
@@ -30,6 +32,57 @@ CLIENT_BEHAVIORS = [
     "interested",      # Интересуется, но забыл
 ]
 
+# Фоновые задачи обратной связи наставника и LLM-конспекта: sid -> asyncio.Task (см. ahandle)
+_FEEDBACK_TASKS: Dict[str, "asyncio.Task"] = {}
+_SUMMARY_TASKS: Dict[str, "asyncio.Task"] = {}
+
+
+def _forget(tasks: Dict[str, "asyncio.Task"], sid: str, task: "asyncio.Task"):
+    if tasks.get(sid) is task:
+        del tasks[sid]
+
+
+# Разбор, сгенерированный в фоне, пишется отдельным ключом kv на слот, а не в
+# заголовок сессии: фоновая задача не пересохраняет сессию и не спорит с
+# очередным /turn. В заголовке на месте такого разбора — None, при загрузке
+# слоты заполняются из kv. gen в ключе — разборы сброшенной тренировки не
+# попадают в новую (старые ключи удаляет чистильщик по TTL "sleeping_dragon").
+
+def _feedback_key(sid: str, gen: Optional[str], slot: int) -> str:
+    return f"{sid}:fb:{gen or '-'}:{slot:05d}"
+
+
+def _missing_feedback(sid: str, state: Dict[str, Any]) -> Dict[str, int]:
+    """ключ kv -> номер слота для ещё не заполненных разборов"""
+    gen = (state.get("meta") or {}).get("gen")
+    return {_feedback_key(sid, gen, i): i for i, f in enumerate(state.get("feedback") or []) if f is None}
+
+
+def _fill_feedback(feedback: List[Optional[str]], keys: Dict[str, int], found: Dict[str, str]):
+    for key, slot in keys.items():
+        if key in found:
+            feedback[slot] = found[key]
+
+
+# LLM-конспект истории (PROMPT_SUMMARY=llm) в async-ходе строится так же в фоне и
+# пишется в свой ключ: {"summary": ..., "summary_upto": ...}; в state.meta он
+# попадает при загрузке, если новее того, что уже в заголовке.
+
+def _summary_key(sid: str, gen: Optional[str]) -> str:
+    return f"{sid}:summary:{gen or '-'}"
+
+
+def _adopt_summary(meta: Dict[str, Any], raw: Optional[str]):
+    if not raw:
+        return
+    try:
+        d = json.loads(raw)
+    except ValueError:
+        return
+    if int(d.get("summary_upto") or 0) > int(meta.get("summary_upto") or 0):
+        meta["summary"] = d.get("summary") or ""
+        meta["summary_upto"] = d["summary_upto"]
+
 
 @dataclass
 class SleepingDragonState:
@@ -51,25 +104,46 @@ class SleepingDragonEngine:
     Симулирует неактивного клиента и даёт обратную связь.
     """
     
-    def __init__(self, sid: str):
+    def __init__(self, sid: str, session: Optional[Session] = None, load_side: bool = True):
         self.sid = f"sleeping_dragon:{sid}"
-        self.store = StateStore("salesbot.db")
-        raw = self.store.get(self.sid)
+        self.session = session or Session(self.sid)
+        self.state = self.session.load_state(lambda d: SleepingDragonState(**d))
         
-        if raw:
-            try:
-                d = json.loads(raw)
-                self.state = SleepingDragonState(**d)
-            except:
-                self._reset()
-        else:
+        if self.state is None:
             self._reset()
+        elif load_side:
+            self._apply_side(get_store(self.session.path).get_many(self._side_keys()))
         
         # Подключение к DeepSeek (Tietz)
         try:
-            self.llm = VoicePipeline().llm
+            self.llm = get_pipeline().llm
         except:
             self.llm = None
+        
+        # История диалога в промпт клиента — окном в пределах бюджета токенов
+        self.prompts = PromptBuilder(
+            "sleeping_dragon",
+            role_map={"seller": "user", "client": "assistant"},
+            llm=self.llm
+        )
+    
+    @classmethod
+    async def aopen(cls, sid: str):
+        """Загрузка без блокировки event loop (async-роуты); запись — через asave()"""
+        engine = cls(sid, await Session.aopen(f"sleeping_dragon:{sid}"), load_side=False)
+        engine._apply_side(await get_async_store(engine.session.path).get_many(engine._side_keys()))
+        return engine
+    
+    def _missing_feedback(self) -> Dict[str, int]:
+        return _missing_feedback(self.sid, {"meta": self.state.meta, "feedback": self.state.feedback})
+    
+    def _side_keys(self) -> List[str]:
+        """Ключи kv, куда фоновые задачи пишут мимо заголовка: разборы и конспект"""
+        return list(self._missing_feedback()) + [_summary_key(self.sid, self.state.meta.get("gen"))]
+    
+    def _apply_side(self, found: Dict[str, str]):
+        _fill_feedback(self.state.feedback, self._missing_feedback(), found)
+        _adopt_summary(self.state.meta, found.get(_summary_key(self.sid, self.state.meta.get("gen"))))
     
     def _reset(self):
         """Создать новую тренировку"""
@@ -79,10 +153,11 @@ class SleepingDragonEngine:
             wave=1,
             history=[],
             feedback=[],
-            meta={"responses": 0}
+            meta={"responses": 0, "gen": uuid.uuid4().hex}  # gen — токен тренировки, меняется при сбросе
         )
         self._save()
     
+    @evict_on_error
     def reset(self):
         """Публичный метод сброса"""
         self._reset()
@@ -90,11 +165,16 @@ class SleepingDragonEngine:
     
     def _save(self):
         """Сохранить состояние"""
-        self.store.set(self.sid, json.dumps(self.state.to_dict(), ensure_ascii=False))
+        self.session.save_state(self.state)
+    
+    async def asave(self):
+        """Асинхронно записать отложенное состояние"""
+        await self.session.aflush()
     
     def snapshot(self):
         """Получить текущее состояние"""
-        return self.state.to_dict()
+        # history — последние STATE_HISTORY_WINDOW ходов; сколько всего — turn_count
+        return dict(self.state.to_dict(), turn_count=turn_count(self.state.history))
     
     def _get_scenario_description(self) -> str:
         """Получить описание ситуации"""
@@ -178,52 +258,163 @@ class SleepingDragonEngine:
 
 Тон: тёплый, поддерживающий, экспертный."""
     
+    @evict_on_error
     def handle(self, text: str) -> Dict[str, Any]:
         """
         Обработка сообщения продавца.
         Возвращает ответ клиента + обратную связь от наставника.
         """
         # Сохраняем сообщение продавца
-        self.state.history.append({
-            "role": "seller",
-            "content": text,
-            "wave": self.state.wave
-        })
-        self.state.meta["responses"] += 1
+        self._add_seller_turn(text)
         
         # Генерируем ответ клиента через Tietz
         client_response = self._generate_client_response(text)
         
         # Сохраняем ответ клиента
-        self.state.history.append({
-            "role": "client",
-            "content": client_response,
-            "wave": self.state.wave
-        })
+        self._add_client_turn(client_response)
         
         # Генерируем обратную связь от наставника
         coach_feedback = self._generate_coach_feedback(text, client_response)
         self.state.feedback.append(coach_feedback)
         
-        # Проверяем, пора ли переходить к следующей волне
-        should_advance = self.state.meta["responses"] % 2 == 0  # После каждых 2 ответов
+        result = self._result(client_response, coach_feedback)
+        self._advance_wave(result)
+        
+        self._save()
+        return result
+    
+    @evict_on_error
+    async def ahandle(self, text: str) -> Dict[str, Any]:
+        """
+        Async-обработка хода: ждём только ответ клиента (один вызов LLM).
+        Обратная связь наставника генерируется фоновой задачей и пишется в свой
+        ключ kv (в state.feedback попадает при следующей загрузке) — забрать её можно через
+        wait_feedback() / GET /sleeping_dragon/v1/feedback/{user_id}.
+        """
+        self._add_seller_turn(text)
+        client_response = await self._agenerate_client_response(text)
+        self._add_client_turn(client_response)
+        
+        # Промпт наставника собираем до смены волны — разбор относится к этому ходу
+        coach_messages = self._coach_messages(text, client_response)
+        slot = len(self.state.feedback)
+        self.state.feedback.append(None)  # место под разбор этого хода
+        
+        result = self._result(client_response, None)
+        result["feedback_pending"] = True
+        result["feedback_index"] = slot
+        self._advance_wave(result)
+        
+        # Ход пишем сразу, разбор — отдельным ключом, когда будет готов
+        self._save()
+        await self.asave()
+        
+        key = _feedback_key(self.sid, self.state.meta.get("gen"), slot)
+        task = asyncio.get_running_loop().create_task(self._afill_feedback(key, coach_messages))
+        _FEEDBACK_TASKS[self.sid] = task
+        task.add_done_callback(lambda t, sid=self.sid: _forget(_FEEDBACK_TASKS, sid, t))
         
-        result = {
+        # конспект истории тоже не ждём перед ответом (см. PromptBuilder.build(defer=True))
+        if self.prompts.deferred is not None and self.sid not in _SUMMARY_TASKS:
+            key = _summary_key(self.sid, self.state.meta.get("gen"))
+            task = asyncio.get_running_loop().create_task(self._arefresh_summary(key, *self.prompts.deferred))
+            _SUMMARY_TASKS[self.sid] = task
+            task.add_done_callback(lambda t, sid=self.sid: _forget(_SUMMARY_TASKS, sid, t))
+        return result
+    
+    async def _afill_feedback(self, key: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Фоновая генерация разбора и запись его в свой ключ kv (см. _feedback_key).
+        Заголовок и ходы сессии не трогаем: их в это время может сохранять /turn.
+        """
+        feedback = await self._agenerate_coach_feedback(messages)
+        await get_async_store(self.session.path).set(key, feedback)
+        return feedback
+    
+    async def _arefresh_summary(self, key: str, previous: str, turns: List[Any], upto: int) -> Optional[str]:
+        """Фоновый LLM-конспект выпавших из окна ходов — в свой ключ kv"""
+        text = await self.prompts.asummarize(previous, turns)
+        if text is not None:
+            await get_async_store(self.session.path).set(
+                key, json.dumps({"summary": text, "summary_upto": upto}, ensure_ascii=False))
+        return text
+    
+    @staticmethod
+    async def aheader(sid: str) -> Optional[Dict[str, Any]]:
+        """Волна/разборы/метаданные без чтения истории (заголовок сессии) или None"""
+        session = Session(f"sleeping_dragon:{sid}")
+        state = await session.aheader()
+        if state:
+            keys = _missing_feedback(session.key, state)
+            if keys:
+                state["feedback"] = list(state["feedback"])
+                _fill_feedback(state["feedback"], keys, await get_async_store(session.path).get_many(keys))
+        return state
+    
+    @staticmethod
+    def pending_feedback(sid: str) -> Optional["asyncio.Task"]:
+        """Незавершённая задача разбора для пользователя sid (или None)"""
+        return _FEEDBACK_TASKS.get(f"sleeping_dragon:{sid}")
+    
+    @staticmethod
+    async def wait_feedback(sid: str, timeout: float) -> bool:
+        """Дождаться разбора последнего хода (без отмены задачи); True — готов"""
+        task = _FEEDBACK_TASKS.get(f"sleeping_dragon:{sid}")
+        if task is None:
+            return True
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        return bool(done)
+    
+    def _add_seller_turn(self, text: str):
+        self.state.history.append({
+            "role": "seller",
+            "content": text,
+            "wave": self.state.wave
+        })
+        self.state.meta["responses"] += 1
+    
+    def _add_client_turn(self, client_response: str):
+        self.state.history.append({
+            "role": "client",
+            "content": client_response,
+            "wave": self.state.wave
+        })
+    
+    def _result(self, client_response: str, coach_feedback: Optional[str]) -> Dict[str, Any]:
+        return {
             "client_response": client_response,
             "coach_feedback": coach_feedback,
             "wave": self.state.wave,
             "scenario": self._get_scenario_description(),
             "behavior": self.state.behavior,
         }
+    
+    def _advance_wave(self, result: Dict[str, Any]):
+        """Проверяем, пора ли переходить к следующей волне"""
+        should_advance = self.state.meta["responses"] % 2 == 0  # После каждых 2 ответов
         
         if should_advance and self.state.wave < 3:
             self.state.wave += 1
             result["wave_advanced"] = True
             result["next_wave"] = self.state.wave
             result["wave_message"] = self._get_wave_message(self.state.wave)
-        
-        self._save()
-        return result
+    
+    def _client_messages(self, seller_message: str, defer: bool = False) -> List[Dict[str, str]]:
+        # сообщение продавца уже в истории — в окно идут ходы до него
+        return self.prompts.build(
+            self._get_client_role_prompt(),
+            self.state.history,
+            user=seller_message,
+            meta=self.state.meta,
+            upto=len(self.state.history) - 1,
+            defer=defer
+        )
+    
+    def _coach_messages(self, seller_message: str, client_response: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self._get_coach_role_prompt(seller_message, client_response)},
+            {"role": "user", "content": f"Проанализируй это сообщение продавца в контексте ответа клиента"}
+        ]
     
     def _generate_client_response(self, seller_message: str) -> str:
         """Генерация ответа клиента через DeepSeek"""
@@ -231,11 +422,7 @@ class SleepingDragonEngine:
             return self._local_client_response()
         
         try:
-            messages = [
-                {"role": "system", "content": self._get_client_role_prompt()},
-                {"role": "user", "content": seller_message}
-            ]
-            response = self.llm.chat(messages)
+            response = self.llm.chat(self._client_messages(seller_message))
             return response
         except Exception as e:
             return self._local_client_response()
@@ -246,15 +433,37 @@ class SleepingDragonEngine:
             return self._local_coach_feedback()
         
         try:
-            messages = [
-                {"role": "system", "content": self._get_coach_role_prompt(seller_message, client_response)},
-                {"role": "user", "content": f"Проанализируй это сообщение продавца в контексте ответа клиента"}
-            ]
-            feedback = self.llm.chat(messages)
+            feedback = self.llm.chat(self._coach_messages(seller_message, client_response))
             return feedback
         except Exception as e:
             return self._local_coach_feedback()
     
+    async def _agenerate_client_response(self, seller_message: str) -> str:
+        """Ответ клиента без блокировки event loop"""
+        if not self.llm:
+            return self._local_client_response()
+        
+        try:
+            # defer: LLM-конспект истории — в фоне после ответа (ahandle)
+            return await self.llm.achat(self._client_messages(seller_message, defer=True))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._local_client_response()
+    
+    async def _agenerate_coach_feedback(self, messages: List[Dict[str, str]]) -> str:
+        """Разбор наставника без блокировки event loop"""
+        if not self.llm:
+            return self._local_coach_feedback()
+        
+        try:
+            # разбор ждут не сразу — ходы других пользователей идут к API первыми
+            return await self.llm.achat(messages, priority=PRIORITY_BACKGROUND)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._local_coach_feedback()
+    
     def _local_client_response(self) -> str:
         """Локальный ответ клиента без AI"""
         responses = [
@@ -28,8 +28,9 @@ async def start_telegram(req: Request):
     
     # Use chat_id as user ID for telegram users
     user_id = str(chat_id)
-    engine = SleepingDragonEngine(user_id)
+    engine = await SleepingDragonEngine.aopen(user_id)
     result = engine.reset()
+    await engine.asave()
     
     # Get initial state to show user
     state = engine.snapshot()
@@ -75,8 +76,9 @@ async def start_session(user_id: str):
     """
     Legacy endpoint - creates new sleeping dragon session
     """
-    engine = SleepingDragonEngine(user_id)
+    engine = await SleepingDragonEngine.aopen(user_id)
     engine.reset()
+    await engine.asave()
     state = engine.snapshot()
     return {"ok": True, "user_id": user_id, "state": state}
 
@@ -85,7 +87,9 @@ async def start_session(user_id: str):
 async def process_turn(req: Request):
     """
     Process a turn in the sleeping dragon training
-    User sends a message, we provide client response and feedback
+    User sends a message, we reply with the client response right away;
+    coach feedback is generated in background - poll GET /feedback/{user_id}
+    (or pass "wait_feedback": seconds to wait for it here)
     """
     data = await req.json()
     user_id = data.get("user_id") or data.get("chat_id")
@@ -95,21 +99,52 @@ async def process_turn(req: Request):
         return {"error": "user_id and message required"}
     
     user_id = str(user_id)
-    engine = SleepingDragonEngine(user_id)
-    result = engine.process_message(message)
+    engine = await SleepingDragonEngine.aopen(user_id)
+    result = await engine.ahandle(message)
+    await engine.asave()
+    
+    wait = float(data.get("wait_feedback") or 0)
+    if wait > 0 and await SleepingDragonEngine.wait_feedback(user_id, min(wait, 60.0)):
+        engine = await SleepingDragonEngine.aopen(user_id)  # разбор записан отдельным сохранением
+        result["coach_feedback"] = engine.state.feedback[result["feedback_index"]]
+        result["feedback_pending"] = result["coach_feedback"] is None
     
     return {
         "ok": True,
-        "reply": result.get("reply", ""),
-        "feedback": result.get("feedback", ""),
+        "reply": result["client_response"],
+        "feedback": result["coach_feedback"],
+        "feedback_pending": result["feedback_pending"],
+        "result": result,
         "state": engine.snapshot()
     }
 
 
+@router.get("/feedback/{user_id}")
+async def get_feedback(user_id: str, wait: float = 0):
+    """
+    Coach feedback for the last turn (follow-up to /turn).
+    wait - seconds to wait if feedback is still being generated
+    """
+    if wait > 0:
+        await SleepingDragonEngine.wait_feedback(user_id, min(wait, 60.0))
+    pending = SleepingDragonEngine.pending_feedback(user_id) is not None
+    # нужны только feedback и wave — читаем заголовок, без истории диалога
+    state = await SleepingDragonEngine.aheader(user_id) or {}
+    feedback = state.get("feedback") or []
+    return {
+        "ok": True,
+        "pending": pending,
+        "index": len(feedback) - 1,
+        "feedback": feedback[-1] if feedback else None,
+        "wave": state.get("wave", 1)
+    }
+
+
 @router.get("/state/{user_id}")
 async def get_state(user_id: str):
     """Get current state of user's sleeping dragon session"""
-    engine = SleepingDragonEngine(user_id)
+    engine = await SleepingDragonEngine.aopen(user_id)
+    await engine.asave()
     state = engine.snapshot()
     return {"ok": True, "state": state}
 
@@ -117,6 +152,7 @@ async def get_state(user_id: str):
 @router.post("/reset/{user_id}")
 async def reset_session(user_id: str):
     """Reset user's sleeping dragon session to start fresh"""
-    engine = SleepingDragonEngine(user_id)
+    engine = await SleepingDragonEngine.aopen(user_id)
     result = engine.reset()
+    await engine.asave()
     return {"ok": True, "result": result, "state": engine.snapshot()}
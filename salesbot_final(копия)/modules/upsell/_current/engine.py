@@ -1,8 +1,9 @@
 
 import json, random
 from dataclasses import dataclass, asdict
-from core.state.v1 import StateStore
-from core.voice_gateway.v1 import VoicePipeline
+from typing import Optional
+from core.state.v1 import Session, evict_on_error, turn_count
+from core.voice_gateway.v1 import get_pipeline
 
 MODES = ["soft","normal","aggressive"]
 PACKAGES = {
@@ -21,23 +22,22 @@ class USState:
         return asdict(self)
 
 class UpsellEngine:
-    def __init__(self, sid:str):
+    def __init__(self, sid: str, session: Optional[Session]=None):
         self.sid=f"us:{sid}"
-        self.store=StateStore("salesbot.db")
-        raw=self.store.get(self.sid)
-        if raw:
-            try:
-                d=json.loads(raw)
-                self.state=USState(**d)
-            except:
-                self._reset()
-        else:
+        self.session=session or Session(self.sid)
+        self.state=self.session.load_state(lambda d: USState(**d))
+        if self.state is None:
             self._reset()
         try:
-            self.llm=VoicePipeline().llm
+            self.llm=get_pipeline().llm
         except:
             self.llm=None
 
+    @classmethod
+    async def aopen(cls, sid: str):
+        """Загрузка без блокировки event loop (async-роуты); запись — через asave()"""
+        return cls(sid, await Session.aopen(f"us:{sid}"))
+
     def _reset(self):
         mode=random.choice(MODES)
         pkg=random.choice(list(PACKAGES.keys()))
@@ -45,11 +45,16 @@ class UpsellEngine:
         self._save()
 
     def _save(self):
-        self.store.set(self.sid, json.dumps(self.state.to_dict(), ensure_ascii=False))
+        self.session.save_state(self.state)
+
+    async def asave(self):
+        await self.session.aflush()
 
     def snapshot(self):
-        return self.state.to_dict()
+        # history — последние STATE_HISTORY_WINDOW ходов; сколько всего — turn_count
+        return dict(self.state.to_dict(), turn_count=turn_count(self.state.history))
 
+    @evict_on_error
     def handle(self, text:str)->dict:
         self.state.history.append({"role":"user","content":text})
         pkg_desc=PACKAGES[self.state.package]
@@ -81,6 +86,7 @@ class UpsellEngine:
             "score":score
         }
 
+    @evict_on_error
     def reset(self):
         self._reset()
         return {"ok":True}
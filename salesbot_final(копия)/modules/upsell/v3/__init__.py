@@ -70,7 +70,7 @@ def register_telegram(dp, registry):
         
         mode_name = modes_ru.get(state['mode'], state['mode'])
         package_name = packages_ru.get(state['package'], state['package'])
-        history_count = len(state.get('history', []))
+        history_count = state['turn_count']
         
         status_text = (
             f"📊 <b>Статус тренировки</b>\n\n"
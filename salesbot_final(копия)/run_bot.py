@@ -11,16 +11,17 @@ if not TELEGRAM_TOKEN:
     print("ERROR: set TELEGRAM_TOKEN environment variable")
     sys.exit(1)
 
-from aiogram import Bot
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import executor
 
 # Подключаем автозагрузчик модулей для telegram
 from telegram.autoload import autoload_telegram_handlers
 from api.core.registry import ModuleRegistry
+# отправки бота — через общую очередь с лимитами Telegram
+from integrations.telegram_bot.v1.outbox import aiogram_bot
 
 def main():
-    bot = Bot(token=TELEGRAM_TOKEN)
+    bot = aiogram_bot(TELEGRAM_TOKEN)
     dp = Dispatcher(bot)
     registry = ModuleRegistry()
 
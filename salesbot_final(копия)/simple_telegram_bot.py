@@ -2,10 +2,13 @@
 # Replace your existing file with this one.
 import os
 import time
+import threading
 import requests
 import json
 import re
-from typing import Dict, Tuple, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, List
 
 # ============ SETTINGS ============
 BACKEND_URL = (os.getenv("BACKEND_URL") or "http://127.0.0.1:8080").rstrip("/")
@@ -17,6 +20,20 @@ TOKEN = (
     or os.getenv("TOKEN")
 )
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")  # optional
+# dispatcher: parallel workers, max queued updates overall / per chat
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+BOT_QUEUE_MAX = int(os.getenv("BOT_QUEUE_MAX", "500"))
+BOT_CHAT_QUEUE_MAX = int(os.getenv("BOT_CHAT_QUEUE_MAX", "20"))
+# module discovery: cache file, re-probe interval (s), parallel probes
+BOT_MODULES_CACHE = os.getenv("BOT_MODULES_CACHE") or os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "bot_modules_cache.json"
+)
+BOT_MODULES_TTL = int(os.getenv("BOT_MODULES_TTL", "600"))
+BOT_PROBE_WORKERS = int(os.getenv("BOT_PROBE_WORKERS", "8"))
+# where updates come from: inbox (webhook queue) when this process is the queue's
+# drainer, TG_INBOX_DRAINER=bot; otherwise poll (getUpdates). See UPDATE SOURCES.
+BOT_UPDATES = "inbox" if (os.getenv("TG_INBOX_DRAINER") or "").strip().lower() == "bot" else "poll"
+BOT_INBOX_POLL = float(os.getenv("BOT_INBOX_POLL", "0.5"))
 
 if not TOKEN:
     print("❌ Нет TELEGRAM токена в переменных окружения. Проверьте start_core_api.bat")
@@ -25,13 +42,33 @@ if not TOKEN:
 
 BASE_URL = f"https://api.telegram.org/bot{TOKEN}"
 
+# Keep-alive sessions, one per upstream: no new TCP/TLS handshake per message.
+# Pool = every worker plus the getUpdates long poll.
+try:
+    from core.integrations.patch_v4.http_client import get_session as http_session
+    TG_HTTP = http_session("telegram", pool_size=BOT_WORKERS + 1)
+    BACKEND_HTTP = http_session("backend", pool_size=BOT_WORKERS)
+except Exception:
+    # core not importable (bot started outside the project) — plain sessions
+    TG_HTTP = requests.Session()
+    BACKEND_HTTP = requests.Session()
+
+# Outgoing messages go through the shared send scheduler: Telegram limits
+# (~30 msg/s per bot, 1 msg/s per chat), retry_after on 429, retries on 5xx.
+try:
+    from integrations.telegram_bot.v1.outbox import get_outbox
+    OUTBOX = get_outbox(TOKEN)
+except Exception:
+    OUTBOX = None  # direct sendMessage, as before
+
 # Session memory: chat_id -> {"mode": "dialog"/None, "sid": str|None}
 SESSIONS: Dict[int, dict] = {}
 
 # Logging
 def log(*args):
     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    print(f"[{ts}] [BOT]", *args)
+    # one write per line: workers and probe threads log concurrently
+    print(f"[{ts}] [BOT] " + " ".join(str(a) for a in args), flush=True)
 
 # Telegram helpers
 def send_message(chat_id: int, text: str, reply_markup=None, parse_mode=None):
@@ -42,7 +79,13 @@ def send_message(chat_id: int, text: str, reply_markup=None, parse_mode=None):
             payload["reply_markup"] = reply_markup
         if parse_mode:
             payload["parse_mode"] = parse_mode
-        resp = requests.post(
+        if OUTBOX is not None:
+            # blocks this worker until sent — keeps replies of one chat in order
+            data = OUTBOX.send("sendMessage", payload)
+            if not data.get("ok"):
+                log("Ошибка sendMessage:", data.get("status"), data.get("description"))
+            return
+        resp = TG_HTTP.post(
             BASE_URL + "/sendMessage",
             json=payload,
             timeout=10,
@@ -80,7 +123,7 @@ def fetch_routes_summary() -> Dict:
     """
     url = BACKEND_URL + "/api/public/v1/routes_summary"
     try:
-        r = requests.get(url, timeout=5)
+        r = BACKEND_HTTP.get(url, timeout=5)
         r.raise_for_status()
         return r.json()
     except Exception as e:
@@ -115,7 +158,7 @@ def probe_module_endpoint(module: str, version: str) -> str:
         url = BACKEND_URL + candidate
         try:
             # POST a lightweight probe; backend should respond quickly
-            r = requests.post(url, json={"probe": True, "chat_id": 0}, timeout=5)
+            r = BACKEND_HTTP.post(url, json={"probe": True, "chat_id": 0}, timeout=5)
             # Accept any 2xx as success
             if 200 <= r.status_code < 300:
                 log("Probe OK:", candidate, "status", r.status_code)
@@ -141,10 +184,14 @@ def build_module_commands_from_backend() -> Dict[str, Tuple[str, str]]:
         return commands
 
     log("routes_summary attached modules count:", len(attached))
+    targets = []
     for imp in attached:
         module, version = parse_attached_module_name(imp)
-        if not module:
-            continue
+        if module and (module, version) not in targets:
+            targets.append((module, version))
+
+    def probe(target: Tuple[str, str]) -> str:
+        module, version = target
         # attempt to probe with version first
         endpoint = ""
         if version:
@@ -152,6 +199,12 @@ def build_module_commands_from_backend() -> Dict[str, Tuple[str, str]]:
         # if probe with version failed, also try without version
         if not endpoint:
             endpoint = probe_module_endpoint(module, "")
+        return endpoint
+
+    # modules are probed in parallel; patterns of one module — in order
+    with ThreadPoolExecutor(max_workers=max(1, BOT_PROBE_WORKERS), thread_name_prefix="probe") as pool:
+        endpoints = list(pool.map(probe, targets))
+    for (module, version), endpoint in zip(targets, endpoints):
         if endpoint:
             cmd = f"/{module}"
             desc = f"{module} ({version or 'no-version'})"
@@ -206,11 +259,89 @@ def find_modules_commands_fs() -> Dict[str, Tuple[str, str]]:
         log("Ошибка при FS сканировании modules:", e)
     return commands
 
-# Build MODULE_COMMANDS using backend discovery first, then fs fallback
-MODULE_COMMANDS = build_module_commands_from_backend()
-if not MODULE_COMMANDS:
+# ---- cache + background refresh ----
+#
+# Startup never waits for the backend: MODULE_COMMANDS comes from the cache file
+# (or the instant fs-scan), module_refresher() re-probes the backend in the
+# background every BOT_MODULES_TTL seconds and swaps the dict in place of the
+# old one — handlers always read the current global, no restart needed.
+
+_REFRESH_NOW = threading.Event()
+
+def load_module_cache() -> Tuple[Dict[str, Tuple[str, str]], float]:
+    """(commands, saved_at) from BOT_MODULES_CACHE; ({}, 0) if missing or for another backend."""
+    try:
+        with open(BOT_MODULES_CACHE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("backend") != BACKEND_URL:
+            return {}, 0.0
+        commands = {cmd: (ep, desc) for cmd, (ep, desc) in (data.get("commands") or {}).items()}
+        return commands, float(data.get("ts") or 0)
+    except FileNotFoundError:
+        return {}, 0.0
+    except Exception as e:
+        log("Не удалось прочитать кэш модулей:", e)
+        return {}, 0.0
+
+def save_module_cache(commands: Dict[str, Tuple[str, str]]):
+    data = {"ts": time.time(), "backend": BACKEND_URL, "commands": commands}
+    tmp = BOT_MODULES_CACHE + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, BOT_MODULES_CACHE)  # readers never see a half-written file
+    except Exception as e:
+        log("Не удалось сохранить кэш модулей:", e)
+
+def set_module_commands(commands: Dict[str, Tuple[str, str]], source: str):
+    """Hot-swap MODULE_COMMANDS (one reference assignment — safe for running workers)."""
+    global MODULE_COMMANDS
+    old = MODULE_COMMANDS
+    if commands == old:
+        return
+    added = sorted(set(commands) - set(old))
+    removed = sorted(set(old) - set(commands))
+    changed = sorted(c for c in set(commands) & set(old) if commands[c] != old[c])
+    MODULE_COMMANDS = commands
+    log(f"module commands updated from {source}: +{added} -{removed} ~{changed}")
+
+def refresh_module_commands() -> bool:
+    """Re-probe the backend; on success swap and persist. False — backend unreachable, keep current."""
+    t0 = time.time()
+    commands = build_module_commands_from_backend()
+    if not commands:
+        return False
+    set_module_commands(commands, "backend")
+    save_module_cache(commands)
+    log(f"module discovery done in {time.time() - t0:.1f}s: {len(commands)} commands")
+    return True
+
+def request_module_refresh():
+    """Ask the refresher to re-probe now (e.g. user sent an unknown module command)."""
+    _REFRESH_NOW.set()
+
+def module_refresher(cached_at: float):
+    next_at = cached_at + BOT_MODULES_TTL
+    while True:
+        _REFRESH_NOW.wait(max(0.0, next_at - time.time()))
+        _REFRESH_NOW.clear()
+        try:
+            ok = refresh_module_commands()
+        except Exception as e:
+            log("Ошибка обновления модулей:", e)
+            ok = False
+        # backend down — try again sooner than the full TTL
+        next_at = time.time() + (BOT_MODULES_TTL if ok else min(BOT_MODULES_TTL, 60))
+
+def start_module_refresher():
+    threading.Thread(target=module_refresher, args=(_MODULES_CACHED_AT,), name="module-refresher", daemon=True).start()
+
+MODULE_COMMANDS, _MODULES_CACHED_AT = load_module_cache()
+if MODULE_COMMANDS:
+    log(f"Module commands from cache ({int(time.time() - _MODULES_CACHED_AT)}s old):", MODULE_COMMANDS)
+else:
     MODULE_COMMANDS = find_modules_commands_fs()
-log("Discovered module commands:", MODULE_COMMANDS)
+    log("Module commands from fs-scan (backend discovery runs in background):", MODULE_COMMANDS)
 
 # Legacy trainer commands removed - no longer used
 
@@ -275,13 +406,14 @@ def handle_modules_menu(chat_id: int, session: dict):
 def handle_module_command(chat_id: int, session: dict, cmd: str):
     endpoint_desc = MODULE_COMMANDS.get(cmd)
     if not endpoint_desc:
+        request_module_refresh()  # may have been attached since the last probe
         send_message(chat_id, "Модульная команда не найдена или не подключена.")
         return
     endpoint, desc = endpoint_desc
     url = BACKEND_URL + endpoint
     log("CALL MODULE", cmd, url)
     try:
-        resp = requests.post(url, json={"chat_id": chat_id}, timeout=15)
+        resp = BACKEND_HTTP.post(url, json={"chat_id": chat_id}, timeout=15)
         resp.raise_for_status()
         try:
             data = resp.json()
@@ -364,28 +496,215 @@ def handle_update(update: dict):
     # No active session mode anymore - just guide user
     send_message(chat_id, "Используй /start чтобы начать или /modules чтобы выбрать модуль.")
 
+# ===================== DISPATCHER =====================
+#
+# Each handler blocks on the backend (LLM reply can take 10+ s), so updates are
+# handed to a pool of worker threads: different chats run in parallel, updates
+# of one chat run strictly one after another, in arrival order.
+
+def update_chat_id(update: dict) -> Any:
+    """Ordering key of an update: its chat id (updates without a chat get their own key)."""
+    for kind in ("message", "edited_message", "callback_query"):
+        obj = update.get(kind) or {}
+        chat = (obj.get("message") or {}).get("chat") if kind == "callback_query" else obj.get("chat")
+        if chat and chat.get("id") is not None:
+            return chat["id"]
+    return ("update", update.get("update_id"))
+
+
+class ChatDispatcher:
+    """
+    Per-chat FIFO queues served by a fixed pool of worker threads.
+
+    - a chat is owned by at most one worker at a time -> per-chat ordering
+    - after one update the chat goes to the back of the ready queue, so a busy
+      chat does not starve the others
+    - backpressure: submit() blocks while max_pending updates are queued
+      (the poller stops fetching, Telegram keeps the rest on its side);
+      a single chat may queue up to max_per_chat updates, extra ones are
+      dropped and on_overflow(chat_id) is called once until the chat catches up
+    """
+
+    def __init__(self, handler: Callable[[dict], None], workers: int = 8, max_pending: int = 500,
+                 max_per_chat: int = 20, on_overflow: Optional[Callable[[Any], None]] = None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.max_per_chat = max(1, max_per_chat)
+        self.on_overflow = on_overflow
+        self._queues: Dict[Any, deque] = {}  # chat -> updates waiting for that chat
+        self._ready: deque = deque()         # chats with work and no worker yet
+        self._owned = set()                  # chats in _ready or being handled
+        self._overflowed = set()
+        self._pending = 0
+        self._busy = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.stats = {"processed": 0, "errors": 0, "dropped": 0, "backpressure": 0, "max_pending": 0}
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"bot-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def submit(self, update: dict) -> bool:
+        """Queue an update; blocks while the dispatcher is full. False — dropped (chat queue full)."""
+        chat = update_chat_id(update)
+        queued = notify = False
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self.stats["backpressure"] += 1
+                while self._pending >= self.max_pending and not self._stopping:
+                    self._cond.wait()
+            q = self._queues.setdefault(chat, deque())
+            if len(q) >= self.max_per_chat:
+                self.stats["dropped"] += 1
+                notify = chat not in self._overflowed
+                self._overflowed.add(chat)
+            else:
+                q.append(update)
+                queued = True
+                self._pending += 1
+                self.stats["max_pending"] = max(self.stats["max_pending"], self._pending)
+                if chat not in self._owned:
+                    self._owned.add(chat)
+                    self._ready.append(chat)
+                    self._cond.notify_all()
+        if notify and self.on_overflow is not None:
+            self.on_overflow(chat)
+        return queued
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopping:
+                    self._cond.wait()
+                if not self._ready:
+                    return  # stopping and nothing left
+                chat = self._ready.popleft()
+                update = self._queues[chat].popleft()
+                self._busy += 1
+            try:
+                self.handler(update)
+                ok = True
+            except Exception as e:
+                log("Ошибка обработки апдейта", update.get("update_id"), "chat", chat, ":", e)
+                ok = False
+            with self._cond:
+                self._busy -= 1
+                self._pending -= 1
+                self.stats["processed" if ok else "errors"] += 1
+                if self._queues[chat]:
+                    self._ready.append(chat)  # next update of this chat, behind the others
+                else:
+                    del self._queues[chat]
+                    self._owned.discard(chat)
+                    self._overflowed.discard(chat)
+                self._cond.notify_all()
+
+    def stop(self, timeout: float = 30.0):
+        """Finish queued updates (up to timeout) and stop the workers."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self.stats, pending=self._pending, busy=self._busy, chats=len(self._queues))
+
+
+def notify_overflow(chat_id: Any):
+    if isinstance(chat_id, int):
+        send_message(chat_id, "⏳ Слишком много сообщений подряд — дождись ответа на предыдущие.")
+
+# ===================== UPDATE SOURCES =====================
+#
+# poll  — getUpdates long polling (default)
+# inbox — TG_INBOX_DRAINER=bot: Telegram posts to the backend's
+#   /telegram_bot/v1/webhook, which only queues updates
+#   (integrations/telegram_bot/v1/inbox.py, SQLite); any number of bot processes
+#   drain that queue. Each update_id is handled once, updates of one chat in
+#   order. The same TG_INBOX_DRAINER=bot keeps the backend's own workers off,
+#   so there is exactly one kind of drainer.
+
+def poll_updates(dispatcher: ChatDispatcher, offset: Optional[int]) -> Optional[int]:
+    resp = TG_HTTP.get(BASE_URL + "/getUpdates", params={"timeout": 50, "offset": offset}, timeout=70)
+    data = resp.json()
+    for upd in data.get("result", []):
+        # blocks while the dispatcher is full — that is the backpressure
+        dispatcher.submit(upd)
+        offset = upd["update_id"] + 1
+    return offset
+
+def make_inbox_handler(inbox) -> Callable[[dict], None]:
+    """handle_update + report the result to the inbox (an error -> retried later)."""
+    def handle(update: dict):
+        uid = update["update_id"]
+        try:
+            handle_update(update)
+        except Exception as e:
+            inbox.done(uid, f"{type(e).__name__}: {e}")
+            raise
+        inbox.done(uid)
+    return handle
+
+def drain_inbox(dispatcher: ChatDispatcher, inbox):
+    """Hand every claimable update to the dispatcher; nap when the queue is empty."""
+    claimed = inbox.claim()
+    if claimed is None:
+        time.sleep(BOT_INBOX_POLL)
+        return
+    while claimed is not None:
+        # the inbox gives out one update per chat at a time, so per-chat queues never overflow
+        dispatcher.submit(claimed[1])
+        claimed = inbox.claim()
+
 # ===================== MAIN LOOP =====================
 
 def main():
     log("✅ simple_telegram_bot started. BACKEND_URL:", BACKEND_URL)
     log("Telegram token present. Discovered module commands:", MODULE_COMMANDS)
+    start_module_refresher()
+    inbox = None
+    handler = handle_update
+    if BOT_UPDATES == "inbox":
+        from integrations.telegram_bot.v1.inbox import get_inbox
+        inbox = get_inbox()
+        handler = make_inbox_handler(inbox)
+    dispatcher = ChatDispatcher(
+        handler, BOT_WORKERS, BOT_QUEUE_MAX, BOT_CHAT_QUEUE_MAX, on_overflow=notify_overflow
+    ).start()
+    log(f"updates: {BOT_UPDATES}; dispatcher: workers={BOT_WORKERS}, queue_max={BOT_QUEUE_MAX}, "
+        f"chat_queue_max={BOT_CHAT_QUEUE_MAX}")
     offset = None
     last_heartbeat = time.time()
-    while True:
-        try:
-            resp = requests.get(BASE_URL + "/getUpdates", params={"timeout": 50, "offset": offset}, timeout=70)
-            data = resp.json()
-            for upd in data.get("result", []):
-                offset = upd["update_id"] + 1
-                handle_update(upd)
-        except Exception as e:
-            log("Ошибка в основном цикле:", e)
-            time.sleep(3)
-        now = time.time()
-        if now - last_heartbeat > 60:
-            active_chats = len(SESSIONS)
-            log(f"heartbeat: active_chats={active_chats}, last_activity_ago={int(now-LAST_ACTIVITY_TS)}s")
-            last_heartbeat = now
+    try:
+        while True:
+            try:
+                if inbox is not None:
+                    drain_inbox(dispatcher, inbox)
+                else:
+                    offset = poll_updates(dispatcher, offset)
+            except Exception as e:
+                log("Ошибка в основном цикле:", e)
+                time.sleep(3)
+            now = time.time()
+            if now - last_heartbeat > 60:
+                active_chats = len(SESSIONS)
+                log(f"heartbeat: active_chats={active_chats}, last_activity_ago={int(now-LAST_ACTIVITY_TS)}s,",
+                    "dispatcher:", dispatcher.snapshot(),
+                    "outbox:", OUTBOX.stats() if OUTBOX is not None else None)
+                last_heartbeat = now
+    finally:
+        dispatcher.stop()
+        if OUTBOX is not None:
+            OUTBOX.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,21 +1,27 @@
 
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from .engine import DragonEngine
 
 router = APIRouter(prefix="/sleeping_dragon/v4", tags=["sleeping_dragon"])
 
 @router.post("/start/{sid}")
 async def start(sid:str):
-    eng=DragonEngine(sid)
+    eng=await DragonEngine.aopen(sid)
     eng.reset()
+    await eng.asave()
     return {"ok":True,"sid":sid}
 
 @router.post("/handle/{sid}")
 async def handle(sid:str, text:str):
-    eng=DragonEngine(sid)
-    return eng.handle(text)
+    eng=await DragonEngine.aopen(sid)
+    # handle() синхронно ходит в LLM — в пул потоков, чтобы не держать event loop
+    result = await run_in_threadpool(eng.handle, text)
+    await eng.asave()
+    return result
 
 @router.get("/snapshot/{sid}")
 async def snapshot(sid:str):
-    eng=DragonEngine(sid)
+    eng=await DragonEngine.aopen(sid)
+    await eng.asave()
     return eng.snapshot()
@@ -1,7 +1,19 @@
 from fastapi import FastAPI
+from core.state.v1 import store as state_store
+from core.state.v1 import close_async_stores
 
 app = FastAPI(title="salesbot", version="v1-final")
 
+# общий пул соединений к salesbot.db: открываем на старте, закрываем на остановке
+@app.on_event("startup")
+async def _state_startup():
+    state_store.on_startup()
+
+@app.on_event("shutdown")
+async def _state_shutdown():
+    await close_async_stores()
+    state_store.on_shutdown()
+
 # базовый healthcheck
 @app.get("/api/public/v1/health")
 async def root_health():
@@ -1,15 +1,16 @@
 import os
-from aiogram import Bot
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import executor
 from api.core.registry import ModuleRegistry
 from telegram.autoload import autoload_telegram_handlers
+# отправки бота — через общую очередь с лимитами Telegram
+from integrations.telegram_bot.v1.outbox import aiogram_bot
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN required")
 
-bot = Bot(token=TELEGRAM_TOKEN)
+bot = aiogram_bot(TELEGRAM_TOKEN)
 dp = Dispatcher(bot)
 registry = ModuleRegistry()
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Тест фоновой обратной связи Спящего Дракона.
+Два хода подряд: разбор первого хода не должен затираться сохранением второго.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+
+class _SlowLLM:
+    """Фейковый LLM: ответ клиента — 0.5 с, разбор наставника — 0.2 с"""
+
+    async def achat(self, messages, **kwargs):
+        if not messages[-1]["content"].startswith("Проанализируй"):
+            await asyncio.sleep(0.5)
+            return "Клиент: подумаю"
+        await asyncio.sleep(0.2)
+        return "FEEDBACK"
+
+
+async def _two_turns():
+    from core.state.v1 import close_async_stores
+    try:
+        return await _run_turns()
+    finally:
+        await close_async_stores()  # соединения aiosqlite держат процесс
+
+
+async def _run_turns():
+    from modules.sleeping_dragon.v1.engine import SleepingDragonEngine
+
+    async def turn(text):
+        engine = await SleepingDragonEngine.aopen("fb-test")
+        engine.llm = _SlowLLM()
+        result = await engine.ahandle(text)
+        await engine.asave()
+        return result
+
+    engine = await SleepingDragonEngine.aopen("fb-test")
+    engine.reset()
+    await engine.asave()
+
+    await turn("Добрый день! Как вам тексты?")
+    await turn("Напомню о себе: демо готово")  # сразу, пока пишется разбор первого
+    await SleepingDragonEngine.wait_feedback("fb-test", 5)
+
+    feedback = (await SleepingDragonEngine.aopen("fb-test")).state.feedback
+    header = await SleepingDragonEngine.aheader("fb-test")
+    return feedback, header["feedback"]
+
+
+def test_feedback_survives_back_to_back_turns():
+    """Оба разбора на месте после двух ходов подряд"""
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())  # salesbot.db — во временной папке
+    try:
+        feedback, header_feedback = asyncio.run(_two_turns())
+    finally:
+        os.chdir(cwd)
+    assert feedback == ["FEEDBACK", "FEEDBACK"], feedback
+    assert header_feedback == ["FEEDBACK", "FEEDBACK"], header_feedback
+    print(f"✅ sleeping_dragon.feedback: {feedback}")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    test_feedback_survives_back_to_back_turns()
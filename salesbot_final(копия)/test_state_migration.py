@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Тест хранения сессий: миграция состояний из kv в sessions/turns и загрузка
+истории окном (STATE_HISTORY_WINDOW).
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class _State:
+    stage: str
+    history: list
+    metadata: dict
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _legacy_db(path, layout):
+    """Файл БД в старом формате: состояние движка одним JSON в kv"""
+    blob = json.dumps({
+        "stage": "offer",
+        "history": [{"role": "user", "content": f"msg {i}"} for i in range(60)],
+        "metadata": {"client": "Анна"},
+    }, ensure_ascii=False)
+    conn = sqlite3.connect(path)
+    if layout == "core_db":
+        # kv(k, v) старого core/db/v1
+        conn.execute("CREATE TABLE kv (k TEXT PRIMARY KEY, v TEXT)")
+        conn.executemany("INSERT INTO kv VALUES (?, ?)", [("mp:42", blob), ("settings", "plain")])
+    else:
+        conn.execute("CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT, ts REAL)")
+        conn.executemany("INSERT INTO kv VALUES (?, ?, 0)", [("mp:42", blob), ("settings", "plain")])
+    conn.commit()
+    conn.close()
+
+
+def _check(layout):
+    from core.state.v1 import Session, close_stores, get_store, turn_count
+
+    path = os.path.join(tempfile.mkdtemp(), "salesbot.db")
+    _legacy_db(path, layout)
+    try:
+        store = get_store(path)
+        # состояние уехало в sessions/turns, прочие ключи kv на месте
+        assert store.get("mp:42") is None
+        assert store.get("settings") == "plain"
+
+        session = Session("mp:42", path, window=50)
+        state = session.load_state(lambda d: _State(**d))
+        assert state.stage == "offer" and state.metadata == {"client": "Анна"}
+        assert len(state.history) == 50
+        assert state.history[0]["content"] == "msg 10" and state.history[-1]["content"] == "msg 59"
+        assert turn_count(state.history) == 60
+
+        # новый ход дописывается после 60-го, окно сдвигается
+        state.history.append({"role": "user", "content": "msg 60"})
+        session.save_state(state)
+        reloaded = Session("mp:42", path, window=50).load_state(lambda d: _State(**d))
+        assert len(reloaded.history) == 50
+        assert reloaded.history[-1]["content"] == "msg 60"
+        assert turn_count(reloaded.history) == 61
+
+        # полная история — постранично через turns()
+        assert [seq for seq, _ in session.turns(limit=3)] == [60, 59, 58]
+    finally:
+        close_stores()
+    print(f"✅ state.migration ({layout}): 61 ход, в окне 50")
+
+
+def test_kv_blob_migrates_to_sessions():
+    _check("kv")
+
+
+def test_core_db_kv_migrates_to_sessions():
+    _check("core_db")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    test_kv_blob_migrates_to_sessions()
+    test_core_db_kv_migrates_to_sessions()